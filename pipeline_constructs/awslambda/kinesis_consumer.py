@@ -0,0 +1,124 @@
+import json
+
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_kinesis as kinesis
+import aws_cdk.aws_lambda as lambda_
+import aws_cdk.aws_lambda_event_sources as event_sources
+import aws_cdk.aws_s3 as s3
+import aws_cdk.aws_sqs as sqs
+from aws_cdk import Duration
+from constructs import Construct
+
+# Output formats which can be written by the Lambda consumer
+SUPPORTED_OUTPUT_FORMATS = ["json", "parquet"]
+
+
+class KinesisConsumer(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            function_name: str,
+            code_path: str,
+            layer_arn: str,
+            memory_size: int,
+            batch_size: int,
+            max_batching_window: int,
+            data_stream: kinesis.IStream,
+            output_bucket: s3.IBucket,
+            output_format: str,
+            output_compression: str,
+            selected_fields_parameter_name: str,
+            selected_fields_ttl: int,
+            schema_bucket: s3.IBucket,
+            schema_key: str,
+            output_columns: list,
+            required_fields: list
+    ):
+        super().__init__(scope, construct_id)
+
+        if output_format not in SUPPORTED_OUTPUT_FORMATS:
+            raise ValueError("Output format '{}' is not supported by the Lambda consumer, expected one of {}".format(
+                output_format, ", ".join(SUPPORTED_OUTPUT_FORMATS)))
+
+        self.function = lambda_.Function(
+            self,
+            "Function",
+            function_name=function_name,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            handler="lambda_consumer.handler",
+            code=lambda_.Code.from_asset(code_path),
+            layers=[
+                lambda_.LayerVersion.from_layer_version_arn(self, "PyArrowLayer", layer_arn)
+            ],
+            memory_size=memory_size,
+            timeout=Duration.minutes(5),
+            environment={
+                "SELECTED_FIELDS_PARAMETER": selected_fields_parameter_name,
+                "SELECTED_FIELDS_TTL": str(selected_fields_ttl),
+                "SCHEMA_BUCKET": schema_bucket.bucket_name,
+                "SCHEMA_KEY": schema_key,
+                "OUTPUT_BUCKET": output_bucket.bucket_name,
+                "OUTPUT_FORMAT": output_format,
+                "OUTPUT_COMPRESSION": output_compression,
+                # Compact, the environment variables of a function are limited to 4 KB
+                "OUTPUT_COLUMNS": json.dumps(output_columns, separators=(",", ":")),
+                "REQUIRED_FIELDS": json.dumps(required_fields, separators=(",", ":"))
+            }
+        )
+
+        self.function.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "ssm:GetParameter"
+                ],
+                resources=[
+                    "arn:{}:ssm:{}:{}:parameter/{}".format(
+                        self.function.stack.partition,
+                        self.function.stack.region,
+                        self.function.stack.account,
+                        selected_fields_parameter_name
+                    )
+                ]
+            )
+        )
+
+        schema_bucket.grant_read(self.function, schema_key)
+        output_bucket.grant_put(self.function)
+
+        # PyArrow checks the output bucket before writing into it
+        self.function.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "s3:ListBucket"
+                ],
+                resources=[
+                    output_bucket.bucket_arn
+                ]
+            )
+        )
+
+        # Invalid messages are dead letters of the function, a batch which still fails after the retries, e.g. when S3
+        # is unavailable, is skipped and the Kinesis positions of its records are sent to the failure queue
+        self.failure_queue = sqs.Queue(
+            self,
+            "FailureQueue",
+            queue_name="{}-failures".format(function_name),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.SQS_MANAGED
+        )
+
+        self.function.add_event_source(
+            event_sources.KinesisEventSource(
+                data_stream,
+                starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+                batch_size=batch_size,
+                max_batching_window=Duration.seconds(max_batching_window),
+                retry_attempts=3,
+                bisect_batch_on_error=True,
+                on_failure=event_sources.SqsDlq(self.failure_queue)
+            )
+        )
@@ -0,0 +1,91 @@
+import aws_cdk.aws_events as events
+import aws_cdk.aws_events_targets as targets
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_kinesis as kinesis
+import aws_cdk.aws_lambda as lambda_
+from aws_cdk import Duration
+from constructs import Construct
+
+
+class ShardScaler(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            function_name: str,
+            code_path: str,
+            schedule: str,
+            data_stream: kinesis.IStream,
+            min_shards: int,
+            max_shards: int,
+            scale_out_utilization: float,
+            scale_in_utilization: float,
+            target_utilization: float
+    ):
+        super().__init__(scope, construct_id)
+
+        if not 1 <= min_shards <= max_shards:
+            raise ValueError("Expected 1 <= min shard count <= max shard count, got {} and {}".format(
+                min_shards, max_shards))
+        if not 0 < scale_in_utilization < target_utilization < scale_out_utilization <= 1:
+            raise ValueError("Expected 0 < scale-in < target < scale-out utilization <= 1, got {}, {} and {}".format(
+                scale_in_utilization, target_utilization, scale_out_utilization))
+
+        self.function = lambda_.Function(
+            self,
+            "Function",
+            function_name=function_name,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            handler="shard_scaler.handler",
+            code=lambda_.Code.from_asset(code_path),
+            memory_size=128,
+            timeout=Duration.minutes(1),
+            # Only one scaler may run at a time, an overlapping run would scale on the same metrics twice
+            reserved_concurrent_executions=1,
+            environment={
+                "STREAM_NAME": data_stream.stream_name,
+                "MIN_SHARDS": str(min_shards),
+                "MAX_SHARDS": str(max_shards),
+                "SCALE_OUT_UTILIZATION": str(scale_out_utilization),
+                "SCALE_IN_UTILIZATION": str(scale_in_utilization),
+                "TARGET_UTILIZATION": str(target_utilization)
+            }
+        )
+
+        self.function.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "kinesis:DescribeStreamSummary",
+                    "kinesis:UpdateShardCount",
+                    "kinesis:ListTagsForStream",
+                    "kinesis:AddTagsToStream"
+                ],
+                resources=[
+                    data_stream.stream_arn
+                ]
+            )
+        )
+
+        self.function.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "cloudwatch:GetMetricData"
+                ],
+                resources=[
+                    "*"
+                ]
+            )
+        )
+
+        self.rule = events.Rule(
+            self,
+            "Schedule",
+            rule_name="{}-schedule".format(function_name),
+            schedule=events.Schedule.expression(schedule),
+            targets=[
+                targets.LambdaFunction(self.function)
+            ]
+        )
@@ -0,0 +1,97 @@
+import aws_cdk.aws_glue as glue
+import aws_cdk.aws_iam as iam
+from constructs import Construct
+
+
+class CompactionJob(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            job_name: str,
+            worker_type: str,
+            number_of_workers: int,
+            schedule: str,
+            job_bucket_arn: str,
+            job_bucket_name: str,
+            script_location: str,
+            job_params: dict,
+            output_bucket_arn: str
+    ):
+        super().__init__(scope, construct_id)
+
+        job_role = iam.Role(
+            self,
+            "IamCompactionJobRole",
+            role_name=job_name,
+            assumed_by=iam.ServicePrincipal("glue.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSGlueServiceRole")
+            ],
+            inline_policies={
+                "AmazonS3ReadWriteObjectsPermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "s3:ListBucket",
+                                "s3:*Object*"
+                            ],
+                            resources=[
+                                job_bucket_arn,
+                                "{}/*".format(job_bucket_arn),
+                                output_bucket_arn,
+                                "{}/*".format(output_bucket_arn)
+                            ]
+                        )
+                    ]
+                )
+            }
+        )
+
+        self.job = glue.CfnJob(
+            self,
+            "Job",
+            name=job_name,
+            role=job_role.role_name,
+            glue_version="4.0",
+            command=glue.CfnJob.JobCommandProperty(
+                name="glueetl",
+                script_location=script_location,
+                python_version="3"
+            ),
+            execution_property=glue.CfnJob.ExecutionPropertyProperty(
+                max_concurrent_runs=1
+            ),
+            default_arguments={
+                "--enable-metrics": "true",
+                "--enable-continuous-cloudwatch-log": "true",
+                "--job-bookmark-option": "job-bookmark-disable",
+                "--job-language": "python",
+                "--TempDir": "s3://{}/temporary/".format(job_bucket_name)
+            } | job_params,
+            # A retry completes a swap of compacted files which failed half way from its manifest
+            max_retries=1,
+            worker_type=worker_type,
+            number_of_workers=number_of_workers,
+            execution_class="STANDARD"
+        )
+
+        self.job.node.add_dependency(job_role)
+
+        self.trigger = glue.CfnTrigger(
+            self,
+            "Trigger",
+            name="{}-schedule".format(job_name),
+            type="SCHEDULED",
+            schedule=schedule,
+            start_on_creation=True,
+            actions=[
+                glue.CfnTrigger.ActionProperty(
+                    job_name=job_name
+                )
+            ]
+        )
+
+        self.trigger.node.add_dependency(self.job)
@@ -1,8 +1,5 @@
 import aws_cdk.aws_glue as glue
 import aws_cdk.aws_iam as iam
-import aws_cdk.aws_s3 as s3
-import aws_cdk.aws_s3_deployment as s3deploy
-from aws_cdk import RemovalPolicy
 from aws_cdk import Stack
 from constructs import Construct
 
@@ -18,60 +15,16 @@ class EtlJob(Construct):
             number_of_workers: int,
             max_concurrent_runs: int,
             job_bucket_name: str,
-            job_bucket_deployment_path: str,
+            job_bucket_arn: str,
             script_location: str,
             job_params: dict,
             kinesis_stream_arn: str,
-            output_bucket_arn: str
+            output_bucket_arn: str,
+            selected_fields_parameter_name: str,
+            raw_archive_bucket_arn: str = None
     ):
         super().__init__(scope, construct_id)
 
-        job_assets_bucket = s3.Bucket(
-            self,
-            "S3JobAssetsBucket",
-            bucket_name=job_bucket_name,
-            block_public_access=s3.BlockPublicAccess(
-                block_public_acls=False,
-                block_public_policy=True,
-                ignore_public_acls=True,
-                restrict_public_buckets=True
-            ),
-            encryption=s3.BucketEncryption.S3_MANAGED,
-            enforce_ssl=True,
-            versioned=False,
-            removal_policy=RemovalPolicy.DESTROY,
-            auto_delete_objects=True
-        )
-
-        job_assets_bucket.add_to_resource_policy(
-            permission=iam.PolicyStatement(
-                effect=iam.Effect.ALLOW,
-                principals=[
-                    iam.ServicePrincipal('glue.amazonaws.com')
-                ],
-                actions=[
-                    "s3:ListBucket",
-                    "s3:*Object*"
-                ],
-                resources=[
-                    job_assets_bucket.bucket_arn,
-                    "{}/*".format(job_assets_bucket.bucket_arn)
-                ],
-                conditions={
-                    "StringEquals": {"aws:SourceAccount": Stack.of(self).account}
-                }
-            )
-        )
-
-        job_assets_bucket_deployment = s3deploy.BucketDeployment(
-            self,
-            "S3JobAssetsBucketDeployment",
-            destination_bucket=job_assets_bucket,
-            sources=[
-                s3deploy.Source.asset(job_bucket_deployment_path)
-            ]
-        )
-
         job_role = iam.Role(
             self,
             "IamStreamingJobRole",
@@ -87,7 +40,8 @@ class EtlJob(Construct):
                             effect=iam.Effect.ALLOW,
                             actions=[
                                 "kinesis:GetShardIterator",
-                                "kinesis:GetRecords"
+                                "kinesis:GetRecords",
+                                "kinesis:DescribeStream"
                             ],
                             resources=[
                                 kinesis_stream_arn
@@ -105,6 +59,38 @@ class EtlJob(Construct):
                         )
                     ]
                 ),
+                "AmazonCloudWatchPutMetricDataPermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "cloudwatch:PutMetricData",
+                                "cloudwatch:GetMetricStatistics"
+                            ],
+                            resources=[
+                                "*"
+                            ]
+                        )
+                    ]
+                ),
+                "AmazonSsmGetParameterPermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "ssm:GetParameter"
+                            ],
+                            resources=[
+                                "arn:{}:ssm:{}:{}:parameter/{}".format(
+                                    Stack.of(self).partition,
+                                    Stack.of(self).region,
+                                    Stack.of(self).account,
+                                    selected_fields_parameter_name
+                                )
+                            ]
+                        )
+                    ]
+                ),
                 "AmazonS3ReadWriteObjectsPermission": iam.PolicyDocument(
                     statements=[
                         iam.PolicyStatement(
@@ -114,11 +100,14 @@ class EtlJob(Construct):
                                 "s3:*Object*"
                             ],
                             resources=[
-                                job_assets_bucket.bucket_arn,
-                                "{}/*".format(job_assets_bucket.bucket_arn),
+                                job_bucket_arn,
+                                "{}/*".format(job_bucket_arn),
                                 output_bucket_arn,
                                 "{}/*".format(output_bucket_arn)
-                            ]
+                            ] + ([
+                                raw_archive_bucket_arn,
+                                "{}/*".format(raw_archive_bucket_arn)
+                            ] if raw_archive_bucket_arn else [])
                         )
                     ]
                 )
@@ -130,7 +119,8 @@ class EtlJob(Construct):
             "Job",
             name=job_name,
             role=job_role.role_name,
-            glue_version="3.0",
+            # Glue 4.0 is the first version starting Kinesis sources at a timestamp
+            glue_version="4.0",
             command=glue.CfnJob.JobCommandProperty(
                 name="gluestreaming",
                 script_location=script_location,
@@ -142,13 +132,13 @@ class EtlJob(Construct):
             default_arguments={
                 "--enable-metrics": "true",
                 "--enable-spark-ui": "true",
-                "--spark-event-logs-path": "s3://{}/sparkHistoryLogs/".format(job_assets_bucket.bucket_name),
+                "--spark-event-logs-path": "s3://{}/sparkHistoryLogs/".format(job_bucket_name),
                 "--enable-job-insights": "false",
                 "--enable-glue-datacatalog": "true",
                 "--enable-continuous-cloudwatch-log": "true",
                 "--job-bookmark-option": "job-bookmark-disable",
                 "--job-language": "python",
-                "--TempDir": "s3://{}/temporary/".format(job_assets_bucket.bucket_name)
+                "--TempDir": "s3://{}/temporary/".format(job_bucket_name)
             } | job_params,
             max_retries=3,
             worker_type=worker_type,
@@ -156,5 +146,4 @@ class EtlJob(Construct):
             execution_class="STANDARD"
         )
 
-        self.job.node.add_dependency(job_assets_bucket_deployment)
         self.job.node.add_dependency(job_role)
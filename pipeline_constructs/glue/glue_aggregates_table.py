@@ -0,0 +1,130 @@
+import aws_cdk.aws_glue as glue
+from aws_cdk import Stack
+from constructs import Construct
+from pipeline_constructs.glue.glue_output_database import OUTPUT_FORMATS
+
+# Column types of the aggregate functions, the Glue ETL Job casts the inputs of avg, min, max and sum to double
+AGGREGATE_TYPES = {
+    "count": "bigint",
+    "count_distinct": "bigint",
+    "avg": "double",
+    "min": "double",
+    "max": "double",
+    "sum": "double"
+}
+
+
+class AggregatesTable(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            database_name: str,
+            table_name: str,
+            bucket_name: str,
+            output_format: str,
+            output_compression: str,
+            aggregates_config: dict,
+            partition_projection_start_date: str = "2023-01-01"
+    ):
+        super().__init__(scope, construct_id)
+
+        storage = OUTPUT_FORMATS[output_format]
+
+        aggregates = [(name, spec) for entry in aggregates_config["aggregates"] for name, spec in entry.items()]
+        for name, spec in aggregates:
+            if spec.get("function") not in AGGREGATE_TYPES:
+                raise ValueError("Unsupported function '{}' of aggregate '{}', expected one of {}".format(
+                    spec.get("function"), name, ", ".join(AGGREGATE_TYPES)))
+            # The distinct values of the open windows are kept by the Glue ETL Job, so their number must be capped
+            if spec["function"] == "count_distinct" and not spec.get("max-distinct"):
+                raise ValueError("Aggregate '{}' needs a 'max-distinct'".format(name))
+
+        columns = [
+            {
+                "name": aggregates_config["key"],
+                "type": aggregates_config["key-type"]
+            },
+            {
+                "name": "window_start",
+                "type": "timestamp"
+            },
+            {
+                "name": "window_end",
+                "type": "timestamp"
+            }
+        ] + [
+            {
+                "name": name,
+                "type": AGGREGATE_TYPES[spec["function"]]
+            }
+            for name, spec in aggregates
+        ]
+
+        location = "s3://{}/aggregates/".format(bucket_name)
+
+        serde_parameters = {
+            "serialization.format": "1"
+        }
+
+        # The aggregates are partitioned by the window and the date of the window start
+        table_parameters = {
+            "compressionType": output_compression,
+            "classification": output_format,
+            "EXTERNAL": "TRUE",
+            "typeOfData": "file",
+            "projection.enabled": "true",
+            "projection.window_name.type": "enum",
+            "projection.window_name.values": ",".join(entry["name"] for entry in aggregates_config["windows"]),
+            "projection.event_date.type": "date",
+            "projection.event_date.format": "yyyy-MM-dd",
+            "projection.event_date.range": "{},NOW".format(partition_projection_start_date),
+            "projection.event_date.interval": "1",
+            "projection.event_date.interval.unit": "DAYS",
+            "storage.location.template": location + "window_name=${window_name}/event_date=${event_date}/"
+        }
+
+        if output_format == "json":
+            serde_parameters["paths"] = ",".join(column["name"] for column in columns)
+        elif output_format == "parquet":
+            table_parameters["parquet.compression"] = output_compression.upper()
+        elif output_format == "orc":
+            table_parameters["orc.compress"] = output_compression.upper()
+
+        self.table = glue.CfnTable(
+            self,
+            "GlueAggregatesTable",
+            catalog_id=Stack.of(self).account,
+            database_name=database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=table_name,
+                description="The table containing the windowed KPI aggregates from the S3 bucket {}".format(
+                    bucket_name),
+                retention=0,
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    columns=columns,
+                    location=location,
+                    input_format=storage["input_format"],
+                    output_format=storage["output_format"],
+                    compressed=output_compression != "none",
+                    number_of_buckets=-1,
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library=storage["serialization_library"],
+                        parameters=serde_parameters
+                    ),
+                    stored_as_sub_directories=False
+                ),
+                partition_keys=[
+                    {
+                        "name": "window_name",
+                        "type": "string"
+                    },
+                    {
+                        "name": "event_date",
+                        "type": "string"
+                    }
+                ],
+                parameters=table_parameters
+            )
+        )
@@ -2,6 +2,28 @@ import aws_cdk.aws_glue as glue
 from aws_cdk import Stack
 from constructs import Construct
 
+# Hive types of the Glue catalog for the primitive types of a Spark schema
+_HIVE_TYPES = {
+    "long": "bigint",
+    "integer": "int",
+    "short": "smallint",
+    "byte": "tinyint"
+}
+
+
+def to_hive_type(data_type):
+    """
+    Convert a data type of a Spark schema in its JSON representation into a Hive type string.
+    """
+    if isinstance(data_type, str):
+        return _HIVE_TYPES.get(data_type, data_type)
+    if data_type["type"] == "array":
+        return "array<{}>".format(to_hive_type(data_type["elementType"]))
+    if data_type["type"] == "map":
+        return "map<{},{}>".format(to_hive_type(data_type["keyType"]), to_hive_type(data_type["valueType"]))
+    return "struct<{}>".format(",".join(
+        "{}:{}".format(field["name"], to_hive_type(field["type"])) for field in data_type["fields"]))
+
 
 class KinesisDatabase(Construct):
 
@@ -12,7 +34,8 @@ class KinesisDatabase(Construct):
             db_name: str,
             table_name: str,
             data_stream_name: str,
-            data_stream_arn: str
+            data_stream_arn: str,
+            schema: dict
     ):
         super().__init__(scope, construct_id)
 
@@ -36,7 +59,12 @@ class KinesisDatabase(Construct):
                     data_stream_name),
                 retention=0,
                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
-                    columns=None,
+                    columns=[
+                        {
+                            "name": field["name"],
+                            "type": to_hive_type(field["type"])
+                        } for field in schema["fields"]
+                    ],
                     location=data_stream_name,
                     input_format='org.apache.hadoop.mapred.TextInputFormat',
                     output_format='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
@@ -2,6 +2,37 @@ import aws_cdk.aws_glue as glue
 from aws_cdk import Stack
 from constructs import Construct
 
+from pipeline_stack.runtime.glue_job_assets_bucket.field_paths import load_selected_fields
+from pipeline_stack.runtime.glue_job_assets_bucket.field_paths import output_columns
+
+# Storage settings of the output table per output format and the compression codecs supported by both the Glue ETL
+# job writer and Athena
+OUTPUT_FORMATS = {
+    "json": {
+        "input_format": "org.apache.hadoop.mapred.TextInputFormat",
+        "output_format": "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+        "serialization_library": "org.openx.data.jsonserde.JsonSerDe",
+        "compressions": ["none", "gzip"]
+    },
+    "parquet": {
+        "input_format": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+        "output_format": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+        "serialization_library": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
+        "compressions": ["none", "snappy", "gzip", "zstd"]
+    },
+    "orc": {
+        "input_format": "org.apache.hadoop.hive.ql.io.orc.OrcInputFormat",
+        "output_format": "org.apache.hadoop.hive.ql.io.orc.OrcOutputFormat",
+        "serialization_library": "org.apache.hadoop.hive.ql.io.orc.OrcSerde",
+        "compressions": ["none", "snappy", "zlib"]
+    }
+}
+
+
+def selected_field_columns(selected_fields_config: dict) -> list:
+    """The columns of a selected fields config, validated and typed like the consumers read it."""
+    return output_columns(load_selected_fields(selected_fields_config))
+
 
 class OutputDatabase(Construct):
 
@@ -11,10 +42,58 @@ class OutputDatabase(Construct):
             construct_id: str,
             db_name: str,
             table_name: str,
-            bucket_name: str
+            bucket_name: str,
+            output_format: str,
+            output_compression: str,
+            selected_fields_config: dict,
+            partition_projection_start_date: str = "2023-01-01"
     ):
         super().__init__(scope, construct_id)
 
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unsupported output format '{}', expected one of {}".format(
+                output_format, ", ".join(OUTPUT_FORMATS)))
+
+        storage = OUTPUT_FORMATS[output_format]
+
+        if output_compression not in storage["compressions"]:
+            raise ValueError("Unsupported compression '{}' for output format '{}', expected one of {}".format(
+                output_compression, output_format, ", ".join(storage["compressions"])))
+
+        columns = selected_field_columns(selected_fields_config)
+
+        serde_parameters = {
+            "serialization.format": "1"
+        }
+
+        table_parameters = {
+            "compressionType": output_compression,
+            "classification": output_format
+        }
+
+        # The output data is partitioned by the event date and hour of the records. Partition projection lets Athena
+        # compute the partitions of a query from its predicates, so no crawler or MSCK REPAIR runs are needed.
+        table_parameters |= {
+            "projection.enabled": "true",
+            "projection.event_date.type": "date",
+            "projection.event_date.format": "yyyy-MM-dd",
+            "projection.event_date.range": "{},NOW".format(partition_projection_start_date),
+            "projection.event_date.interval": "1",
+            "projection.event_date.interval.unit": "DAYS",
+            "projection.event_hour.type": "integer",
+            "projection.event_hour.range": "0,23",
+            "projection.event_hour.digits": "2",
+            "storage.location.template": "s3://{}/event_date=${{event_date}}/event_hour=${{event_hour}}/".format(
+                bucket_name)
+        }
+
+        if output_format == "json":
+            serde_parameters["paths"] = ",".join(column["name"] for column in columns)
+        elif output_format == "parquet":
+            table_parameters["parquet.compression"] = output_compression.upper()
+        elif output_format == "orc":
+            table_parameters["orc.compress"] = output_compression.upper()
+
         self.database = glue.CfnDatabase(
             self,
             "Database",
@@ -34,170 +113,30 @@ class OutputDatabase(Construct):
                 description="The table containing the output data from the S3 bucket {}".format(bucket_name),
                 retention=0,
                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
-                    columns=[
-                        {
-                            "name": "msg_mid",
-                            "type": "int"
-                        },
-                        {
-                            "name": "msg_id",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_sender",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_topic",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_destinantion",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_creationtimestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_starttimestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_endtimestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "msg_version",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_id",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_name",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_number",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_type",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_family",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_brand",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_model",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_on_status_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_on_status_value",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_control_id",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_control_modespreader_status_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_control_modespreader_status_value",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_spreader_id",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_spreader_locked_status_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_spreader_locked_status_value",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_spreader_unlocked_status_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_spreader_unlocked_status_value",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_hoist_id",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_hoist_hoisting_height_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_hoist_hoisting_height_value",
-                            "type": "double"
-                        },
-                        {
-                            "name": "che_hoist_weight_gross_value",
-                            "type": "double"
-                        },
-                        {
-                            "name": "che_trolley_id",
-                            "type": "int"
-                        },
-                        {
-                            "name": "che_trolley_trolleying_reach_timestamp",
-                            "type": "string"
-                        },
-                        {
-                            "name": "che_trolley_trolleying_reach_value",
-                            "type": "double"
-                        },
-                        {
-                            "name": "che_trolley_trolleying_reach_reference",
-                            "type": "string"
-                        },
-                        {
-                            "name":"che_cycle_move_counter_move_id",
-                            "type": "int"
-                        }
-
-                    ],
+                    columns=columns,
                     location="s3://{}/".format(bucket_name),
-                    input_format='org.apache.hadoop.mapred.TextInputFormat',
-                    output_format='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
-                    compressed=False,
+                    input_format=storage["input_format"],
+                    output_format=storage["output_format"],
+                    compressed=output_compression != "none",
                     number_of_buckets=-1,
                     serde_info=glue.CfnTable.SerdeInfoProperty(
-                        serialization_library='org.openx.data.jsonserde.JsonSerDe',
-                        parameters={
-                            "serialization.format": "1",
-                            "paths": "che_brand,che_control_id,che_control_modespreader_status_timestamp,che_control_modespreader_status_value,che_family,che_hoist_hoisting_height_timestamp,che_hoist_hoisting_height_value,che_hoist_id,che_hoist_weight_gross_value,che_id,che_model,che_name,che_number,che_on_status_timestamp,che_on_status_value,che_spreader_id,che_spreader_locked_status_timestamp,che_spreader_locked_status_value,che_spreader_unlocked_status_timestamp,che_spreader_unlocked_status_value,che_trolley_id,che_trolley_trolleying_reach_reference,che_trolley_trolleying_reach_timestamp,che_trolley_trolleying_reach_value,che_type,msg_creationtimestamp,msg_destinantion,msg_endtimestamp,msg_id,msg_mid,msg_sender,msg_starttimestamp,msg_timestamp,msg_topic,msg_version,che_cycle_move_counter_move_id"
-                        }
+                        serialization_library=storage["serialization_library"],
+                        parameters=serde_parameters
                     ),
                     sort_columns=None,
                     skewed_info=None,
                     stored_as_sub_directories=False
                 ),
-                partition_keys=None,
+                partition_keys=[
+                    {
+                        "name": "event_date",
+                        "type": "string"
+                    },
+                    {
+                        "name": "event_hour",
+                        "type": "string"
+                    }
+                ],
                 parameters={
                     "sizeKey": "30059192",
                     "objectCount": "118",
@@ -209,11 +148,9 @@ class OutputDatabase(Construct):
                     "exclusions": "[\"s3://{bucket}/**.csv\",\"s3://{bucket}/**.txt\",\"s3://{bucket}/**.csv.metadata\",\"s3://{bucket}/**/Unsaved/**\"]".format(
                         bucket=bucket_name),
                     "CrawlerSchemaDeserializerVersion": "1.0",
-                    "compressionType": "none",
-                    "classification": "json",
                     "EXTERNAL": "TRUE",
                     "typeOfData": "file"
-                }
+                } | table_parameters
             )
         )
 
@@ -0,0 +1,94 @@
+import aws_cdk.aws_glue as glue
+from aws_cdk import Stack
+from constructs import Construct
+from pipeline_constructs.glue.glue_output_database import OUTPUT_FORMATS
+from pipeline_constructs.glue.glue_output_database import selected_field_columns
+
+
+class RouteTable(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            database_name: str,
+            table_name: str,
+            bucket_name: str,
+            output_format: str,
+            output_compression: str,
+            route_config: dict,
+            partition_projection_start_date: str = "2023-01-01"
+    ):
+        super().__init__(scope, construct_id)
+
+        storage = OUTPUT_FORMATS[output_format]
+
+        columns = selected_field_columns(route_config)
+
+        location = "s3://{}/routes/{}/".format(bucket_name, route_config["name"])
+
+        serde_parameters = {
+            "serialization.format": "1"
+        }
+
+        # The routes are partitioned like the output by the event date and hour of the records
+        table_parameters = {
+            "compressionType": output_compression,
+            "classification": output_format,
+            "EXTERNAL": "TRUE",
+            "typeOfData": "file",
+            "projection.enabled": "true",
+            "projection.event_date.type": "date",
+            "projection.event_date.format": "yyyy-MM-dd",
+            "projection.event_date.range": "{},NOW".format(partition_projection_start_date),
+            "projection.event_date.interval": "1",
+            "projection.event_date.interval.unit": "DAYS",
+            "projection.event_hour.type": "integer",
+            "projection.event_hour.range": "0,23",
+            "projection.event_hour.digits": "2",
+            "storage.location.template": location + "event_date=${event_date}/event_hour=${event_hour}/"
+        }
+
+        if output_format == "json":
+            serde_parameters["paths"] = ",".join(column["name"] for column in columns)
+        elif output_format == "parquet":
+            table_parameters["parquet.compression"] = output_compression.upper()
+        elif output_format == "orc":
+            table_parameters["orc.compress"] = output_compression.upper()
+
+        self.table = glue.CfnTable(
+            self,
+            "GlueRouteTable",
+            catalog_id=Stack.of(self).account,
+            database_name=database_name,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=table_name,
+                description="The table containing the output data of the route {} from the S3 bucket {}".format(
+                    route_config["name"], bucket_name),
+                retention=0,
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    columns=columns,
+                    location=location,
+                    input_format=storage["input_format"],
+                    output_format=storage["output_format"],
+                    compressed=output_compression != "none",
+                    number_of_buckets=-1,
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library=storage["serialization_library"],
+                        parameters=serde_parameters
+                    ),
+                    stored_as_sub_directories=False
+                ),
+                partition_keys=[
+                    {
+                        "name": "event_date",
+                        "type": "string"
+                    },
+                    {
+                        "name": "event_hour",
+                        "type": "string"
+                    }
+                ],
+                parameters=table_parameters
+            )
+        )
@@ -0,0 +1,116 @@
+import aws_cdk.aws_glue as glue
+import aws_cdk.aws_iam as iam
+from aws_cdk import Stack
+from constructs import Construct
+
+
+class ReplayJob(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            job_name: str,
+            worker_type: str,
+            number_of_workers: int,
+            job_bucket_arn: str,
+            job_bucket_name: str,
+            script_location: str,
+            job_params: dict,
+            raw_archive_bucket_arn: str,
+            output_bucket_arn: str,
+            selected_fields_parameter_name: str
+    ):
+        super().__init__(scope, construct_id)
+
+        job_role = iam.Role(
+            self,
+            "IamReplayJobRole",
+            role_name=job_name,
+            assumed_by=iam.ServicePrincipal("glue.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSGlueServiceRole")
+            ],
+            inline_policies={
+                "AmazonSsmGetParameterPermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "ssm:GetParameter"
+                            ],
+                            resources=[
+                                "arn:{}:ssm:{}:{}:parameter/{}".format(
+                                    Stack.of(self).partition,
+                                    Stack.of(self).region,
+                                    Stack.of(self).account,
+                                    selected_fields_parameter_name
+                                )
+                            ]
+                        )
+                    ]
+                ),
+                "AmazonS3ReadArchivePermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "s3:ListBucket",
+                                "s3:GetObject"
+                            ],
+                            resources=[
+                                raw_archive_bucket_arn,
+                                "{}/*".format(raw_archive_bucket_arn)
+                            ]
+                        )
+                    ]
+                ),
+                "AmazonS3ReadWriteObjectsPermission": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "s3:ListBucket",
+                                "s3:*Object*"
+                            ],
+                            resources=[
+                                job_bucket_arn,
+                                "{}/*".format(job_bucket_arn),
+                                output_bucket_arn,
+                                "{}/*".format(output_bucket_arn)
+                            ]
+                        )
+                    ]
+                )
+            }
+        )
+
+        # The job is started on demand with the --startDate and --endDate arguments of the replayed event dates
+        self.job = glue.CfnJob(
+            self,
+            "Job",
+            name=job_name,
+            role=job_role.role_name,
+            glue_version="4.0",
+            command=glue.CfnJob.JobCommandProperty(
+                name="glueetl",
+                script_location=script_location,
+                python_version="3"
+            ),
+            execution_property=glue.CfnJob.ExecutionPropertyProperty(
+                max_concurrent_runs=1
+            ),
+            default_arguments={
+                "--enable-metrics": "true",
+                "--enable-continuous-cloudwatch-log": "true",
+                "--job-bookmark-option": "job-bookmark-disable",
+                "--job-language": "python",
+                "--TempDir": "s3://{}/temporary/".format(job_bucket_name)
+            } | job_params,
+            max_retries=0,
+            worker_type=worker_type,
+            number_of_workers=number_of_workers,
+            execution_class="STANDARD"
+        )
+
+        self.job.node.add_dependency(job_role)
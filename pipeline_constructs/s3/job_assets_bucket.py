@@ -0,0 +1,65 @@
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_s3 as s3
+import aws_cdk.aws_s3_deployment as s3deploy
+from aws_cdk import RemovalPolicy
+from aws_cdk import Stack
+from constructs import Construct
+
+
+class JobAssetsBucket(Construct):
+
+    def __init__(
+            self,
+            scope: Construct,
+            construct_id: str,
+            bucket_name: str,
+            deployment_paths: list
+    ):
+        super().__init__(scope, construct_id)
+
+        self.bucket = s3.Bucket(
+            self,
+            "S3JobAssetsBucket",
+            bucket_name=bucket_name,
+            block_public_access=s3.BlockPublicAccess(
+                block_public_acls=False,
+                block_public_policy=True,
+                ignore_public_acls=True,
+                restrict_public_buckets=True
+            ),
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            versioned=False,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True
+        )
+
+        self.bucket.add_to_resource_policy(
+            permission=iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                principals=[
+                    iam.ServicePrincipal('glue.amazonaws.com')
+                ],
+                actions=[
+                    "s3:ListBucket",
+                    "s3:*Object*"
+                ],
+                resources=[
+                    self.bucket.bucket_arn,
+                    "{}/*".format(self.bucket.bucket_arn)
+                ],
+                conditions={
+                    "StringEquals": {"aws:SourceAccount": Stack.of(self).account}
+                }
+            )
+        )
+
+        # The contents of all deployment paths are merged into the root of the bucket
+        self.deployment = s3deploy.BucketDeployment(
+            self,
+            "S3JobAssetsBucketDeployment",
+            destination_bucket=self.bucket,
+            sources=[
+                s3deploy.Source.asset(deployment_path) for deployment_path in deployment_paths
+            ]
+        )
@@ -0,0 +1,100 @@
+"""
+Capacity model of the pipeline, shared by the capacity planner and the checks of the stack at synth time.
+
+The model derives the shards from the Kinesis write limits, and the Glue workers and window size from the message
+throughput per vCPU measured by the local benchmark of the transformation. A micro-batch of a window has to be
+processed before the next window ends, and a message is written at the latest a window plus the processing time of
+its batch after it arrived.
+"""
+import math
+
+from pipeline_stack.runtime.glue_job_assets_bucket.adaptive_window import format_window_size
+from pipeline_stack.runtime.glue_job_assets_bucket.adaptive_window import parse_window_size
+
+# Write limits of a provisioned shard
+SHARD_BYTES_PER_SECOND = 1024 * 1024
+SHARD_RECORDS_PER_SECOND = 1000
+
+# vCPUs and DPUs of the Glue worker types
+WORKER_VCPUS = {"G.025X": 2, "G.1X": 4, "G.2X": 8}
+WORKER_DPUS = {"G.025X": 0.25, "G.1X": 1, "G.2X": 2}
+
+# A Glue cluster reaches a fraction of the local benchmark throughput per vCPU, because of the Kinesis fetch, the
+# S3 writes and the coordination of the executors
+CLUSTER_EFFICIENCY = 0.7
+
+# The time of a micro-batch which does not depend on its size, e.g. fetching from Kinesis and committing to S3
+BATCH_OVERHEAD_SECONDS = 3.0
+
+# The share of the cluster throughput the planner uses, the rest absorbs peaks and catching up
+MAX_JOB_UTILIZATION = 0.7
+
+
+def shards_needed(message_rate, record_size, messages_per_record=1, utilization=1.0):
+    """The shards needed to write message_rate messages/s of record_size bytes each at the given utilization."""
+    records = message_rate / messages_per_record / (SHARD_RECORDS_PER_SECOND * utilization)
+    data = message_rate * record_size / (SHARD_BYTES_PER_SECOND * utilization)
+    return max(1, math.ceil(records), math.ceil(data))
+
+
+def job_throughput(worker_type, number_of_workers, messages_per_second_per_vcpu):
+    """The messages/s a Glue job processes. One of the workers runs the driver."""
+    if worker_type not in WORKER_VCPUS:
+        raise ValueError("Unknown worker type '{}', expected one of {}".format(
+            worker_type, ", ".join(WORKER_VCPUS)))
+    executors = max(1, number_of_workers - 1)
+    return executors * WORKER_VCPUS[worker_type] * messages_per_second_per_vcpu * CLUSTER_EFFICIENCY
+
+
+def batch_seconds(message_rate, window_seconds, throughput):
+    """The processing time of the micro-batch of a window."""
+    return BATCH_OVERHEAD_SECONDS + message_rate * window_seconds / throughput
+
+
+def plan_job(message_rate, latency_target, messages_per_second_per_vcpu, worker_types=None, max_workers=100):
+    """
+    Return the cheapest (worker type, number of workers, window seconds) which processes message_rate messages/s
+    within latency_target seconds, or None if no configuration does. Of the feasible windows the largest is chosen,
+    since larger windows write fewer and larger files.
+    """
+    best = None
+    for worker_type in worker_types or list(WORKER_VCPUS):
+        for number_of_workers in range(2, max_workers + 1):
+            throughput = job_throughput(worker_type, number_of_workers, messages_per_second_per_vcpu)
+            utilization = message_rate / throughput
+            if utilization > MAX_JOB_UTILIZATION:
+                continue
+            # Sustained: batch_seconds(window) <= window, within the target: window + batch_seconds(window) <= target
+            min_window = math.ceil(BATCH_OVERHEAD_SECONDS / (1 - utilization))
+            max_window = math.floor((latency_target - BATCH_OVERHEAD_SECONDS) / (1 + utilization))
+            if max_window >= max(min_window, 1):
+                cost = WORKER_DPUS[worker_type] * number_of_workers
+                if best is None or cost < best[0]:
+                    best = (cost, worker_type, number_of_workers, max_window)
+                break
+    return best[1:] if best else None
+
+
+def check_capacity(message_rate, record_size, latency_target, messages_per_second_per_vcpu, shard_count,
+                   worker_type=None, number_of_workers=None, window_size=None, messages_per_record=1):
+    """Return warnings for the configured values which cannot sustain the declared load."""
+    warnings = []
+
+    needed = shards_needed(message_rate, record_size, messages_per_record)
+    if needed > shard_count:
+        warnings.append("{} shards cannot take {} messages/s of {} bytes, at least {} shards are needed".format(
+            shard_count, message_rate, record_size, needed))
+
+    if worker_type is None:
+        return warnings
+
+    window_seconds = parse_window_size(window_size)
+    throughput = job_throughput(worker_type, number_of_workers, messages_per_second_per_vcpu)
+    processing = batch_seconds(message_rate, window_seconds, throughput)
+    if processing > window_seconds:
+        warnings.append("{} {} workers process a {} window of {} messages/s in about {:.0f} seconds, so the job "
+                        "falls behind".format(number_of_workers, worker_type, window_size, message_rate, processing))
+    elif latency_target is not None and window_seconds + processing > latency_target:
+        warnings.append("Messages are written about {:.0f} seconds after they arrive, above the latency target of {} "
+                        "seconds".format(window_seconds + processing, latency_target))
+    return warnings
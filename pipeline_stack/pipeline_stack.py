@@ -1,3 +1,5 @@
+import json
+import re
 from pathlib import Path
 from string import Template
 
@@ -6,14 +8,24 @@ import aws_cdk.aws_glue as glue
 import aws_cdk.aws_iam as iam
 import aws_cdk.aws_kinesis as kinesis
 import aws_cdk.aws_s3 as s3
+from aws_cdk import Annotations
 from aws_cdk import Duration
 from aws_cdk import RemovalPolicy
 from aws_cdk import Stack
 from constructs import Construct
+from pipeline_constructs.awslambda.kinesis_consumer import KinesisConsumer
+from pipeline_constructs.awslambda.shard_scaler import ShardScaler
+from pipeline_constructs.glue.compaction_job import CompactionJob
 from pipeline_constructs.glue.etl_job import EtlJob
+from pipeline_constructs.glue.glue_aggregates_table import AggregatesTable
 from pipeline_constructs.glue.glue_kinesis_database import KinesisDatabase
 from pipeline_constructs.glue.glue_output_database import OutputDatabase
+from pipeline_constructs.glue.glue_output_database import selected_field_columns
+from pipeline_constructs.glue.glue_route_table import RouteTable
+from pipeline_constructs.glue.replay_job import ReplayJob
+from pipeline_constructs.s3.job_assets_bucket import JobAssetsBucket
 from pipeline_constructs.ssm.string_parameters import StringParameters
+from pipeline_stack.capacity import check_capacity
 
 
 class PipelineStack(Stack):
@@ -33,10 +45,86 @@ class PipelineStack(Stack):
 
         # Context variables
         kinesis_shard_count = self.node.try_get_context("kinesis-shard-count")
+        kinesis_record_format = self.node.try_get_context("kinesis-record-format")
+        kinesis_autoscaling = self.node.try_get_context("kinesis-autoscaling")
+        kinesis_autoscaling_schedule = self.node.try_get_context("kinesis-autoscaling-schedule")
+        kinesis_min_shard_count = self.node.try_get_context("kinesis-min-shard-count")
+        kinesis_max_shard_count = self.node.try_get_context("kinesis-max-shard-count")
+        kinesis_scale_out_utilization = self.node.try_get_context("kinesis-scale-out-utilization")
+        kinesis_scale_in_utilization = self.node.try_get_context("kinesis-scale-in-utilization")
+        kinesis_target_utilization = self.node.try_get_context("kinesis-target-utilization")
         job_worker_type = self.node.try_get_context("job-worker-type")
         job_number_of_workers = self.node.try_get_context("job-number-of-workers")
         job_max_concurrent_runs = self.node.try_get_context("job-max-concurrent-runs")
+        consumer_engine = self.node.try_get_context("consumer-engine")
+        consumer_layer_arn = self.node.try_get_context("consumer-layer-arn")
+        consumer_memory_size = self.node.try_get_context("consumer-memory-size")
+        consumer_batch_size = self.node.try_get_context("consumer-batch-size")
+        consumer_max_batching_window = self.node.try_get_context("consumer-max-batching-window")
         job_window_size = self.node.try_get_context("job-window-size")
+        job_starting_position = self.node.try_get_context("job-starting-position")
+        job_max_fetch_time_ms = self.node.try_get_context("job-max-fetch-time-ms")
+        job_max_fetch_records_per_shard = self.node.try_get_context("job-max-fetch-records-per-shard")
+        job_catch_up = self.node.try_get_context("job-catch-up")
+        job_catch_up_window_size = self.node.try_get_context("job-catch-up-window-size")
+        job_catch_up_max_fetch_time_ms = self.node.try_get_context("job-catch-up-max-fetch-time-ms")
+        job_catch_up_max_fetch_records_per_shard = self.node.try_get_context("job-catch-up-max-fetch-records-per-shard")
+        job_catch_up_lag_seconds = self.node.try_get_context("job-catch-up-lag-seconds")
+        job_steady_lag_seconds = self.node.try_get_context("job-steady-lag-seconds")
+        job_adaptive_window = self.node.try_get_context("job-adaptive-window")
+        job_adaptive_window_min_size = self.node.try_get_context("job-adaptive-window-min-size")
+        job_adaptive_window_max_size = self.node.try_get_context("job-adaptive-window-max-size")
+        job_adaptive_window_target_utilization = self.node.try_get_context("job-adaptive-window-target-utilization")
+        job_adaptive_window_min_records = self.node.try_get_context("job-adaptive-window-min-records")
+        job_adaptive_window_max_lag_seconds = self.node.try_get_context("job-adaptive-window-max-lag-seconds")
+        job_adaptive_window_cooldown_seconds = self.node.try_get_context("job-adaptive-window-cooldown-seconds")
+        job_required_fields = self.node.try_get_context("job-required-fields")
+        job_aggregates = self.node.try_get_context("job-aggregates")
+        job_routes = self.node.try_get_context("job-routes")
+        job_deduplication = self.node.try_get_context("job-deduplication")
+        job_deduplication_key = self.node.try_get_context("job-deduplication-key")
+        job_deduplication_ttl = self.node.try_get_context("job-deduplication-ttl")
+        metrics_namespace = self.node.try_get_context("metrics-namespace")
+        metrics_sink = self.node.try_get_context("metrics-sink")
+        job_profiling_interval = self.node.try_get_context("job-profiling-interval")
+        selected_fields_ttl = self.node.try_get_context("selected-fields-ttl")
+        job_messages_per_second_per_vcpu = self.node.try_get_context("job-messages-per-second-per-vcpu")
+        expected_message_rate = self.node.try_get_context("expected-message-rate")
+        expected_record_size = self.node.try_get_context("expected-record-size")
+        expected_messages_per_record = self.node.try_get_context("expected-messages-per-record")
+        expected_latency_seconds = self.node.try_get_context("expected-latency-seconds")
+        output_format = self.node.try_get_context("output-format")
+        output_compression = self.node.try_get_context("output-compression")
+        compaction_schedule = self.node.try_get_context("compaction-schedule")
+        compaction_worker_type = self.node.try_get_context("compaction-worker-type")
+        compaction_number_of_workers = self.node.try_get_context("compaction-number-of-workers")
+        compaction_target_file_size_mb = self.node.try_get_context("compaction-target-file-size-mb")
+        compaction_min_partition_age_hours = self.node.try_get_context("compaction-min-partition-age-hours")
+        compaction_lookback_hours = self.node.try_get_context("compaction-lookback-hours")
+        raw_archive = self.node.try_get_context("raw-archive")
+        raw_archive_expiration_days = self.node.try_get_context("raw-archive-expiration-days")
+        replay_worker_type = self.node.try_get_context("replay-worker-type")
+        replay_number_of_workers = self.node.try_get_context("replay-number-of-workers")
+        current_state = self.node.try_get_context("current-state")
+        current_state_key = self.node.try_get_context("current-state-key")
+        current_state_order_by = self.node.try_get_context("current-state-order-by")
+
+        # Warn at synth time when the configured capacity cannot sustain the declared load. Context values passed on
+        # the command line are strings.
+        if expected_message_rate is not None:
+            capacity_warnings = check_capacity(
+                message_rate=float(expected_message_rate),
+                record_size=float(expected_record_size),
+                latency_target=float(expected_latency_seconds) if expected_latency_seconds is not None else None,
+                messages_per_second_per_vcpu=float(job_messages_per_second_per_vcpu),
+                shard_count=int(kinesis_max_shard_count if kinesis_autoscaling else kinesis_shard_count),
+                worker_type=job_worker_type if consumer_engine == "glue" else None,
+                number_of_workers=int(job_number_of_workers),
+                window_size=job_window_size,
+                messages_per_record=float(expected_messages_per_record)
+            )
+            for capacity_warning in capacity_warnings:
+                Annotations.of(self).add_warning(capacity_warning)
 
         # Prefix for resource names
         prefix = "{}-{}-{}".format(organization, environment, application)
@@ -80,17 +168,92 @@ class PipelineStack(Stack):
             removal_policy=RemovalPolicy.RETAIN
         )
 
+        # S3 Raw Archive Bucket, written by the Glue ETL Job only
+        raw_archive = raw_archive and consumer_engine == "glue"
+        if raw_archive:
+            s3_raw_archive_bucket = s3.Bucket(
+                self,
+                "S3RawArchiveBucket",
+                bucket_name="{}-raw-archive-{}".format(prefix, postfix),
+                block_public_access=s3.BlockPublicAccess(
+                    block_public_acls=True,
+                    block_public_policy=True,
+                    ignore_public_acls=True,
+                    restrict_public_buckets=True
+                ),
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                versioned=False,
+                lifecycle_rules=[
+                    s3.LifecycleRule(expiration=Duration.days(raw_archive_expiration_days))
+                ] if raw_archive_expiration_days else None,
+                removal_policy=RemovalPolicy.RETAIN
+            )
+
         # Glue Output Database
+        # The consumers reject reloaded selected fields which are not columns of the deployed table
+        output_columns = selected_field_columns(json.loads(selected_fields_json_string))
         glue_output_database = OutputDatabase(
             self,
             "GlueOutputDatabase",
             db_name=glue_output_database_name,
             table_name=glue_output_table_name,
-            bucket_name=s3_output_bucket.bucket_name
+            bucket_name=s3_output_bucket.bucket_name,
+            output_format=output_format,
+            output_compression=output_compression,
+            selected_fields_config=json.loads(selected_fields_json_string)
         )
 
         glue_output_database.node.add_dependency(s3_output_bucket)
 
+        # Glue Aggregates Table
+        aggregates_json_string = "{}"
+        if job_aggregates:
+            if consumer_engine != "glue":
+                raise ValueError("Aggregates are only computed by the Glue ETL Job, not by the Lambda consumer")
+
+            aggregates_json_string = Path(dirpath, 'config', 'kpis', 'aggregates_sample.json').read_text()
+
+            glue_aggregates_table = AggregatesTable(
+                self,
+                "GlueAggregatesTable",
+                database_name=glue_output_database.database.database_input.name,
+                table_name="{}-aggregates-table".format(prefix),
+                bucket_name=s3_output_bucket.bucket_name,
+                output_format=output_format,
+                output_compression=output_compression,
+                aggregates_config=json.loads(aggregates_json_string)
+            )
+
+            glue_aggregates_table.node.add_dependency(glue_output_database)
+
+        # Glue Route Tables, one output table per route of the Glue ETL Job
+        routes_json_string = "{}"
+        if job_routes:
+            if consumer_engine != "glue":
+                raise ValueError("Routes are only written by the Glue ETL Job, not by the Lambda consumer")
+
+            routes_json_string = Path(dirpath, 'config', 'kpis', 'routes_sample.json').read_text()
+
+            for route_config in json.loads(routes_json_string)["routes"]:
+                glue_route_table = RouteTable(
+                    self,
+                    "GlueRouteTable-{}".format(route_config["name"]),
+                    database_name=glue_output_database.database.database_input.name,
+                    table_name="{}-{}-output-table".format(prefix, route_config["name"]),
+                    bucket_name=s3_output_bucket.bucket_name,
+                    output_format=output_format,
+                    output_compression=output_compression,
+                    route_config=route_config
+                )
+
+                glue_route_table.node.add_dependency(glue_output_database)
+
+        # Glue Current State Table, an Iceberg table which the Glue ETL Job creates in the output database at its start
+        # and keeps up to date with the latest selected fields per key
+        if current_state and consumer_engine != "glue":
+            raise ValueError("The current state table is only kept by the Glue ETL Job, not by the Lambda consumer")
+
         # S3 Athena Query Results Bucket
         s3_athena_query_results_bucket = s3.Bucket(
             self,
@@ -140,6 +303,24 @@ class PipelineStack(Stack):
             retention_period=Duration.hours(24)
         )
 
+        # Kinesis Shard Scaler
+        if kinesis_autoscaling:
+            shard_scaler = ShardScaler(
+                self,
+                "KinesisShardScaler",
+                function_name="{}-shard-scaler".format(prefix),
+                code_path=str(Path(dirpath, 'runtime', 'glue_job_assets_bucket')),
+                schedule=kinesis_autoscaling_schedule,
+                data_stream=kinesis_data_stream,
+                min_shards=kinesis_min_shard_count,
+                max_shards=kinesis_max_shard_count,
+                scale_out_utilization=kinesis_scale_out_utilization,
+                scale_in_utilization=kinesis_scale_in_utilization,
+                target_utilization=kinesis_target_utilization
+            )
+
+            shard_scaler.node.add_dependency(kinesis_data_stream)
+
         # Glue Kinesis Database
         glue_kinesis_database = KinesisDatabase(
             self,
@@ -147,35 +328,249 @@ class PipelineStack(Stack):
             db_name="{}-kinesis-database".format(prefix),
             table_name="{}-kinesis-table".format(prefix),
             data_stream_name=kinesis_data_stream.stream_name,
-            data_stream_arn=kinesis_data_stream.stream_arn
+            data_stream_arn=kinesis_data_stream.stream_arn,
+            schema=json.loads(Path(dirpath, 'config', 'schemas', 'input_schema.json').read_text())
         )
 
         glue_kinesis_database.node.add_dependency(kinesis_data_stream)
 
-        # Glue ETL Job
-        glue_job = EtlJob(
+        # S3 Job Assets Bucket
+        job_assets_bucket_name = "{}-jobassets-{}".format(prefix, postfix)
+
+        job_assets_bucket = JobAssetsBucket(
+            self,
+            "S3JobAssetsBucket",
+            bucket_name=job_assets_bucket_name,
+            deployment_paths=[
+                str(Path(dirpath, 'runtime', 'glue_job_assets_bucket')),
+                str(Path(dirpath, 'config', 'schemas'))
+            ]
+        )
+
+        if consumer_engine == "glue":
+            # Glue ETL Job
+            # Python modules next to the job script which are imported by it
+            job_python_modules = [
+                "adaptive_window.py",
+                "aggregates.py",
+                "cached_parameter.py",
+                "catch_up.py",
+                "compression.py",
+                "current_state.py",
+                "field_paths.py",
+                "metrics.py",
+                "profiling.py",
+                "record_codec.py",
+                "routes.py",
+                "transforms.py"
+            ]
+
+            if kinesis_record_format not in ["json", "packed"]:
+                raise ValueError("Unsupported Kinesis record format '{}', expected 'json' or 'packed'".format(
+                    kinesis_record_format))
+
+            if job_starting_position not in ["TRIM_HORIZON", "LATEST"] and not re.match(
+                    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(Z|[+-]\d{2}:\d{2})$", job_starting_position):
+                raise ValueError(
+                    "Invalid starting position '{}', expected TRIM_HORIZON, LATEST or a timestamp like "
+                    "2023-03-01T06:00:00Z".format(job_starting_position))
+
+            if job_steady_lag_seconds >= job_catch_up_lag_seconds:
+                raise ValueError("The steady lag of {} seconds must be below the catch-up lag of {} seconds".format(
+                    job_steady_lag_seconds, job_catch_up_lag_seconds))
+
+            # The read profiles of the job, it switches to the catch-up profile while it is far behind the stream
+            job_read_profiles = {
+                "steady": {
+                    "window-size": job_window_size,
+                    "max-fetch-time-ms": job_max_fetch_time_ms,
+                    "max-fetch-records-per-shard": job_max_fetch_records_per_shard
+                },
+                "catch-up": {
+                    "window-size": job_catch_up_window_size,
+                    "max-fetch-time-ms": job_catch_up_max_fetch_time_ms,
+                    "max-fetch-records-per-shard": job_catch_up_max_fetch_records_per_shard
+                }
+            }
+
+            # The current state table is an Iceberg table in the Glue Data Catalog. Glue takes a single --conf
+            # argument, so the further settings are appended to its value.
+            job_current_state_params = {
+                "--datalake-formats": "iceberg",
+                "--conf": " --conf ".join([
+                    "spark.sql.extensions=org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions",
+                    "spark.sql.catalog.glue_catalog=org.apache.iceberg.spark.SparkCatalog",
+                    "spark.sql.catalog.glue_catalog.warehouse=s3://{}/".format(s3_output_bucket_name),
+                    "spark.sql.catalog.glue_catalog.catalog-impl=org.apache.iceberg.aws.glue.GlueCatalog",
+                    "spark.sql.catalog.glue_catalog.io-impl=org.apache.iceberg.aws.s3.S3FileIO",
+                    # The names of the database and table contain hyphens
+                    "spark.sql.catalog.glue_catalog.glue.skip-name-validation=true"
+                ])
+            } if current_state else {}
+
+            # The window size of the steady profile adapts to the load between the bounds, starting at job-window-size
+            job_adaptive_window_policy = {
+                "min-window-size": job_adaptive_window_min_size,
+                "max-window-size": job_adaptive_window_max_size,
+                "target-utilization": job_adaptive_window_target_utilization,
+                "min-records": job_adaptive_window_min_records,
+                "max-lag-seconds": job_adaptive_window_max_lag_seconds,
+                "cooldown-seconds": job_adaptive_window_cooldown_seconds
+            } if job_adaptive_window else {}
+
+            # Packed records may be zstd compressed, gzip is part of the standard library
+            job_packed_record_params = {
+                "--additional-python-modules": "zstandard==0.21.0"
+            } if kinesis_record_format == "packed" else {}
+
+            glue_job = EtlJob(
+                self,
+                "GlueEtlJob",
+                job_name="{}-job".format(prefix),
+                worker_type=job_worker_type,
+                number_of_workers=job_number_of_workers,
+                max_concurrent_runs=job_max_concurrent_runs,
+                job_bucket_name=job_assets_bucket_name,
+                job_bucket_arn=job_assets_bucket.bucket.bucket_arn,
+                script_location="s3://{}/job_script.py".format(job_assets_bucket_name),
+                job_params={
+                    "--extra-py-files": ",".join(
+                        "s3://{}/{}".format(job_assets_bucket_name, module) for module in job_python_modules),
+                    "--startingPosition": job_starting_position,
+                    "--readProfiles": json.dumps(job_read_profiles),
+                    "--catchUp": "true" if job_catch_up else "false",
+                    "--catchUpLagSeconds": str(job_catch_up_lag_seconds),
+                    "--steadyLagSeconds": str(job_steady_lag_seconds),
+                    "--adaptiveWindow": json.dumps(job_adaptive_window_policy),
+                    "--kinesisStreamName": kinesis_data_stream.stream_name,
+                    "--kinesisEndpointUrl": "https://kinesis.{}.{}".format(self.region, self.url_suffix),
+                    "--kinesisRecordFormat": kinesis_record_format,
+                    "--inputSchemaPath": "s3://{}/input_schema.json".format(job_assets_bucket_name),
+                    "--outputColumns": json.dumps(output_columns),
+                    "--selectedFieldsParameter": ssm_param_job_selected_fields_name,
+                    "--selectedFieldsTtl": str(selected_fields_ttl),
+                    "--aggregates": aggregates_json_string,
+                    "--routes": routes_json_string,
+                    "--s3OutputBucket": s3_output_bucket.bucket_name,
+                    "--outputFormat": output_format,
+                    "--outputCompression": output_compression,
+                    "--deduplication": "true" if job_deduplication else "false",
+                    "--deduplicationKey": job_deduplication_key,
+                    "--deduplicationTtl": job_deduplication_ttl,
+                    "--metricsNamespace": metrics_namespace,
+                    "--metricsSink": metrics_sink,
+                    "--profilingInterval": str(job_profiling_interval),
+                    "--profilingPath": "s3://{}/profiles/".format(s3_output_bucket.bucket_name),
+                    "--rawArchive": "true" if raw_archive else "false",
+                    "--rawArchiveBucket": s3_raw_archive_bucket.bucket_name if raw_archive else "none",
+                    "--requiredFields": json.dumps(job_required_fields),
+                    "--currentState": "true" if current_state else "false",
+                    "--currentStateDatabase": glue_output_database_name,
+                    "--currentStateTable": "{}-current-state-table".format(prefix),
+                    "--currentStateKey": current_state_key,
+                    "--currentStateOrderBy": current_state_order_by
+                } | job_packed_record_params | job_current_state_params,
+                kinesis_stream_arn=kinesis_data_stream.stream_arn,
+                output_bucket_arn=s3_output_bucket.bucket_arn,
+                selected_fields_parameter_name=ssm_param_job_selected_fields_name,
+                raw_archive_bucket_arn=s3_raw_archive_bucket.bucket_arn if raw_archive else None
+            )
+
+            glue_job.node.add_dependency(job_assets_bucket)
+            glue_job.node.add_dependency(glue_kinesis_database)
+            glue_job.node.add_dependency(glue_output_database)
+            glue_job.node.add_dependency(s3_output_bucket)
+            glue_job.node.add_dependency(ssm_string_parameters)
+
+            # Glue Replay Job, which rebuilds the output of a range of event dates from the raw archive
+            if raw_archive:
+                replay_job = ReplayJob(
+                    self,
+                    "GlueReplayJob",
+                    job_name="{}-replay-job".format(prefix),
+                    worker_type=replay_worker_type,
+                    number_of_workers=replay_number_of_workers,
+                    job_bucket_arn=job_assets_bucket.bucket.bucket_arn,
+                    job_bucket_name=job_assets_bucket_name,
+                    script_location="s3://{}/replay_script.py".format(job_assets_bucket_name),
+                    job_params={
+                        "--extra-py-files": ",".join(
+                            "s3://{}/{}".format(job_assets_bucket_name, module) for module in job_python_modules),
+                        "--lateArrivalDays": "1",
+                        "--rawArchiveBucket": s3_raw_archive_bucket.bucket_name,
+                        "--kinesisRecordFormat": kinesis_record_format,
+                        "--selectedFieldsParameter": ssm_param_job_selected_fields_name,
+                        "--inputSchemaPath": "s3://{}/input_schema.json".format(job_assets_bucket_name),
+                        "--s3OutputBucket": s3_output_bucket.bucket_name,
+                        "--outputFormat": output_format,
+                        "--outputCompression": output_compression,
+                        "--deduplication": "true" if job_deduplication else "false",
+                        "--deduplicationKey": job_deduplication_key,
+                        "--requiredFields": json.dumps(job_required_fields)
+                    } | job_packed_record_params,
+                    raw_archive_bucket_arn=s3_raw_archive_bucket.bucket_arn,
+                    output_bucket_arn=s3_output_bucket.bucket_arn,
+                    selected_fields_parameter_name=ssm_param_job_selected_fields_name
+                )
+
+                replay_job.node.add_dependency(job_assets_bucket)
+                replay_job.node.add_dependency(ssm_string_parameters)
+        elif consumer_engine == "lambda":
+            # The Lambda consumer keeps no state between invocations to compress with
+            if json.loads(selected_fields_json_string).get("compression"):
+                raise ValueError("The 'lambda' consumer engine does not support the compression of the selected "
+                                 "fields, remove the 'compression' from kpi_sample.json or use the 'glue' engine")
+            # Lambda Kinesis Consumer
+            lambda_consumer = KinesisConsumer(
+                self,
+                "LambdaKinesisConsumer",
+                function_name="{}-consumer".format(prefix),
+                code_path=str(Path(dirpath, 'runtime', 'glue_job_assets_bucket')),
+                layer_arn=consumer_layer_arn.format(region=self.region),
+                memory_size=consumer_memory_size,
+                batch_size=consumer_batch_size,
+                max_batching_window=consumer_max_batching_window,
+                data_stream=kinesis_data_stream,
+                output_bucket=s3_output_bucket,
+                output_format=output_format,
+                output_compression=output_compression,
+                selected_fields_parameter_name=ssm_param_job_selected_fields_name,
+                selected_fields_ttl=selected_fields_ttl,
+                schema_bucket=job_assets_bucket.bucket,
+                schema_key="input_schema.json",
+                output_columns=output_columns,
+                required_fields=job_required_fields
+            )
+
+            lambda_consumer.node.add_dependency(job_assets_bucket)
+            lambda_consumer.node.add_dependency(ssm_string_parameters)
+        else:
+            raise ValueError("Unsupported consumer engine '{}', expected 'glue' or 'lambda'".format(consumer_engine))
+
+        # Glue Compaction Job
+        compaction_job = CompactionJob(
             self,
-            "GlueEtlJob",
-            job_name="{}-job".format(prefix),
-            worker_type=job_worker_type,
-            number_of_workers=job_number_of_workers,
-            max_concurrent_runs=job_max_concurrent_runs,
-            job_bucket_name="{}-jobassets-{}".format(prefix, postfix),
-            job_bucket_deployment_path=str(Path(dirpath, 'runtime', 'glue_job_assets_bucket')),
-            script_location="s3://{}-jobassets-{}/job_script.py".format(prefix, postfix),
+            "GlueCompactionJob",
+            job_name="{}-compaction-job".format(prefix),
+            worker_type=compaction_worker_type,
+            number_of_workers=compaction_number_of_workers,
+            schedule=compaction_schedule,
+            job_bucket_arn=job_assets_bucket.bucket.bucket_arn,
+            job_bucket_name=job_assets_bucket_name,
+            script_location="s3://{}/compaction_script.py".format(job_assets_bucket_name),
             job_params={
-                "--windowSize": job_window_size,
-                "--kinesisDB": glue_kinesis_database.database.database_input.name,
-                "--kinesisTable": glue_kinesis_database.table.table_input.name,
-                "--selectedFields": selected_fields_json_string,
-                "--s3OutputBucket": s3_output_bucket.bucket_name
+                "--extra-py-files": "s3://{}/compaction.py".format(job_assets_bucket_name),
+                "--s3OutputBucket": s3_output_bucket.bucket_name,
+                "--outputFormat": output_format,
+                "--outputCompression": output_compression,
+                "--targetFileSizeMb": str(compaction_target_file_size_mb),
+                "--minPartitionAgeHours": str(compaction_min_partition_age_hours),
+                "--lookbackHours": str(compaction_lookback_hours)
             },
-            kinesis_stream_arn=kinesis_data_stream.stream_arn,
-            output_bucket_arn=s3_output_bucket.bucket_arn,
+            output_bucket_arn=s3_output_bucket.bucket_arn
         )
 
-        glue_job.node.add_dependency(glue_kinesis_database)
-        glue_job.node.add_dependency(s3_output_bucket)
+        compaction_job.node.add_dependency(job_assets_bucket)
 
         # Cloudwatch Dashboard
         dashboard = cloudwatch.CfnDashboard(
@@ -186,11 +581,11 @@ class PipelineStack(Stack):
             .substitute(
                 region=self.region,
                 kinesis_data_stream_name=kinesis_data_stream.stream_name,
-                glue_job_name=glue_job.job.name,
+                glue_job_name="{}-job".format(prefix),
+                metrics_namespace=metrics_namespace,
                 s3_output_bucket_name=s3_output_bucket.bucket_name,
             )
         )
 
         dashboard.node.add_dependency(kinesis_data_stream)
-        dashboard.node.add_dependency(glue_job)
         dashboard.node.add_dependency(s3_output_bucket)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Adaptive window size of the steady read profile of the Glue ETL Job.
+
+The window size of a streaming query is fixed while it runs. The job observes the duration and records of the recent
+micro-batches of the output query and the lag of the stream, and restarts the queries with another window size
+between the configured bounds when the window no longer fits the load:
+- Micro-batches which take most of the window fall behind, the window grows so the overhead of a micro-batch is
+  spread over more records.
+- A lag of the stream while micro-batches take a small part of the window means the fetch limits of a micro-batch cap
+  the throughput, the window shrinks so more micro-batches read the stream.
+- Micro-batches with few records, e.g. at night, write tiny files, the window grows until they reach the minimum
+  records with some headroom.
+- Micro-batches with many records which take a small part of the window add latency, the window shrinks.
+
+The decision only depends on the observations, the window size and the policy, so it can be simulated against load
+curves without Spark or AWS, see tools/simulate_window_size.py. Small changes are skipped, since every change restarts
+the streaming queries.
+"""
+import re
+import statistics
+from collections import namedtuple
+
+# A completed micro-batch of the output query
+BatchObservation = namedtuple("BatchObservation", ["duration_seconds", "records"])
+
+WindowPolicy = namedtuple("WindowPolicy", [
+    "min_window_seconds",
+    "max_window_seconds",
+    # The share of the window a micro-batch should take, between 0 and 1
+    "target_utilization",
+    # Micro-batches with fewer records write small files
+    "min_records",
+    # The lag of the stream above which the window shrinks to read the stream more often
+    "max_lag_seconds",
+    # The relative change of the window below which it is kept
+    "min_change",
+    # The seconds a window is kept after a change, unless the micro-batches take longer than the window
+    "cooldown_seconds"
+])
+
+WindowDecision = namedtuple("WindowDecision", ["window_seconds", "reason"])
+
+# The last change of the window, whether it grew and how many seconds ago
+WindowChange = namedtuple("WindowChange", ["grew", "seconds_ago"])
+
+# The number of recent micro-batches a decision is based on
+OBSERVED_BATCHES = 5
+
+# Windows are sized for this multiple of the minimum records, so a small rise or fall of the load keeps the window
+RECORDS_HEADROOM = 1.5
+
+_WINDOW_SIZE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(second|minute|hour)s?$")
+
+_UNIT_SECONDS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+def parse_window_size(window_size):
+    """
+    Return the seconds of a window size like "10 seconds", "2 minutes" or "1 hour". The capacity checks of the stack
+    at synth time parse the window sizes with this function too, so it only depends on the standard library.
+    """
+    match = _WINDOW_SIZE_PATTERN.match(str(window_size).strip())
+    if not match:
+        raise ValueError("Invalid window size {!r}, expected e.g. '10 seconds' or '2 minutes'".format(window_size))
+    return float(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def format_window_size(window_seconds):
+    return "{} seconds".format(int(window_seconds))
+
+
+def load_window_policy(config):
+    """Validate the adaptive window config of the job arguments. Returns None for an empty config, which disables it."""
+    if not config:
+        return None
+    policy = WindowPolicy(
+        min_window_seconds=parse_window_size(config["min-window-size"]),
+        max_window_seconds=parse_window_size(config["max-window-size"]),
+        target_utilization=float(config["target-utilization"]),
+        min_records=int(config["min-records"]),
+        max_lag_seconds=float(config["max-lag-seconds"]),
+        min_change=float(config.get("min-change", 0.25)),
+        cooldown_seconds=float(config.get("cooldown-seconds", 900))
+    )
+    return validate_window_policy(policy)
+
+
+def validate_window_policy(policy):
+    if not 1 <= policy.min_window_seconds <= policy.max_window_seconds:
+        raise ValueError("Expected 1 second <= min window <= max window, got {} and {} seconds".format(
+            policy.min_window_seconds, policy.max_window_seconds))
+    if not 0 < policy.target_utilization < 1:
+        raise ValueError("Expected 0 < target utilization < 1, got {}".format(policy.target_utilization))
+    if policy.min_records < 0 or policy.max_lag_seconds <= 0 or policy.min_change < 0 or policy.cooldown_seconds < 0:
+        raise ValueError("Min records, max lag, min change and cooldown must not be negative")
+    return policy
+
+
+def decide_window(observations, lag_seconds, window_seconds, policy, last_change=None):
+    """
+    Decide the window size for the recent micro-batches, oldest first, and the lag of the stream in seconds or None if
+    it is unknown. The last change is a WindowChange, or None if the window did not change yet. Returns a
+    WindowDecision with the unchanged window size if nothing is to be done.
+    """
+    recent = observations[-OBSERVED_BATCHES:]
+    if len(recent) < OBSERVED_BATCHES:
+        return WindowDecision(window_seconds, "too few micro-batches")
+
+    duration = statistics.median(observation.duration_seconds for observation in recent)
+    records = statistics.median(observation.records for observation in recent)
+    utilization = duration / window_seconds
+    # The smallest window the micro-batches fit into at the target utilization
+    fitting_window = duration / policy.target_utilization
+    # The window which reads the minimum records with headroom, records scale with the window
+    records_window = window_seconds * RECORDS_HEADROOM * policy.min_records / records if records else \
+        policy.max_window_seconds
+
+    # A reversal of the last change needs its signal in every recent micro-batch, not only in the median one
+    grew = last_change.grew if last_change is not None else None
+    shrinking_records = [observation.records for observation in recent] if grew is True else [records]
+    growing_records = [observation.records for observation in recent] if grew is False else [records]
+
+    if utilization > policy.target_utilization:
+        wanted, reason = fitting_window, "micro-batches take {:.0%} of the window".format(utilization)
+    elif lag_seconds is not None and lag_seconds > policy.max_lag_seconds:
+        wanted, reason = fitting_window, "the stream is {:.0f} seconds behind".format(lag_seconds)
+    elif max(growing_records) < policy.min_records:
+        wanted, reason = records_window, "micro-batches of {:.0f} records".format(records)
+    elif min(shrinking_records) > RECORDS_HEADROOM ** 2 * policy.min_records:
+        # The shortest window which reads the minimum records with headroom and fits the micro-batches
+        if fitting_window > records_window:
+            wanted, reason = fitting_window, "micro-batches take {:.0%} of the window".format(utilization)
+        else:
+            wanted, reason = records_window, "micro-batches of {:.0f} records".format(records)
+    else:
+        return WindowDecision(window_seconds, "micro-batches of {:.0f} records take {:.0%} of the window".format(
+            records, utilization))
+
+    wanted = round(min(policy.max_window_seconds, max(policy.min_window_seconds, wanted)))
+    if abs(wanted - window_seconds) < policy.min_change * window_seconds:
+        return WindowDecision(window_seconds, "within {:.0%} of the window".format(policy.min_change))
+
+    # Every change restarts the streaming queries, so the window is kept for the cooldown unless the micro-batches take
+    # longer than the window and the job falls behind
+    if last_change is not None and last_change.seconds_ago < policy.cooldown_seconds and duration <= window_seconds:
+        return WindowDecision(window_seconds, "changed {:.0f} seconds ago, {}".format(last_change.seconds_ago, reason))
+    return WindowDecision(wanted, reason)
@@ -0,0 +1,372 @@
+"""
+Windowed KPI aggregates of the Glue ETL Job.
+
+The aggregates are computed per key, e.g. che_id, over tumbling or sliding event time windows of the selected fields.
+They are computed in the micro-batches of the output query from its persisted batch, so the stream has a single
+consumer. Every batch is aggregated into partial aggregates per window and key, which are merged into the windows
+still open from the previous batches. The watermark is the latest event time of the records minus the watermark delay:
+a window is written once the watermark passes its end, and records of windows which were already written are dropped.
+
+The open windows are written next to the checkpoints of the output query after every micro-batch, so they continue
+across retries, restarts of the streaming queries with another read profile and restarts of the job.
+"""
+import re
+from collections import namedtuple
+
+from pyspark.sql.functions import array_distinct
+from pyspark.sql.functions import col
+from pyspark.sql.functions import collect_list
+from pyspark.sql.functions import collect_set
+from pyspark.sql.functions import count
+from pyspark.sql.functions import date_format
+from pyspark.sql.functions import flatten
+from pyspark.sql.functions import lit
+from pyspark.sql.functions import max as max_
+from pyspark.sql.functions import min as min_
+from pyspark.sql.functions import size
+from pyspark.sql.functions import slice as slice_
+from pyspark.sql.functions import sum as sum_
+from pyspark.sql.functions import to_timestamp
+from pyspark.sql.functions import when
+from pyspark.sql.functions import window
+
+from adaptive_window import parse_window_size
+
+AGGREGATE_PARTITION_KEYS = ["window_name", "event_date"]
+
+# Aggregate functions whose partial aggregates of the batches can be merged. The distinct values of a window are kept
+# until it is written, so count_distinct counts them exactly and needs a cap on the number of values it keeps.
+_FUNCTIONS = ["count", "count_distinct", "avg", "min", "max", "sum"]
+
+# The columns of a window of a partial aggregate
+_WINDOW_COLUMNS = ["window_name", "window_start", "window_end"]
+
+# The latest event time of the records merged into the open windows, which the watermark follows
+_WATERMARK_SCHEMA = "max_event_seconds double"
+
+_NAME_PATTERN = re.compile(r"[a-z_][a-z0-9_]*$")
+
+AggregateWindow = namedtuple("AggregateWindow", ["name", "duration", "slide"])
+Aggregate = namedtuple("Aggregate", ["name", "function", "column", "where", "max_distinct"])
+Aggregates = namedtuple("Aggregates", ["key", "key_type", "event_time", "watermark", "windows", "aggregates"])
+
+
+class AggregateConfigError(ValueError):
+    pass
+
+
+def load_aggregates(config, column_names):
+    """
+    Validate the aggregates config against the output column names of the selected fields. Returns None for an empty
+    config, which disables the aggregates.
+    """
+    if not config:
+        return None
+
+    def require(name):
+        if not isinstance(config.get(name), str) or not config[name]:
+            raise AggregateConfigError("Aggregates config must contain a non-empty string '{}'".format(name))
+        return config[name]
+
+    def require_column(column_name):
+        if column_name not in column_names:
+            raise AggregateConfigError("Column '{}' is not one of the selected fields".format(column_name))
+        return column_name
+
+    windows = []
+    for entry in config.get("windows") or []:
+        if not isinstance(entry, dict) or not _NAME_PATTERN.match(str(entry.get("name"))) or not entry.get("duration"):
+            raise AggregateConfigError("Windows must have a name and a duration, got {!r}".format(entry))
+        windows.append(AggregateWindow(entry["name"], entry["duration"], entry.get("slide")))
+    if not windows or len({aggregate_window.name for aggregate_window in windows}) != len(windows):
+        raise AggregateConfigError("Aggregates config must contain windows with distinct names")
+
+    aggregates = []
+    for entry in config.get("aggregates") or []:
+        for name, spec in entry.items():
+            if not _NAME_PATTERN.match(name):
+                raise AggregateConfigError("Invalid aggregate name {!r}".format(name))
+            if spec.get("function") not in _FUNCTIONS:
+                raise AggregateConfigError("Unsupported function {!r} of aggregate '{}', expected one of {}".format(
+                    spec.get("function"), name, ", ".join(_FUNCTIONS)))
+            if spec.get("column") is None and spec["function"] != "count":
+                raise AggregateConfigError("Aggregate '{}' needs a column".format(name))
+            max_distinct = spec.get("max-distinct")
+            if spec["function"] == "count_distinct" and (
+                    not isinstance(max_distinct, int) or isinstance(max_distinct, bool) or max_distinct < 1):
+                raise AggregateConfigError(
+                    "Aggregate '{}' needs a positive 'max-distinct', the number of distinct values a window keeps"
+                    .format(name))
+            where = spec.get("where") or {}
+            for column_name in where:
+                require_column(column_name)
+            aggregates.append(Aggregate(
+                name,
+                spec["function"],
+                require_column(spec["column"]) if spec.get("column") is not None else None,
+                where,
+                max_distinct if spec["function"] == "count_distinct" else None
+            ))
+    if not aggregates or len({aggregate.name for aggregate in aggregates}) != len(aggregates):
+        raise AggregateConfigError("Aggregates config must contain aggregates with distinct names")
+    try:
+        parse_window_size(require("watermark"))
+    except ValueError as error:
+        raise AggregateConfigError("Invalid watermark of the aggregates: {}".format(error))
+
+    return Aggregates(
+        key=require_column(require("key")),
+        key_type=require("key-type"),
+        event_time=require_column(require("event-time")),
+        watermark=require("watermark"),
+        windows=windows,
+        aggregates=aggregates
+    )
+
+
+def _partial_columns(aggregate):
+    value = col(aggregate.column) if aggregate.column is not None else lit(1)
+    if aggregate.function in ["avg", "min", "max", "sum"]:
+        value = value.cast("double")
+    for column_name, expected in aggregate.where.items():
+        value = when(col(column_name) == lit(expected), value)
+    if aggregate.function == "avg":
+        return [
+            sum_(value).alias("_{}_sum".format(aggregate.name)),
+            count(value).alias("_{}_count".format(aggregate.name))
+        ]
+    if aggregate.function == "count_distinct":
+        # One value beyond the cap is kept, so windows exceeding it are known
+        return [slice_(collect_set(value), 1, aggregate.max_distinct + 1).alias("_{}_values".format(aggregate.name))]
+    if aggregate.function == "count":
+        return [count(value).alias(aggregate.name)]
+    return [{"min": min_, "max": max_, "sum": sum_}[aggregate.function](value).alias(aggregate.name)]
+
+
+def _merged_columns(aggregate):
+    if aggregate.function == "avg":
+        names = ["_{}_sum".format(aggregate.name), "_{}_count".format(aggregate.name)]
+        return [sum_(col(name)).alias(name) for name in names]
+    if aggregate.function == "count_distinct":
+        name = "_{}_values".format(aggregate.name)
+        return [slice_(array_distinct(flatten(collect_list(col(name)))), 1, aggregate.max_distinct + 1).alias(name)]
+    merge = {"count": sum_, "sum": sum_, "min": min_, "max": max_}[aggregate.function]
+    return [merge(col(aggregate.name)).alias(aggregate.name)]
+
+
+def _final_column(aggregate):
+    if aggregate.function == "avg":
+        return (col("_{}_sum".format(aggregate.name)) / col("_{}_count".format(aggregate.name))).alias(aggregate.name)
+    if aggregate.function == "count_distinct":
+        # Windows with more distinct values than the cap have no count
+        distinct = size(col("_{}_values".format(aggregate.name)))
+        return when(distinct <= aggregate.max_distinct, distinct).cast("bigint").alias(aggregate.name)
+    return col(aggregate.name)
+
+
+def aggregate_windows(data_frame, aggregates, watermark_seconds=None):
+    """
+    Aggregate the selected fields of a batch into partial aggregates per window and key of every window of the
+    aggregates config. Windows ending at or before the watermark in epoch seconds are dropped.
+    """
+    rows = data_frame \
+        .withColumn("_event_time", to_timestamp(col(aggregates.event_time))) \
+        .where(col("_event_time").isNotNull())
+    partials = None
+    for aggregate_window in aggregates.windows:
+        windowed = rows \
+            .groupBy(
+                window(col("_event_time"), aggregate_window.duration, aggregate_window.slide).alias("window"),
+                col(aggregates.key).cast(aggregates.key_type).alias(aggregates.key)
+            ) \
+            .agg(*[column for aggregate in aggregates.aggregates for column in _partial_columns(aggregate)]) \
+            .select(
+                lit(aggregate_window.name).alias("window_name"),
+                col("window.start").alias("window_start"),
+                col("window.end").alias("window_end"),
+                "*"
+            ) \
+            .drop("window")
+        partials = windowed if partials is None else partials.unionByName(windowed)
+    if watermark_seconds is not None:
+        partials = partials.where(col("window_end").cast("double") > lit(watermark_seconds))
+    return partials
+
+
+def merge_windows(partials, aggregates):
+    """Merge the partial aggregates of the same window and key."""
+    return partials \
+        .groupBy(*_WINDOW_COLUMNS, aggregates.key) \
+        .agg(*[column for aggregate in aggregates.aggregates for column in _merged_columns(aggregate)])
+
+
+def final_windows(windows, aggregates):
+    """The rows of the aggregates table of merged windows, with the window bounds as timestamps."""
+    return windows.select(
+        col(aggregates.key),
+        col("window_start"),
+        col("window_end"),
+        *[_final_column(aggregate) for aggregate in aggregates.aggregates],
+        col("window_name"),
+        date_format(col("window_start"), "yyyy-MM-dd").alias("event_date")
+    )
+
+
+def write_aggregates(data_frame, path, output_format, output_compression):
+    # Every micro-batch only holds the windows the watermark closed, so most batches are empty
+    if not data_frame.take(1):
+        return
+    data_frame.write \
+        .mode("append") \
+        .format(output_format) \
+        .option("compression", output_compression) \
+        .partitionBy(*AGGREGATE_PARTITION_KEYS) \
+        .save(path)
+
+
+class AggregateState:
+    """
+    The open windows of the aggregates between the micro-batches of the output query. The open windows and the
+    watermark after every batch are written to a prefix of its batch id, so a retried batch starts from the state of the
+    batch before it, and the job continues with the state after a restart. The closed windows of a batch are staged in
+    its prefix before the state is committed and moved into the aggregates table afterwards, so a batch retried after
+    the commit only moves the staged files which are left instead of writing its windows twice. The size of the open
+    windows is the number of keys times the windows a watermark delay spans, times max-distinct values of every
+    count_distinct aggregate.
+    """
+
+    def __init__(self, spark, aggregates, path):
+        self.spark = spark
+        self.aggregates = aggregates
+        self.path = path.rstrip("/")
+        self.watermark_delay_seconds = parse_window_size(aggregates.watermark)
+        self.batch_ids = None
+        self.batch_id = None
+        self.max_event_seconds = None
+        self.windows = None
+
+    def watermark_seconds(self):
+        if self.max_event_seconds is None:
+            return None
+        return self.max_event_seconds - self.watermark_delay_seconds
+
+    def _file_system(self, path):
+        jvm = self.spark.sparkContext._jvm
+        path = jvm.org.apache.hadoop.fs.Path(path)
+        return path.getFileSystem(self.spark.sparkContext._jsc.hadoopConfiguration()), path
+
+    def _list_batch_ids(self):
+        file_system, path = self._file_system(self.path)
+        if not file_system.exists(path):
+            return []
+        names = [status.getPath().getName() for status in file_system.listStatus(path)]
+        return sorted(int(name[len("batch="):]) for name in names if name.startswith("batch="))
+
+    def _batch_path(self, batch_id):
+        return "{}/batch={}/".format(self.path, batch_id)
+
+    def _delete(self, path):
+        file_system, path = self._file_system(path)
+        file_system.delete(path, True)
+
+    def _load(self, batch_id):
+        """Load the state after a batch. Returns False for a batch whose state was not committed."""
+        if batch_id is None:
+            self.windows, self.max_event_seconds, self.batch_id = None, None, None
+            return True
+        file_system, watermark_path = self._file_system(self._batch_path(batch_id) + "watermark")
+        rows = self.spark.read.schema(_WATERMARK_SCHEMA).json(watermark_path.toString()).collect() \
+            if file_system.exists(watermark_path) else []
+        if not rows:
+            return False
+        self.windows = self.spark.read.parquet(self._batch_path(batch_id) + "open")
+        self.max_event_seconds, self.batch_id = rows[0]["max_event_seconds"], batch_id
+        return True
+
+    def _move_closed(self, batch_id, path):
+        """Move the staged closed windows of a batch into their partitions of the aggregates table."""
+        jvm = self.spark.sparkContext._jvm
+        staged_file_system, staged_path = self._file_system(self._batch_path(batch_id) + "closed")
+        if not staged_file_system.exists(staged_path):
+            return
+        output_file_system, _ = self._file_system(path)
+        staged_prefix = staged_file_system.makeQualified(staged_path).toString().rstrip("/") + "/"
+        files = staged_file_system.listFiles(staged_path, True)
+        staged_files = []
+        while files.hasNext():
+            staged_file = files.next().getPath()
+            if not staged_file.getName().startswith(("_", ".")):
+                staged_files.append(staged_file)
+        # A staged file is deleted once it is copied, a copy interrupted before the delete is overwritten
+        for staged_file in staged_files:
+            relative_path = staged_file.toString()[len(staged_prefix):]
+            jvm.org.apache.hadoop.fs.FileUtil.copy(
+                staged_file_system,
+                staged_file,
+                output_file_system,
+                jvm.org.apache.hadoop.fs.Path(path.rstrip("/") + "/" + relative_path),
+                True,
+                True,
+                self.spark.sparkContext._jsc.hadoopConfiguration()
+            )
+        staged_file_system.delete(staged_path, True)
+
+    def apply(self, data_frame, batch_id, path, output_format, output_compression):
+        """Merge the selected fields of a batch into the open windows and write the windows the watermark closed."""
+        if self.batch_ids is None:
+            self.batch_ids = self._list_batch_ids()
+        if batch_id in self.batch_ids and (self.batch_id == batch_id or self._load(batch_id)):
+            print("Skipping the aggregates of batch {}, it was already merged".format(batch_id))
+            self._move_closed(batch_id, path)
+            return
+        if self.batch_ids and (self.batch_id is None or self.batch_id >= batch_id):
+            # The first batch of the job run, or a retried batch, starts from the latest committed state before it
+            previous = [state_batch_id for state_batch_id in self.batch_ids if state_batch_id < batch_id]
+            while previous and not self._load(previous[-1]):
+                previous.pop()
+            if not previous:
+                self._load(None)
+
+        partials = aggregate_windows(data_frame, self.aggregates, self.watermark_seconds())
+        if self.windows is not None and self.windows.columns != partials.columns:
+            print("Starting the open windows of the aggregates over, the aggregates config changed")
+            self.windows = None
+        if self.windows is not None:
+            partials = partials.unionByName(self.windows)
+        windows = merge_windows(partials, self.aggregates).persist()
+        try:
+            batch_max_event_seconds = data_frame \
+                .select(max_(to_timestamp(col(self.aggregates.event_time))).cast("double")) \
+                .first()[0]
+            max_event_seconds = self.max_event_seconds
+            if batch_max_event_seconds is not None:
+                max_event_seconds = max(max_event_seconds or batch_max_event_seconds, batch_max_event_seconds)
+            watermark_seconds = None if max_event_seconds is None else max_event_seconds - self.watermark_delay_seconds
+            closed = col("window_end").cast("double") <= lit(watermark_seconds) \
+                if watermark_seconds is not None else lit(False)
+
+            # The watermark is written last and commits the state of the batch
+            batch_path = self._batch_path(batch_id)
+            self._delete(batch_path)
+            write_aggregates(final_windows(windows.where(closed), self.aggregates), batch_path + "closed",
+                             output_format, output_compression)
+            windows.where(~closed).write.mode("overwrite").parquet(batch_path + "open")
+            self.spark.createDataFrame([(max_event_seconds,)], _WATERMARK_SCHEMA) \
+                .coalesce(1) \
+                .write \
+                .mode("overwrite") \
+                .json(batch_path + "watermark")
+        finally:
+            windows.unpersist()
+        if batch_id not in self.batch_ids:
+            self.batch_ids.append(batch_id)
+            self.batch_ids.sort()
+
+        self._move_closed(batch_id, path)
+
+        # The state the batch started from is kept until the next batch, in case the batch is retried
+        oldest_kept = self.batch_id if self.batch_id is not None else batch_id
+        for state_batch_id in [state_batch_id for state_batch_id in self.batch_ids if state_batch_id < oldest_kept]:
+            self._delete(self._batch_path(state_batch_id))
+            self.batch_ids.remove(state_batch_id)
+        self._load(batch_id)
@@ -0,0 +1,45 @@
+"""
+SSM parameters read with a TTL cache, so the jobs pick up changed values without a restart.
+"""
+import time
+
+
+class CachedParameter:
+    """
+    The value and version of an SSM parameter, read again at most every ttl seconds. If reading fails after the value
+    was read once, the cached value is kept until the next read.
+    """
+
+    def __init__(self, name, ttl, client=None):
+        self.name = name
+        self.ttl = ttl
+        self.client = client
+        self.version = None
+        self.value = None
+        self.read_at = None
+
+    def get(self):
+        """Return the version and value of the parameter."""
+        if self.read_at is not None and time.monotonic() - self.read_at < self.ttl:
+            return self.version, self.value
+
+        if self.client is None:
+            # Imported here, so the transformations can be used locally without the AWS SDK
+            import boto3
+
+            self.client = boto3.client("ssm")
+
+        from botocore.exceptions import BotoCoreError
+        from botocore.exceptions import ClientError
+
+        try:
+            parameter = self.client.get_parameter(Name=self.name)["Parameter"]
+        except (BotoCoreError, ClientError) as error:
+            if self.read_at is None:
+                raise
+            print("Keeping version {} of parameter {}, reading it failed: {}".format(self.version, self.name, error))
+        else:
+            self.version = parameter["Version"]
+            self.value = parameter["Value"]
+        self.read_at = time.monotonic()
+        return self.version, self.value
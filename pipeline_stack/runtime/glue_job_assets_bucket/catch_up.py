@@ -0,0 +1,106 @@
+"""
+Read profiles of the Glue ETL Job and the switching between them.
+
+The steady profile keeps the latency low with short micro-batches. When the job is far behind the latest records of
+the stream, e.g. after an outage or a start from an earlier position, it switches to the catch-up profile, which reads
+longer micro-batches until the backlog is processed. The fetch limits of both profiles bound the records of a
+micro-batch, so a backlog never turns into a micro-batch larger than the executors can hold.
+
+The lag is the MillisBehindLatest of the GetRecords calls on the stream, which Kinesis publishes as the maximum of the
+GetRecords.IteratorAgeMilliseconds metric. Switching the profile restarts the streaming queries, which continue from
+their checkpoints.
+"""
+import datetime
+import re
+from collections import namedtuple
+
+STARTING_POSITIONS = ["TRIM_HORIZON", "LATEST"]
+
+# The interval of the lag checks, which is the resolution of the Kinesis metric
+LAG_CHECK_SECONDS = 60
+
+# A profile is kept at least this long, since every switch restarts the streaming queries
+MIN_PROFILE_SECONDS = 300
+
+_TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(Z|[+-]\d{2}:\d{2})$")
+
+ReadProfile = namedtuple("ReadProfile", ["name", "window_size", "max_fetch_time_ms", "max_fetch_records_per_shard"])
+
+
+class StartingPositionError(ValueError):
+    pass
+
+
+def validate_starting_position(starting_position):
+    """Return the starting position, TRIM_HORIZON, LATEST or a timestamp like 2023-03-01T06:00:00Z."""
+    if starting_position not in STARTING_POSITIONS and not _TIMESTAMP_PATTERN.match(str(starting_position)):
+        raise StartingPositionError(
+            "Invalid starting position {!r}, expected one of {} or a timestamp like 2023-03-01T06:00:00Z".format(
+                starting_position, ", ".join(STARTING_POSITIONS)))
+    return starting_position
+
+
+def load_read_profiles(config):
+    """Return the steady and catch-up read profiles of a config like {"steady": {"window-size": ...}, ...}."""
+    return {
+        name: ReadProfile(
+            name,
+            config[name]["window-size"],
+            int(config[name]["max-fetch-time-ms"]),
+            int(config[name]["max-fetch-records-per-shard"])
+        )
+        for name in ["steady", "catch-up"]
+    }
+
+
+def checkpoint_suffix(starting_position):
+    """
+    The suffix of the checkpoint locations of a starting position. The starting position only applies to queries
+    without a checkpoint, so every position other than TRIM_HORIZON gets checkpoints of its own.
+    """
+    if starting_position == "TRIM_HORIZON":
+        return ""
+    return "-" + re.sub(r"[^0-9a-z]", "", starting_position.lower())
+
+
+def source_options(profile, starting_position):
+    """The options of the Kinesis source for a read profile."""
+    return {
+        "startingPosition": starting_position,
+        "maxFetchTimeInMs": profile.max_fetch_time_ms,
+        "maxFetchRecordsPerShard": profile.max_fetch_records_per_shard
+    }
+
+
+def choose_profile(current, lag_seconds, catch_up_lag_seconds, steady_lag_seconds):
+    """
+    Return the name of the profile for the lag. The job switches to catch-up at a lag of catch_up_lag_seconds and back
+    to steady at steady_lag_seconds, the gap between both keeps it from switching back and forth. An unknown lag keeps
+    the current profile.
+    """
+    if lag_seconds is None:
+        return current
+    if current == "steady" and lag_seconds >= catch_up_lag_seconds:
+        return "catch-up"
+    if current == "catch-up" and lag_seconds <= steady_lag_seconds:
+        return "steady"
+    return current
+
+
+def seconds_behind_latest(cloudwatch, stream_name, end=None, minutes=5):
+    """
+    Return the latest maximum MillisBehindLatest of the stream in seconds, or None if no records were read during the
+    last minutes.
+    """
+    end = end or datetime.datetime.now(datetime.timezone.utc)
+    response = cloudwatch.get_metric_statistics(
+        Namespace="AWS/Kinesis",
+        MetricName="GetRecords.IteratorAgeMilliseconds",
+        Dimensions=[{"Name": "StreamName", "Value": stream_name}],
+        StartTime=end - datetime.timedelta(minutes=minutes),
+        EndTime=end,
+        Period=60,
+        Statistics=["Maximum"]
+    )
+    datapoints = sorted(response["Datapoints"], key=lambda datapoint: datapoint["Timestamp"])
+    return datapoints[-1]["Maximum"] / 1000 if datapoints else None
@@ -0,0 +1,71 @@
+"""
+S3 operations of the Glue compaction job.
+
+Compacted files are staged outside of the partition prefixes and swapped into the partition with a manifest, which
+lists the staged files with their keys in the partition and the source files they replace. S3 cannot rename several
+objects atomically, so the swap copies the staged files first, then deletes the source files, the staged files and the
+manifest. A run which fails during the swap leaves the manifest, and the next run completes the swap from it.
+"""
+import json
+import posixpath
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def list_data_objects(s3, bucket, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            # Hidden files like _SUCCESS markers are not part of the table data
+            if not posixpath.basename(obj["Key"]).startswith(("_", ".")):
+                yield obj
+
+
+def read_manifest(s3, bucket, key):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+
+def write_manifest(s3, bucket, key, manifest):
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode("utf-8"))
+
+
+def delete_objects(s3, bucket, keys):
+    # A single request deletes up to 1000 objects, keys which do not exist count as deleted
+    for i in range(0, len(keys), 1000):
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True}
+        )
+        if response.get("Errors"):
+            raise ManifestError("Failed to delete {} objects, e.g. {Key}: {Message}".format(
+                len(response["Errors"]), **response["Errors"][0]))
+
+
+def swap_in(s3, bucket, partition_prefix, manifest_key, manifest):
+    """
+    Swap the staged files of a manifest into the partition. Every step can be repeated after a failure: staged files
+    which are gone were copied before, as long as their compacted file exists, and source and staged files which are
+    gone were deleted before. Files written into the partition after it was listed, e.g. late records, are left in
+    place.
+    """
+    staging_prefix = posixpath.dirname(manifest_key) + "/"
+    partition_keys = {obj["Key"] for obj in list_data_objects(s3, bucket, partition_prefix)}
+    staged_keys = {obj["Key"] for obj in list_data_objects(s3, bucket, staging_prefix)}
+
+    for staged_key, compacted_key in manifest["compacted"].items():
+        if staged_key in staged_keys:
+            s3.copy_object(Bucket=bucket, Key=compacted_key, CopySource={"Bucket": bucket, "Key": staged_key})
+        elif compacted_key not in partition_keys:
+            raise ManifestError("Neither the staged file {} nor its compacted file {} of manifest {} exist".format(
+                staged_key, compacted_key, manifest_key))
+
+    delete_objects(s3, bucket, [key for key in manifest["sources"] if key in partition_keys])
+    delete_objects(s3, bucket, [key for key in manifest["compacted"] if key in staged_keys])
+    delete_objects(s3, bucket, [manifest_key])
+    print("Compacted {} files in {} into {} files".format(
+        len(manifest["sources"]), partition_prefix, len(manifest["compacted"])))
@@ -0,0 +1,124 @@
+import datetime
+import math
+import posixpath
+import sys
+import uuid
+
+import boto3
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+
+from compaction import delete_objects
+from compaction import list_data_objects
+from compaction import read_manifest
+from compaction import swap_in
+from compaction import write_manifest
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "s3OutputBucket",
+        "outputFormat",
+        "outputCompression",
+        "targetFileSizeMb",
+        "minPartitionAgeHours",
+        "lookbackHours"
+    ]
+)
+sc = SparkContext()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+sc._jsc.hadoopConfiguration().set("mapreduce.fileoutputcommitter.marksuccessfuljobs", "false")
+
+# Read configuration
+param_s3_output_bucket = args['s3OutputBucket']
+param_output_format = args['outputFormat']
+param_output_compression = args['outputCompression']
+param_target_file_size = int(args['targetFileSizeMb']) * 1024 * 1024
+param_min_partition_age_hours = int(args['minPartitionAgeHours'])
+param_lookback_hours = int(args['lookbackHours'])
+
+# Compacted files are staged outside of the partition prefixes, where they are invisible to Athena. Every partition has
+# a staging prefix of its own, which holds the manifest of its swap.
+run_id = uuid.uuid4().hex
+staging_prefix = "_compaction/"
+
+s3 = boto3.client("s3")
+
+
+# Partitions of hours which ended at least minPartitionAgeHours ago are closed, the streaming job writes no new files
+# into them except for late records
+def closed_partitions(now):
+    newest_hour = (now - datetime.timedelta(hours=param_min_partition_age_hours)).replace(
+        minute=0, second=0, microsecond=0)
+    for offset in range(param_lookback_hours):
+        hour = newest_hour - datetime.timedelta(hours=offset)
+        yield "event_date={:%Y-%m-%d}/event_hour={:%H}/".format(hour, hour)
+
+
+def compact_partition(partition_prefix):
+    partition_staging_prefix = staging_prefix + partition_prefix
+    manifest_key = partition_staging_prefix + "_manifest.json"
+
+    # A manifest is left by a run which failed during the swap, which is completed before anything else
+    manifest = read_manifest(s3, param_s3_output_bucket, manifest_key)
+    if manifest is not None:
+        print("Completing the compaction of {} of run {}".format(partition_prefix, manifest["run_id"]))
+        swap_in(s3, param_s3_output_bucket, partition_prefix, manifest_key, manifest)
+        return True
+
+    # Staged files without a manifest are left by a run which failed before the swap, they were never swapped in
+    delete_objects(s3, param_s3_output_bucket, [
+        obj["Key"] for obj in list_data_objects(s3, param_s3_output_bucket, partition_staging_prefix)])
+
+    objects = list(list_data_objects(s3, param_s3_output_bucket, partition_prefix))
+    total_size = sum(obj["Size"] for obj in objects)
+    file_count = max(1, math.ceil(total_size / param_target_file_size))
+
+    # Skip partitions which would not end up with fewer files
+    if len(objects) <= file_count:
+        return False
+
+    paths = ["s3://{}/{}".format(param_s3_output_bucket, obj["Key"]) for obj in objects]
+    run_staging_prefix = "{}{}/".format(partition_staging_prefix, run_id)
+
+    # JSON lines are copied as text, which keeps them byte for byte instead of re-inferring their schema. The columns
+    # of the other formats are merged, since files written before and after a change of the selected fields differ.
+    if param_output_format == "json":
+        data_frame = spark.read.text(paths)
+        output_format = "text"
+    else:
+        data_frame = spark.read.format(param_output_format).option("mergeSchema", "true").load(paths)
+        output_format = param_output_format
+
+    data_frame.coalesce(file_count) \
+        .write \
+        .mode("overwrite") \
+        .format(output_format) \
+        .option("compression", param_output_compression) \
+        .save("s3://{}/{}".format(param_s3_output_bucket, run_staging_prefix))
+
+    # The manifest is written once all compacted files are staged, it lists the source files the swap removes
+    manifest = {
+        "run_id": run_id,
+        "sources": [obj["Key"] for obj in objects],
+        "compacted": {
+            obj["Key"]: "{}compacted-{}-{}".format(partition_prefix, run_id, posixpath.basename(obj["Key"]))
+            for obj in list_data_objects(s3, param_s3_output_bucket, run_staging_prefix)
+        }
+    }
+    write_manifest(s3, param_s3_output_bucket, manifest_key, manifest)
+    swap_in(s3, param_s3_output_bucket, partition_prefix, manifest_key, manifest)
+    return True
+
+
+for partition in closed_partitions(datetime.datetime.utcnow()):
+    compact_partition(partition)
+
+job.commit()
@@ -0,0 +1,306 @@
+"""
+Deadband and swinging-door compression of the selected fields of the Glue ETL Job.
+
+High-frequency sensor values, e.g. the hoisting height of a crane, mostly repeat or change along a line. With a
+compression config, a row of a key, e.g. a crane, is only written when one of its compressed fields moves beyond the
+tolerance of the field, or when the heartbeat interval passed since the last written row of the key:
+- deadband: the value differs from the value of the last written row by more than the tolerance. A tolerance of 0
+  writes every change, which is the only tolerance of string fields.
+- swinging-door: no straight line from the value of the last written row fits the values since within the tolerance.
+  The last row the line still fitted is written, so the written rows interpolate every value within the tolerance.
+
+A change from or to null is always beyond the tolerance. The other fields of a row do not decide whether it is written,
+so status fields which must not be lost are compressed with a tolerance of 0.
+
+The decision only depends on the rows of a key and the state of the key, so it runs with plain Python values, see
+compress_rows. The state of a key is the time and the values of its last written row, the doors of its swinging-door
+fields and the row held back for them.
+"""
+import json
+from collections import namedtuple
+
+METHODS = ["deadband", "swinging-door"]
+
+# The types a field can be compressed with, timestamps only order the rows
+_NUMERIC_TYPES = ["int", "double"]
+
+# The column of the state rows, which is null for the rows of a batch
+STATE = "_compression_state"
+
+FieldCompression = namedtuple("FieldCompression", ["column", "method", "tolerance"])
+
+Compression = namedtuple("Compression", ["key", "order_by", "heartbeat_seconds", "fields"])
+
+
+class CompressionConfigError(ValueError):
+    pass
+
+
+def load_compression(config, selected_fields):
+    """
+    Validate the compression of the selected fields config against its selected fields, as returned by
+    load_selected_fields. Returns None for a config without compression.
+    """
+    compression_config = config.get("compression")
+    if not compression_config:
+        return None
+
+    field_types = {column_name: field_type for column_name, _, field_type in selected_fields}
+    key = compression_config.get("key")
+    order_by = compression_config.get("order-by")
+    if key not in field_types:
+        raise CompressionConfigError("Compression key {!r} is not a selected field".format(key))
+    if field_types.get(order_by) != "timestamp":
+        raise CompressionConfigError("Compression order-by {!r} is not a selected timestamp field".format(order_by))
+    heartbeat_seconds = compression_config.get("heartbeat-seconds")
+    if not isinstance(heartbeat_seconds, (int, float)) or heartbeat_seconds <= 0:
+        raise CompressionConfigError("Compression heartbeat-seconds must be a positive number, got {!r}".format(
+            heartbeat_seconds))
+
+    fields = []
+    for entry in config["selected-fields"]:
+        for column_name, field in entry.items():
+            field_compression = field.get("compression") if isinstance(field, dict) else None
+            if field_compression is None:
+                continue
+            method = field_compression.get("method")
+            tolerance = field_compression.get("tolerance", 0)
+            field_type = field_types[column_name]
+            if method not in METHODS:
+                raise CompressionConfigError("Unsupported compression {!r} of column {!r}, expected one of {}".format(
+                    method, column_name, ", ".join(METHODS)))
+            if column_name in (key, order_by) or field_type == "timestamp":
+                raise CompressionConfigError("Column {!r} cannot be compressed".format(column_name))
+            if not isinstance(tolerance, (int, float)) or tolerance < 0:
+                raise CompressionConfigError("Tolerance of column {!r} must not be negative, got {!r}".format(
+                    column_name, tolerance))
+            if field_type not in _NUMERIC_TYPES and (method != "deadband" or tolerance):
+                raise CompressionConfigError("Column {!r} of type {} only supports a deadband of 0".format(
+                    column_name, field_type))
+            if method == "swinging-door" and not tolerance:
+                raise CompressionConfigError("Swinging door of column {!r} needs a positive tolerance".format(
+                    column_name))
+            fields.append(FieldCompression(column_name, method, tolerance))
+
+    if not fields:
+        raise CompressionConfigError("Compression needs at least one field with a 'compression'")
+    return Compression(key, order_by, heartbeat_seconds, tuple(fields))
+
+
+def _changed(value, last_value, tolerance):
+    if value is None or last_value is None:
+        return value is not last_value
+    if not tolerance:
+        return value != last_value
+    return abs(value - last_value) > tolerance
+
+
+def _archive(row, time, compression):
+    """The state of a key after writing a row."""
+    return {
+        "time": time,
+        "values": {field.column: row[field.column] for field in compression.fields},
+        "doors": {},
+        "held_time": None
+    }
+
+
+def _door_closed(state, row, time, field):
+    """
+    Narrow the doors of a swinging-door field to the row. The doors are the steepest and the flattest slope of a line
+    from the last written value which fits all values since within the tolerance. They are closed for a row if the
+    line to its value leaves them, so the line to the held row always fits the rows before it.
+    """
+    value, last_value = row[field.column], state["values"].get(field.column)
+    elapsed = time - state["time"]
+    if value is None or last_value is None or elapsed <= 0:
+        return _changed(value, last_value, field.tolerance)
+    upper = (value + field.tolerance - last_value) / elapsed
+    lower = (value - field.tolerance - last_value) / elapsed
+    if field.column in state["doors"]:
+        doors_upper, doors_lower = state["doors"][field.column]
+        if not doors_lower <= (value - last_value) / elapsed <= doors_upper:
+            return True
+        upper, lower = min(upper, doors_upper), max(lower, doors_lower)
+    state["doors"][field.column] = [upper, lower]
+    return False
+
+
+def compress_rows(rows, times, state, held, compression):
+    """
+    Compress the rows of a key, oldest first, with their times in epoch seconds or None. The state and the held row are
+    those of the previous rows of the key, or None. Returns the rows to write and the new state and held row.
+    """
+    deadband_fields = [field for field in compression.fields if field.method == "deadband"]
+    swinging_door_fields = [field for field in compression.fields if field.method == "swinging-door"]
+    written = []
+    for row, time in zip(rows, times):
+        if time is None or state is None or state["time"] is None:
+            written.append(row)
+            state, held = _archive(row, time, compression), None
+            continue
+
+        # Every door is narrowed, so the list is not short-circuited like any()
+        closed = [_door_closed(state, row, time, field) for field in swinging_door_fields]
+        if any(closed) and held is not None:
+            # The held row is the last one a line fitted, it is written and the doors open again from it
+            written.append(held)
+            state = _archive(held, state["held_time"], compression)
+            held = None
+            closed = [_door_closed(state, row, time, field) for field in swinging_door_fields]
+
+        if any(closed) or time - state["time"] >= compression.heartbeat_seconds or any(
+                _changed(row[field.column], state["values"].get(field.column), field.tolerance)
+                for field in deadband_fields):
+            written.append(row)
+            state, held = _archive(row, time, compression), None
+        else:
+            held = row
+            state["held_time"] = time
+
+    return written, state, held
+
+
+def _records(pdf):
+    """The rows of a pandas DataFrame as dicts of Python values, with None for nulls."""
+    return pdf.astype(object).where(pdf.notna(), None).to_dict("records")
+
+
+def _compress_group(compression, columns):
+    def compress_group(pdf):
+        import pandas as pd
+
+        is_state = pdf[STATE].notna()
+        state, held = None, None
+        if is_state.any():
+            state = json.loads(pdf.loc[is_state, STATE].iloc[0])
+            if state["held_time"] is not None:
+                held = _records(pdf.loc[is_state, columns])[0]
+
+        batch = pdf[~is_state].sort_values(compression.order_by, kind="stable")
+        times = [None if pd.isna(time) else time.timestamp() for time in batch[compression.order_by]]
+        written, state, held = compress_rows(_records(batch[columns]), times, state, held, compression)
+
+        # The held row is kept in the columns of the state row, the key is always set
+        state_row = held if held is not None else dict.fromkeys(columns)
+        state_row = dict(state_row, **{compression.key: pdf[compression.key].iloc[0], STATE: json.dumps(state)})
+        result = pd.DataFrame(written + [state_row], columns=columns + [STATE])
+        for column in columns:
+            if pd.api.types.is_datetime64_any_dtype(pdf[column]):
+                result[column] = pd.to_datetime(result[column])
+            elif pd.api.types.is_numeric_dtype(pdf[column]):
+                result[column] = pd.to_numeric(result[column])
+        return result
+
+    return compress_group
+
+
+def compress(data_frame, compression, state_data_frame=None):
+    """
+    Compress the selected fields of a batch with the state rows of the previous batches. Returns the rows to write and
+    the new state rows, both from the same grouped result, which should be persisted. Rows without a key are written.
+    """
+    # Imported here, so compress_rows can be used without Spark
+    from pyspark.sql.functions import col
+    from pyspark.sql.functions import lit
+    from pyspark.sql.types import StructField
+    from pyspark.sql.types import StructType
+
+    columns = data_frame.columns
+    rows = data_frame.where(col(compression.key).isNotNull()).withColumn(STATE, lit(None).cast("string"))
+    if state_data_frame is not None:
+        rows = rows.unionByName(state_data_frame)
+    # The state rows have nulls in all columns but the key
+    schema = StructType([StructField(field.name, field.dataType, True) for field in rows.schema.fields])
+    result = rows.groupBy(compression.key).applyInPandas(_compress_group(compression, columns), schema=schema)
+    return result, data_frame.where(col(compression.key).isNull())
+
+
+def compress_closed(data_frame, compression):
+    """
+    Compress the selected fields of closed event dates without the state of earlier rows, like the replay does. The
+    rows held back by a swinging door are written as well, since no later row closes their doors.
+    """
+    from pyspark.sql.functions import col
+
+    result, keyless = compress(data_frame, compression)
+    written = result.where(col(STATE).isNull())
+    if any(field.method == "swinging-door" for field in compression.fields):
+        # The columns of a state row are only set besides the key if it holds a row
+        written = written.unionByName(result.where(col(STATE).isNotNull() & col(compression.order_by).isNotNull()))
+    return written.drop(STATE).unionByName(keyless)
+
+
+class CompressionState:
+    """
+    The compression state of the keys between the micro-batches of the output query. The state rows of every batch are
+    written to a prefix of its batch id, so a retried batch starts from the state of the batch before it, and the job
+    continues with the state after a restart. The prefixes are listed once at the start, afterwards the state of the
+    previous batch is read from its known prefix and older prefixes are deleted by their batch ids.
+    """
+
+    def __init__(self, spark, path):
+        self.spark = spark
+        self.path = path.rstrip("/")
+        self.batch_ids = None
+        self.state = None
+        self.state_batch_id = None
+        self.result = None
+
+    def _file_system(self):
+        jvm = self.spark.sparkContext._jvm
+        path = jvm.org.apache.hadoop.fs.Path(self.path)
+        return path.getFileSystem(self.spark.sparkContext._jsc.hadoopConfiguration()), path
+
+    def _list_batch_ids(self):
+        file_system, path = self._file_system()
+        if not file_system.exists(path):
+            return []
+        names = [status.getPath().getName() for status in file_system.listStatus(path)]
+        return sorted(int(name[len("batch="):]) for name in names if name.startswith("batch="))
+
+    def _batch_path(self, batch_id):
+        return "{}/batch={}/".format(self.path, batch_id)
+
+    def _delete(self, batch_id):
+        file_system, _ = self._file_system()
+        file_system.delete(self.spark.sparkContext._jvm.org.apache.hadoop.fs.Path(self._batch_path(batch_id)), True)
+        self.batch_ids.remove(batch_id)
+
+    def apply(self, data_frame, compression, batch_id):
+        """Compress the selected fields of a batch and write the new state. Returns the rows to write."""
+        from pyspark.sql.functions import col
+
+        if self.result is not None:
+            self.result.unpersist()
+            self.result = None
+
+        if self.batch_ids is None:
+            self.batch_ids = self._list_batch_ids()
+        if self.state_batch_id is None or self.state_batch_id >= batch_id:
+            # The first batch of the job run, or a retried batch, starts from the latest state before it
+            previous = [state_batch_id for state_batch_id in self.batch_ids if state_batch_id < batch_id]
+            self.state_batch_id = previous[-1] if previous else None
+            self.state = self.spark.read.parquet(self._batch_path(previous[-1])) if previous else None
+
+        state = self.state
+        if state is not None and state.columns != data_frame.columns + [STATE]:
+            print("Starting the compression over, the selected fields changed")
+            state = None
+
+        self.result, keyless = compress(data_frame, compression, state)
+        self.result.persist()
+        self.result.where(col(STATE).isNotNull()).coalesce(1).write.mode("overwrite").parquet(
+            self._batch_path(batch_id))
+        if batch_id not in self.batch_ids:
+            self.batch_ids.append(batch_id)
+            self.batch_ids.sort()
+
+        # The state the batch started from is kept until the next batch, in case the persisted result is recomputed
+        oldest_kept = self.state_batch_id if self.state_batch_id is not None else batch_id
+        for state_batch_id in [state_batch_id for state_batch_id in self.batch_ids if state_batch_id < oldest_kept]:
+            self._delete(state_batch_id)
+
+        self.state = self.spark.read.parquet(self._batch_path(batch_id))
+        self.state_batch_id = batch_id
+        return self.result.where(col(STATE).isNull()).drop(STATE).unionByName(keyless)
@@ -0,0 +1,117 @@
+"""
+Latest state per key of the Glue ETL Job, e.g. per crane.
+
+The selected fields of every micro-batch are merged into an Iceberg table in the Glue Data Catalog, which holds one row
+per key with its latest values. Rows replace the row of their key if their order column, e.g. the message timestamp,
+is not older, so late records never overwrite newer state. The table is merge-on-read: a merge writes the changed rows
+and delete files instead of rewriting the data files, which the periodic maintenance compacts.
+"""
+import datetime
+import time
+from collections import namedtuple
+
+from pyspark.sql import Window
+from pyspark.sql.functions import col
+from pyspark.sql.functions import row_number
+
+from field_paths import COLUMN_TYPES
+
+# The Spark catalog of the Glue Data Catalog configured for Iceberg
+CATALOG = "glue_catalog"
+
+# The interval of compacting the data and delete files and expiring old snapshots
+MAINTENANCE_INTERVAL_SECONDS = 3600
+SNAPSHOT_RETENTION_HOURS = 24
+
+CurrentState = namedtuple("CurrentState", ["table", "location", "key", "order_by", "columns"])
+
+
+class CurrentStateConfigError(ValueError):
+    pass
+
+
+def load_current_state(database, table, location, key, order_by, selected_fields):
+    """
+    Validate the key and order columns against the selected fields, which become the columns of the table with the
+    types of the output table, which are Spark SQL types as well.
+    """
+    columns = [(column_name, COLUMN_TYPES[field_type]) for column_name, _, field_type in selected_fields]
+    column_names = [column_name for column_name, _ in columns]
+    for column_name in [key, order_by]:
+        if column_name not in column_names:
+            raise CurrentStateConfigError("Column '{}' is not one of the selected fields".format(column_name))
+    return CurrentState(
+        table="`{}`.`{}`".format(database, table),
+        location=location,
+        key=key,
+        order_by=order_by,
+        columns=columns
+    )
+
+
+def create_table(spark, state):
+    spark.sql("""
+        CREATE TABLE IF NOT EXISTS {catalog}.{table} ({columns})
+        USING iceberg
+        LOCATION '{location}'
+        TBLPROPERTIES (
+            'format-version' = '2',
+            'write.delete.mode' = 'merge-on-read',
+            'write.update.mode' = 'merge-on-read',
+            'write.merge.mode' = 'merge-on-read',
+            'write.metadata.delete-after-commit.enabled' = 'true',
+            'write.metadata.previous-versions-max' = '100'
+        )
+    """.format(
+        catalog=CATALOG,
+        table=state.table,
+        columns=", ".join("`{}` {}".format(column_name, sql_type) for column_name, sql_type in state.columns),
+        location=state.location
+    ))
+
+
+def latest_rows(data_frame, state):
+    """The latest row per key of the selected fields of a micro-batch."""
+    latest_first = Window.partitionBy(state.key).orderBy(col(state.order_by).desc_nulls_last())
+    return data_frame \
+        .where(col(state.key).isNotNull()) \
+        .withColumn("_row_number", row_number().over(latest_first)) \
+        .where(col("_row_number") == 1) \
+        .select(*[column_name for column_name, _ in state.columns])
+
+
+def merge_current_state(data_frame, state):
+    # The temporary view lives in the session of the micro-batch, which is not the session of the job
+    spark = data_frame.sql_ctx.sparkSession
+    latest_rows(data_frame, state).createOrReplaceTempView("current_state_updates")
+    spark.sql("""
+        MERGE INTO {catalog}.{table} AS target
+        USING current_state_updates AS source
+        ON target.`{key}` = source.`{key}`
+        WHEN MATCHED AND (target.`{order_by}` IS NULL OR source.`{order_by}` >= target.`{order_by}`) THEN UPDATE SET *
+        WHEN NOT MATCHED THEN INSERT *
+    """.format(catalog=CATALOG, table=state.table, key=state.key, order_by=state.order_by))
+
+
+class CurrentStateSink:
+    """Merges the micro-batches into the table and runs the maintenance of the table every hour."""
+
+    def __init__(self, spark, state):
+        self.state = state
+        self.last_maintenance = time.monotonic()
+        create_table(spark, state)
+
+    def put(self, data_frame):
+        merge_current_state(data_frame, self.state)
+        if time.monotonic() - self.last_maintenance >= MAINTENANCE_INTERVAL_SECONDS:
+            self.maintain(data_frame.sql_ctx.sparkSession)
+
+    def maintain(self, spark):
+        # The maintenance runs between merges, so it never conflicts with the commits of the job
+        # Data files with delete files are rewritten with the deletes applied
+        spark.sql("CALL {}.system.rewrite_data_files(table => '{}', options => map('delete-file-threshold', '1'))"
+                  .format(CATALOG, self.state.table))
+        expire_before = datetime.datetime.utcnow() - datetime.timedelta(hours=SNAPSHOT_RETENTION_HOURS)
+        spark.sql("CALL {}.system.expire_snapshots(table => '{}', older_than => TIMESTAMP '{:%Y-%m-%d %H:%M:%S}', "
+                  "retain_last => 10)".format(CATALOG, self.state.table, expire_before))
+        self.last_maintenance = time.monotonic()
@@ -0,0 +1,157 @@
+import re
+
+# A segment is a field name followed by any number of list indices or [*], e.g. "gross[0]" or "che[*]"
+_SEGMENT_PATTERN = re.compile(r"([A-Za-z_][A-Za-z0-9_]*)((?:\[(?:\d+|\*)\])*)$")
+_INDEX_PATTERN = re.compile(r"\[(\d+|\*)\]")
+_COLUMN_NAME_PATTERN = re.compile(r"[a-z_][a-z0-9_]*$")
+
+# The types of the selected fields and the Glue types of their output columns, which the stack creates the output table
+# with and the consumers cast the fields to. Fields configured with a path only are strings.
+COLUMN_TYPES = {"timestamp": "timestamp", "int": "bigint", "double": "double", "string": "string"}
+FIELD_TYPES = list(COLUMN_TYPES)
+
+
+class FieldPathError(ValueError):
+    pass
+
+
+class _Each:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "EACH"
+
+
+# The step of a [*] in a field path, which yields one output row per element of the list
+EACH = _Each()
+
+
+def parse_field_path(path):
+    """
+    Parse a field path like "che[*].hoist[0].weight.gross[0].value" into a tuple of steps. Field names are returned
+    as strings, list indices as integers and [*] as EACH.
+    """
+    if not isinstance(path, str) or not path:
+        raise FieldPathError("Field path must be a non-empty string, got {!r}".format(path))
+
+    steps = []
+    for segment in path.split("."):
+        match = _SEGMENT_PATTERN.match(segment)
+        if match is None:
+            raise FieldPathError("Invalid segment {!r} in field path {!r}".format(segment, path))
+        steps.append(match.group(1))
+        steps.extend(EACH if index == "*" else int(index) for index in _INDEX_PATTERN.findall(match.group(2)))
+
+    return tuple(steps)
+
+
+def format_field_path(steps):
+    """Format the steps of a field path like parse_field_path reads them."""
+    path = ""
+    for step in steps:
+        if isinstance(step, str):
+            path += "." + step if path else step
+        else:
+            path += "[*]" if step is EACH else "[{}]".format(step)
+    return path
+
+
+def load_selected_fields(config):
+    """
+    Validate the selected fields config and return a list of (column name, steps, type) tuples in config order. A
+    field is configured either with its path or with an object of its path and type.
+    """
+    entries = config.get("selected-fields") if isinstance(config, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise FieldPathError("Config must contain a non-empty 'selected-fields' list")
+
+    selected_fields = []
+    column_names = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise FieldPathError("Selected field entries must be objects, got {!r}".format(entry))
+        for column_name, field in entry.items():
+            if not _COLUMN_NAME_PATTERN.match(column_name):
+                raise FieldPathError("Invalid column name {!r}".format(column_name))
+            if column_name in column_names:
+                raise FieldPathError("Duplicate column name {!r}".format(column_name))
+            column_names.add(column_name)
+            if isinstance(field, dict):
+                path, field_type = field.get("path"), field.get("type")
+            else:
+                path, field_type = field, "string"
+            if field_type not in FIELD_TYPES:
+                raise FieldPathError("Unsupported type {!r} of column {!r}, expected one of {}".format(
+                    field_type, column_name, ", ".join(FIELD_TYPES)))
+            selected_fields.append((column_name, parse_field_path(path), field_type))
+
+    return selected_fields
+
+
+def output_columns(selected_fields):
+    """The {"name": ..., "type": ...} objects of the output columns of the selected fields, with Glue types."""
+    return [{"name": column_name, "type": COLUMN_TYPES[field_type]} for column_name, _, field_type in selected_fields]
+
+
+def validate_field_paths(selected_fields, schema):
+    """
+    Check that the field paths of the selected fields exist in the input schema, given in the JSON representation of a
+    Spark schema. Field names must name a field of a struct, list indices and [*] must follow a list.
+    """
+    for column_name, steps, _ in selected_fields:
+        data_type = schema
+        for i, step in enumerate(steps):
+            kind = data_type.get("type") if isinstance(data_type, dict) else data_type
+            if isinstance(step, str):
+                fields = data_type.get("fields", []) if kind == "struct" else []
+                data_type = next((field["type"] for field in fields if field["name"] == step), None)
+            else:
+                data_type = data_type.get("elementType") if kind == "array" else None
+            if data_type is None:
+                raise FieldPathError("Field path of column {!r} is not in the input schema after {!r}".format(
+                    column_name, format_field_path(steps[:i + 1])))
+
+
+def validate_output_columns(selected_fields, columns):
+    """
+    Check that the selected fields are columns of the output table with the same types. The columns are the
+    {"name": ..., "type": ...} objects of the table, whose types are Glue types. Columns of the table may be left out.
+    """
+    column_types = {column["name"]: column["type"] for column in columns}
+    for column_name, _, field_type in selected_fields:
+        if column_name not in column_types:
+            raise FieldPathError("Column {!r} is not in the output table, adding a column takes a deployment".format(
+                column_name))
+        if column_types[column_name] != COLUMN_TYPES[field_type]:
+            raise FieldPathError("Column {!r} has type {} in the output table, not {}".format(
+                column_name, column_types[column_name], COLUMN_TYPES[field_type]))
+
+
+def plan_explodes(selected_fields):
+    """
+    Split the field paths of the selected fields at their [*] steps.
+
+    Every distinct path prefix ending with [*] is exploded once, so all fields below the same prefix refer to the same
+    list element. Prefixes in different branches of a message, e.g. "che[*].hoist[*]" and "che[*].trolley[*]", yield
+    the cross product of their elements.
+
+    Returns the explodes as (prefix, parent prefix, steps relative to the parent prefix) tuples, parents first, and
+    the selected fields as (column name, prefix, steps relative to the prefix, type) tuples. A prefix of None stands for
+    the message itself.
+    """
+    explodes = {}
+    fields = []
+    for column_name, steps, field_type in selected_fields:
+        parent = None
+        start = 0
+        for i, step in enumerate(steps):
+            if step is EACH:
+                prefix = steps[:i + 1]
+                explodes.setdefault(prefix, (parent, steps[start:i]))
+                parent = prefix
+                start = i + 1
+        fields.append((column_name, parent, steps[start:], field_type))
+
+    # Parent prefixes are shorter than the prefixes below them
+    ordered = sorted(explodes.items(), key=lambda item: len(item[0]))
+    return [(prefix, parent, relative_steps) for prefix, (parent, relative_steps) in ordered], fields
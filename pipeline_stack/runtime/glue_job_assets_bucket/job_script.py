@@ -1,24 +1,94 @@
-import datetime
 import json
 import sys
+import time
 
-from awsglue import DynamicFrame
+import boto3
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
+from botocore.exceptions import BotoCoreError
+from botocore.exceptions import ClientError
 from pyspark.context import SparkContext
-from pyspark.sql.functions import col
+from pyspark.sql.types import StructType
+from pyspark.sql.utils import AnalysisException
+
+from adaptive_window import BatchObservation
+from adaptive_window import WindowChange
+from adaptive_window import decide_window
+from adaptive_window import format_window_size
+from adaptive_window import load_window_policy
+from adaptive_window import parse_window_size
+from aggregates import AggregateState
+from aggregates import load_aggregates
+from cached_parameter import CachedParameter
+from catch_up import LAG_CHECK_SECONDS
+from catch_up import MIN_PROFILE_SECONDS
+from catch_up import checkpoint_suffix
+from catch_up import choose_profile
+from catch_up import load_read_profiles
+from catch_up import seconds_behind_latest
+from catch_up import source_options
+from catch_up import validate_starting_position
+from compression import CompressionState
+from compression import load_compression
+from current_state import CurrentStateSink
+from current_state import load_current_state
+from field_paths import load_selected_fields
+from field_paths import validate_field_paths
+from field_paths import validate_output_columns
+from metrics import create_sink
+from profiling import Profiler
+from profiling import phase
+from routes import load_routes
+from routes import write_routes
+from transforms import compile_dead_letters
+from transforms import compile_projection
+from transforms import decode_records
+from transforms import decoded_messages
+from transforms import deduplicate
+from transforms import deduplication_metrics
+from transforms import process_batch
+from transforms import select_fields
+from transforms import valid_records
+from transforms import write_raw_archive
 
 args = getResolvedOptions(
     sys.argv,
     [
         "JOB_NAME",
-        "windowSize",
-        "selectedFields",
-        "kinesisDB",
-        "kinesisTable",
-        "s3OutputBucket"
+        "startingPosition",
+        "readProfiles",
+        "catchUp",
+        "catchUpLagSeconds",
+        "steadyLagSeconds",
+        "adaptiveWindow",
+        "selectedFieldsParameter",
+        "selectedFieldsTtl",
+        "aggregates",
+        "routes",
+        "kinesisStreamName",
+        "kinesisEndpointUrl",
+        "kinesisRecordFormat",
+        "inputSchemaPath",
+        "outputColumns",
+        "s3OutputBucket",
+        "outputFormat",
+        "outputCompression",
+        "deduplication",
+        "deduplicationKey",
+        "deduplicationTtl",
+        "metricsNamespace",
+        "metricsSink",
+        "rawArchive",
+        "rawArchiveBucket",
+        "requiredFields",
+        "currentState",
+        "currentStateDatabase",
+        "currentStateTable",
+        "currentStateKey",
+        "currentStateOrderBy",
+        "profilingInterval",
+        "profilingPath"
     ]
 )
 sc = SparkContext()
@@ -26,93 +96,330 @@ glueContext = GlueContext(sc)
 job = Job(glueContext)
 job.init(args["JOB_NAME"], args)
 
+# Skip the _SUCCESS marker object which would otherwise be written by every micro-batch
+sc._jsc.hadoopConfiguration().set("mapreduce.fileoutputcommitter.marksuccessfuljobs", "false")
+
 # Read configuration
-param_window_size = args['windowSize']
-param_selected_fields = json.loads(args['selectedFields'])
-param_kinesis_db = args['kinesisDB']
-param_kinesis_table = args['kinesisTable']
+param_starting_position = validate_starting_position(args['startingPosition'])
+param_read_profiles = load_read_profiles(json.loads(args['readProfiles']))
+param_catch_up = args['catchUp'] == "true"
+param_catch_up_lag_seconds = float(args['catchUpLagSeconds'])
+param_steady_lag_seconds = float(args['steadyLagSeconds'])
+param_window_policy = load_window_policy(json.loads(args['adaptiveWindow']))
+# The selected fields are read from SSM at job start and reloaded at batch boundaries, see processBatch
+param_selected_fields_parameter = CachedParameter(args['selectedFieldsParameter'], int(args['selectedFieldsTtl']))
+selected_fields_version, selected_fields_value = param_selected_fields_parameter.get()
+param_selected_fields = load_selected_fields(json.loads(selected_fields_value))
+param_compression = load_compression(json.loads(selected_fields_value), param_selected_fields)
+param_aggregates = load_aggregates(
+    json.loads(args['aggregates']), [column_name for column_name, _, _ in param_selected_fields])
+# The routes keep the selected fields of their config, they are not reloaded
+param_routes = load_routes(json.loads(args['routes']))
+param_kinesis_stream_name = args['kinesisStreamName']
+param_kinesis_endpoint_url = args['kinesisEndpointUrl']
+param_kinesis_record_format = args['kinesisRecordFormat']
+param_input_schema_path = args['inputSchemaPath']
+param_output_columns = json.loads(args['outputColumns'])
 param_s3_output_bucket = args['s3OutputBucket']
+param_output_format = args['outputFormat']
+param_output_compression = args['outputCompression']
+param_deduplication = args['deduplication'] == "true"
+param_deduplication_key = args['deduplicationKey']
+param_deduplication_ttl = args['deduplicationTtl']
+param_metrics_namespace = args['metricsNamespace']
+param_metrics_sink = args['metricsSink']
+param_raw_archive = args['rawArchive'] == "true"
+param_raw_archive_bucket = args['rawArchiveBucket']
+param_required_fields = json.loads(args['requiredFields'])
+param_current_state = args['currentState'] == "true"
 
-# Script generated for node Kinesis Stream
-dataframe_KinesisStream_node = glueContext.create_data_frame.from_catalog(
-    database=param_kinesis_db,
-    table_name=param_kinesis_table,
-    additional_options={
-        "startingPosition": "TRIM_HORIZON",
-        "inferSchema": "true",
-        "classification": "json",
-        "maxFetchTimeInMs": 10000
-    },
-    transformation_ctx="dataframe_KinesisStream_node"
-)
+spark = glueContext.spark_session
+input_schema_json = json.loads(spark.read.text(param_input_schema_path, wholetext=True).first()[0])
+input_schema = StructType.fromJson(input_schema_json)
 
-# Select fields from config file on AWS SSM and create new colums for each field
-def select_fields_from_kinesisDF(df, selected_fields):
-    selected_df = df.select("*", *[eval(v).alias(k) for k,v in selected_fields.items()])
-    return selected_df
 
+# The raw records of the stream with their data as it was put into the stream
+def read_raw_stream(profile):
+    reader = spark.readStream \
+        .format("kinesis") \
+        .option("streamName", param_kinesis_stream_name) \
+        .option("endpointUrl", param_kinesis_endpoint_url)
+    for name, value in source_options(profile, param_starting_position).items():
+        reader = reader.option(name, value)
+    return reader.load()
 
-def processBatch(data_frame, batchId):
-    if data_frame.count() > 0:
-        KinesisStream_node1 = DynamicFrame.fromDF(
-            data_frame, glueContext, "from_data_frame"
-        )
 
-        # Convert kinesisStream to Dataframe
-        kinesis_df = KinesisStream_node1.toDF()
-
-        # Create a dictionary of selected fields based on configuration
-        selected_fields = {}
-        for field in param_selected_fields['selected-fields']:
-            for col_name, col_path in field.items():
-                selected_fields[col_name] = col_path
-
-        # Select fields from the DF
-        selected_kinesisDF = select_fields_from_kinesisDF(kinesis_df, selected_fields)
-
-        # Remove the old columns from DF and keep the new columns
-        columns_to_keep = [col_name for field in param_selected_fields['selected-fields'] for col_name, _ in field.items()]
-        selected_kinesisDF = selected_kinesisDF.select(columns_to_keep)
-
-        # Create a DynamicFrame for the new selected fields Dataframe
-        selected_kinesisFields_dyf = DynamicFrame.fromDF(selected_kinesisDF, glueContext, "dyf")
-
-        now = datetime.datetime.now()
-        year = now.year
-        month = now.month
-        day = now.day
-        hour = now.hour
-
-        # Script generated for node S3 bucket
-        S3bucket_node_path = (
-                "s3://"
-                + param_s3_output_bucket
-                + "/ingest_year="
-                + "{:0>4}".format(str(year))
-                + "/ingest_month="
-                + "{:0>2}".format(str(month))
-                + "/ingest_day="
-                + "{:0>2}".format(str(day))
-                + "/ingest_hour="
-                + "{:0>2}".format(str(hour))
-                + "/"
-        )
+def read_stream(profile):
+    # The raw data of the records is decoded into messages, which are parsed with the fixed input schema. Packed
+    # records carry many compressed or KPL aggregated messages. Every message keeps its original payload, so records
+    # which cannot be decoded or parsed are written as dead letters instead of rows of nulls. The raw records to archive
+    # are rows of their own in the same stream.
+    data_frame = decode_records(read_raw_stream(profile), input_schema, param_kinesis_record_format, param_raw_archive)
+
+    # Retried PutRecords calls and job retries starting over from TRIM_HORIZON deliver messages more than once
+    if param_deduplication:
+        data_frame = deduplicate(data_frame, param_deduplication_key, param_deduplication_ttl)
+    return data_frame
+
+
+# The projection is planned once per version of the selected fields and reused by every batch. The aggregates keep the
+# projection of the job start.
+selected_fields_projection = initial_projection = compile_projection(param_selected_fields)
+selected_fields_compression = param_compression
+rejected_selected_fields_versions = set()
+
+# The compression state of the keys is kept next to the checkpoints, it starts over with them
+compression_state = CompressionState(spark, "{}/{}/compression_state{}/".format(
+    args["TempDir"], args["JOB_NAME"], checkpoint_suffix(param_starting_position)))
+
+dead_letters = compile_dead_letters(param_required_fields, "s3://{}/dead-letter/".format(param_s3_output_bucket))
+
+# The open windows of the aggregates are merged with every batch of the output query and kept next to the checkpoints
+aggregate_state = AggregateState(spark, param_aggregates, "{}/{}/aggregate_state{}/".format(
+    args["TempDir"], args["JOB_NAME"], checkpoint_suffix(param_starting_position))) \
+    if param_aggregates is not None else None
+
+# The current state table keeps the selected fields of the job start like the aggregates, its columns are fixed
+current_state_sink = CurrentStateSink(spark, load_current_state(
+    args['currentStateDatabase'],
+    args['currentStateTable'],
+    "s3://{}/current_state/".format(param_s3_output_bucket),
+    args['currentStateKey'],
+    args['currentStateOrderBy'],
+    param_selected_fields
+)) if param_current_state else None
+
+job_metrics = create_sink(param_metrics_sink, param_metrics_namespace, {"JobName": args["JOB_NAME"]})
 
-        S3bucket_node = glueContext.write_dynamic_frame.from_options(
-            frame=selected_kinesisFields_dyf,
-            connection_type="s3",
-            format="json",
-            connection_options={"path": S3bucket_node_path, "partitionKeys": []},
-            transformation_ctx="S3bucket_node"
+# Every profilingInterval-th batch of the output query is profiled, 0 disables the profiling
+profiler = Profiler(int(args['profilingInterval']), args['profilingPath'], args["JOB_NAME"])
+
+
+def put_deduplication_metrics():
+    # The progress of the previous micro-batch, the progress of the running one is only complete after it
+    for query in glueContext.spark_session.streams.active:
+        if query.name == "output" and query.lastProgress:
+            # Input rows of packed records are Kinesis records instead of messages
+            job_metrics.put(deduplication_metrics(query.lastProgress, param_kinesis_record_format != "packed"))
+            return
+
+
+def reload_selected_fields(data_frame):
+    global selected_fields_version, selected_fields_projection, selected_fields_compression
+
+    version, value = param_selected_fields_parameter.get()
+    if version == selected_fields_version or version in rejected_selected_fields_versions:
+        return
+
+    try:
+        config = json.loads(value)
+        selected_fields = load_selected_fields(config)
+        # The output table only has the columns of the deployed config, a new column takes a deployment
+        validate_field_paths(selected_fields, input_schema_json)
+        validate_output_columns(selected_fields, param_output_columns)
+        projection = compile_projection(selected_fields)
+        compression = load_compression(config, selected_fields)
+        # Analyzing the projection on the batch fails for field paths missing from the input schema
+        select_fields(data_frame, projection)
+    except (ValueError, AnalysisException) as error:
+        rejected_selected_fields_versions.add(version)
+        print("Keeping version {} of the selected fields, version {} is invalid: {}".format(
+            selected_fields_version, version, error))
+        return
+
+    print("Applying version {} of the selected fields".format(version))
+    selected_fields_version, selected_fields_projection, selected_fields_compression = version, projection, compression
+
+
+def processBatch(data_frame, batchId, profile=None):
+    # A changed selection applies to whole batches only
+    with phase(profile, "reload"):
+        reload_selected_fields(data_frame)
+
+    if profile is not None:
+        # The projection runs into the noop sink first, which separates its time from the time of the write
+        output = select_fields(valid_records(data_frame, dead_letters), selected_fields_projection)
+        profile.set("selected_fields_version", selected_fields_version)
+        profile.plan("batch", data_frame)
+        profile.plan("output", output)
+        with profile.phase("project"):
+            output.write.format("noop").mode("overwrite").save()
+
+    with phase(profile, "write"):
+        process_batch(
+            data_frame,
+            selected_fields_projection,
+            "s3://{}/".format(param_s3_output_bucket),
+            param_output_format,
+            param_output_compression,
+            job_metrics,
+            dead_letters,
+            (lambda output: compression_state.apply(output, selected_fields_compression, batchId))
+            if selected_fields_compression is not None else None
         )
 
+    # The routes, the aggregates and the current state are written from the same persisted batch, so the stream is read
+    # once for all of them
+    if (param_routes or aggregate_state is not None or current_state_sink is not None) and data_frame.take(1):
+        valid_data_frame = valid_records(data_frame, dead_letters)
+        if param_routes:
+            with phase(profile, "routes"):
+                write_routes(
+                    valid_data_frame,
+                    param_routes,
+                    "s3://{}/routes/".format(param_s3_output_bucket),
+                    param_output_format,
+                    param_output_compression
+                )
+        if aggregate_state is not None:
+            with phase(profile, "aggregates"):
+                aggregate_state.apply(
+                    select_fields(valid_data_frame, initial_projection),
+                    batchId,
+                    "s3://{}/aggregates/".format(param_s3_output_bucket),
+                    param_output_format,
+                    param_output_compression
+                )
+        # The latest rows per key of the batch are merged after the output is written
+        if current_state_sink is not None:
+            with phase(profile, "current_state"):
+                current_state_sink.put(select_fields(valid_data_frame, initial_projection))
+
+    if param_deduplication:
+        with phase(profile, "metrics"):
+            put_deduplication_metrics()
+
+
+def process_persisted_batch(data_frame, batchId):
+    # The batch is read by the emptiness check and the writers, so it is kept persisted during processBatch
+    data_frame.persist()
+    profile = profiler.start(batchId, data_frame.sql_ctx.sparkSession) if profiler.sampled(batchId) else None
+    try:
+        if profile is not None:
+            # A profiled batch is read from the stream into the persisted batch in a phase of its own
+            with profile.phase("read"):
+                profile.set("records", decoded_messages(data_frame).count())
+        # The raw records are archived from the same persisted batch before the output is written, so the stream has
+        # a single consumer
+        if param_raw_archive:
+            with phase(profile, "raw_archive"):
+                write_raw_archive(data_frame, "s3://{}/".format(param_raw_archive_bucket))
+        processBatch(decoded_messages(data_frame), batchId, profile)
+    finally:
+        data_frame.unpersist()
+
+    if profile is not None:
+        profiler.write(profile)
+
+
+def start_queries(profile):
+    """Start the streaming queries of the job with a read profile, they continue from their checkpoints."""
+    print("Starting the streaming queries with the {} read profile {}".format(profile.name, profile))
+    data_frame = read_stream(profile)
+    checkpoint_location = "{}/{}/checkpoint{}/".format(
+        args["TempDir"], args["JOB_NAME"], checkpoint_suffix(param_starting_position))
+    return [data_frame.writeStream
+        .queryName("output")
+        .foreachBatch(process_persisted_batch)
+        .trigger(processingTime=profile.window_size)
+        .option("checkpointLocation", checkpoint_location)
+        .start()]
+
+
+def read_lag_seconds():
+    try:
+        return seconds_behind_latest(cloudwatch, param_kinesis_stream_name)
+    except (BotoCoreError, ClientError) as error:
+        print("Reading the lag of the stream failed: {}".format(error))
+        return None
+
+
+def batch_observations(queries):
+    """The completed micro-batches of the output query, oldest first."""
+    progresses = {}
+    for query in queries:
+        if query.name == "output":
+            # Idle triggers report the progress of the next batch id without data, the latest report of a batch wins
+            for progress in query.recentProgress:
+                progresses[progress["batchId"]] = progress
+    return [
+        BatchObservation(progress["durationMs"].get("triggerExecution", 0) / 1000, progress["numInputRows"])
+        for _, progress in sorted(progresses.items())
+    ]
+
+
+# Whether the last change of the window grew it and its monotonic time, None before the first change
+last_window_change = None
+
+
+def adapt_window(queries, lag_seconds):
+    """Return True if the window size of the steady profile changed."""
+    global last_window_change
+
+    window_seconds = parse_window_size(param_read_profiles["steady"].window_size)
+    last_change = WindowChange(last_window_change[0], time.monotonic() - last_window_change[1]) \
+        if last_window_change is not None else None
+    decision = decide_window(batch_observations(queries), lag_seconds, window_seconds, param_window_policy, last_change)
+    if decision.window_seconds == window_seconds:
+        return False
+
+    print("Changing the window size from {:.0f} to {} seconds, {}".format(
+        window_seconds, decision.window_seconds, decision.reason))
+    param_read_profiles["steady"] = param_read_profiles["steady"]._replace(
+        window_size=format_window_size(decision.window_seconds))
+    last_window_change = (decision.window_seconds > window_seconds, time.monotonic())
+    return True
+
+
+def flush_metrics():
+    # A failed put of the buffered metrics must not hide why the queries stopped
+    try:
+        job_metrics.flush()
+    except (BotoCoreError, ClientError) as error:
+        print("Putting the buffered metrics failed: {}".format(error))
+
+
+# The metrics of the last micro-batches are put before the queries restart and when the job stops, since the CloudWatch
+# sink buffers them
+try:
+    if not param_catch_up and param_window_policy is None:
+        start_queries(param_read_profiles["steady"])
+        # Returns when a query fails, which fails the job run
+        spark.streams.awaitAnyTermination()
+    else:
+        cloudwatch = boto3.client("cloudwatch")
+        profile_name = "steady"
+        if param_catch_up:
+            profile_name = choose_profile(
+                profile_name, read_lag_seconds(), param_catch_up_lag_seconds, param_steady_lag_seconds)
+        queries = start_queries(param_read_profiles[profile_name])
+        profile_started = time.monotonic()
+
+        # The lag and the micro-batches are checked between waits. The queries are restarted with the other profile
+        # when the lag crosses a threshold, or with another window size of the steady profile when the window does not
+        # fit the load.
+        while not spark.streams.awaitAnyTermination(LAG_CHECK_SECONDS):
+            if time.monotonic() - profile_started < MIN_PROFILE_SECONDS:
+                continue
+            lag_seconds = read_lag_seconds()
+            next_profile_name = profile_name
+            if param_catch_up:
+                next_profile_name = choose_profile(
+                    profile_name, lag_seconds, param_catch_up_lag_seconds, param_steady_lag_seconds)
+
+            if next_profile_name != profile_name:
+                print("Switching from the {} to the {} read profile at a lag of {:.0f} seconds".format(
+                    profile_name, next_profile_name, lag_seconds))
+            elif profile_name != "steady" or param_window_policy is None or not adapt_window(queries, lag_seconds):
+                continue
+
+            for query in queries:
+                query.stop()
+            spark.streams.resetTerminated()
+            profile_name = next_profile_name
+            queries = start_queries(param_read_profiles[profile_name])
+            profile_started = time.monotonic()
+finally:
+    flush_metrics()
 
-glueContext.forEachBatch(
-    frame=dataframe_KinesisStream_node,
-    batch_function=processBatch,
-    options={
-        "windowSize": param_window_size,
-        "checkpointLocation": args["TempDir"] + "/" + args["JOB_NAME"] + "/checkpoint/"
-    }
-)
 job.commit()
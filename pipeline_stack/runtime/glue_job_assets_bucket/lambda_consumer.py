@@ -0,0 +1,401 @@
+"""
+Lambda consumer of the Kinesis data stream, an alternative to the Glue ETL Job for low-volume sites.
+
+The records of an invocation are parsed and flattened into the selected fields with vectorized PyArrow compute
+functions and written in the same partitioned layout as the Glue ETL Job. Records which cannot be decoded and messages
+which cannot be parsed or miss a required field are written to the dead-letter prefix like the Glue ETL Job does,
+instead of failing the batch.
+"""
+import base64
+import datetime
+import functools
+import gzip
+import io
+import json
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.json as pajson
+
+from cached_parameter import CachedParameter
+from field_paths import EACH
+from field_paths import FieldPathError
+from field_paths import load_selected_fields
+from field_paths import parse_field_path
+from field_paths import plan_explodes
+from field_paths import validate_field_paths
+from field_paths import validate_output_columns
+from record_codec import RecordCodecError
+from record_codec import decode_record
+from record_codec import single_line
+
+PARTITION_KEYS = ["event_date", "event_hour"]
+
+_ARROW_TYPES = {
+    "string": pa.string(),
+    "long": pa.int64(),
+    "integer": pa.int32(),
+    "double": pa.float64(),
+    "float": pa.float32(),
+    "boolean": pa.bool_()
+}
+
+# The Arrow types of the types of the selected fields
+_FIELD_TYPES = {
+    "int": pa.int64(),
+    "double": pa.float64(),
+    "string": pa.string()
+}
+
+# Strings which the casts of Spark turn into numbers, other strings become nulls. Fractions of integers are truncated.
+_INTEGER_PATTERN = r"^\s*[+-]?\d+(\.\d*)?\s*$"
+_DOUBLE_PATTERN = r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$"
+
+# ISO 8601 timestamps in UTC or with a zone offset, which Spark accepts of up to 18 hours
+_TIMESTAMP_PATTERN = r"^(?P<local>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?)" \
+                     r"(?:Z|(?P<sign>[+-])(?P<hours>\d{2})(?::?(?P<minutes>\d{2}))?)?$"
+_MAX_OFFSET_SECONDS = 18 * 3600
+
+MALFORMED_MESSAGE = "Malformed JSON or schema violation"
+MISSING_FIELD = "Missing required field {}"
+
+_config = None
+
+
+def to_arrow_type(data_type):
+    """Convert a data type of a Spark schema in its JSON representation into an Arrow type."""
+    if isinstance(data_type, str):
+        return _ARROW_TYPES[data_type]
+    if data_type["type"] == "array":
+        return pa.list_(to_arrow_type(data_type["elementType"]))
+    return pa.struct([pa.field(field["name"], to_arrow_type(field["type"])) for field in data_type["fields"]])
+
+
+def to_arrow_schema(schema):
+    return pa.schema([pa.field(field["name"], to_arrow_type(field["type"])) for field in schema["fields"]])
+
+
+def read_json_lines(lines, schema):
+    return pajson.read_json(
+        io.BytesIO(b"\n".join(lines)),
+        parse_options=pajson.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+    )
+
+
+def parse_lines(lines, schema, dead_letters):
+    """
+    Parse JSON lines into tables, returned with their lines. An invalid line fails the whole read, so a failed read is
+    split in halves until the invalid lines are found, which are added to the dead letters.
+    """
+    try:
+        return [(read_json_lines(lines, schema), lines)]
+    except pa.ArrowInvalid:
+        if len(lines) == 1:
+            dead_letters.append((MALFORMED_MESSAGE, lines[0].decode("utf-8", "replace")))
+            return []
+    middle = len(lines) // 2
+    return parse_lines(lines[:middle], schema, dead_letters) + parse_lines(lines[middle:], schema, dead_letters)
+
+
+def parse_records(payloads, schema, required_fields=()):
+    """
+    Parse the JSON payloads of a batch with a fixed schema, fields missing from the schema are ignored. Payloads
+    spanning several lines are serialized onto one first. Returns the table of the valid payloads, or None, and the
+    dead letters of the others as (reason, payload) tuples. Payloads missing one of the compiled required fields are
+    dead letters as well.
+    """
+    lines, dead_letters = [], []
+    for payload in payloads:
+        try:
+            lines.append(single_line(payload))
+        except RecordCodecError:
+            dead_letters.append((MALFORMED_MESSAGE, payload.decode("utf-8", "replace")))
+    tables = [route_missing_fields(table, table_lines, required_fields, dead_letters)
+              for table, table_lines in (parse_lines(lines, schema, dead_letters) if lines else [])]
+    tables = [table for table in tables if table.num_rows]
+    return pa.concat_tables(tables) if tables else None, dead_letters
+
+
+def apply_steps(values, steps):
+    for step in steps:
+        if isinstance(step, int):
+            # Lists which are too short yield nulls, like getItem does in Spark
+            long_enough = pc.fill_null(pc.greater(pc.list_value_length(values), step), False)
+            values = pc.list_element(pc.if_else(long_enough, values, pa.scalar(None, values.type)), step)
+        else:
+            values = pc.struct_field(values, [values.type.get_field_index(step)])
+    return values
+
+
+def field_path_to_array(table, steps):
+    return apply_steps(table.column(steps[0]).combine_chunks(), steps[1:])
+
+
+def compile_required_fields(required_fields):
+    """Parse the field paths of the required fields, which must address a single field like in the Glue ETL Job."""
+    compiled = []
+    for required_field in required_fields:
+        steps = parse_field_path(required_field)
+        if EACH in steps:
+            raise FieldPathError("The required field {!r} must address a single field".format(required_field))
+        compiled.append((required_field, steps))
+    return compiled
+
+
+def route_missing_fields(table, lines, required_fields, dead_letters):
+    """
+    Add the lines of the rows missing a required field to the dead letters and return the other rows. The reason is
+    the first missing field, like the coalesced checks of the Glue ETL Job.
+    """
+    if not required_fields:
+        return table
+    missing = [(required_field, pc.is_null(field_path_to_array(table, steps)))
+               for required_field, steps in required_fields]
+    invalid = functools.reduce(pc.or_, [mask for _, mask in missing])
+    for row in pc.indices_nonzero(invalid).to_pylist():
+        required_field = next(required_field for required_field, mask in missing if mask[row].as_py())
+        dead_letters.append((MISSING_FIELD.format(required_field), lines[row].decode("utf-8", "replace")))
+    return table.filter(pc.invert(invalid))
+
+
+def explode_outer(values):
+    """
+    Return the elements of a list array and the index of the list of every element. Empty and null lists yield a
+    single null element, like explode_outer does in Spark.
+    """
+    empty = pc.equal(pc.fill_null(pc.list_value_length(values), 0), 0)
+    values = pc.if_else(empty, pa.scalar([None], values.type), values)
+    return pc.list_flatten(values), pc.list_parent_indices(values)
+
+
+def to_timestamp(values):
+    """
+    Parse ISO 8601 timestamps into UTC, which is how to_timestamp parses them in the UTC session of the Glue ETL Job.
+    Timestamps without a zone offset are taken as UTC. Other values become nulls.
+    """
+    if pa.types.is_timestamp(values.type):
+        return values
+    parts = pc.extract_regex(values, pattern=_TIMESTAMP_PATTERN)
+
+    def part(name):
+        return pc.struct_field(parts, [parts.type.get_field_index(name)])
+
+    def number(name):
+        # Groups which did not match are empty strings
+        digits = part(name)
+        return pc.cast(pc.if_else(pc.equal(digits, ""), "0", digits), pa.int64())
+
+    offset = pc.add(pc.multiply(number("hours"), 3600), pc.multiply(number("minutes"), 60))
+    offset = pc.if_else(pc.equal(part("sign"), "-"), pc.negate(offset), offset)
+    offset = pc.if_else(pc.less_equal(pc.abs(offset), _MAX_OFFSET_SECONDS), offset, pa.scalar(None, pa.int64()))
+    # Integer arithmetic on the microseconds, which every Arrow version supports unlike timestamp arithmetic
+    local = pc.cast(pc.cast(part("local"), pa.timestamp("us")), pa.int64())
+    return pc.cast(pc.subtract(local, pc.multiply(offset, 1000000)), pa.timestamp("us"))
+
+
+def cast_field(values, field_type):
+    """
+    Cast a selected field to the Arrow type of its column, the same types the Glue ETL Job writes. Values which cannot
+    be cast become nulls, like in the casts of Spark.
+    """
+    if field_type == "timestamp":
+        return to_timestamp(values)
+    arrow_type = _FIELD_TYPES[field_type]
+    if field_type != "string" and pa.types.is_string(values.type):
+        valid = pc.fill_null(pc.match_substring_regex(
+            values, pattern=_INTEGER_PATTERN if field_type == "int" else _DOUBLE_PATTERN), False)
+        values = pc.utf8_trim_whitespace(pc.if_else(valid, values, pa.scalar(None, values.type)))
+        if field_type == "int":
+            values = pc.replace_substring_regex(values, pattern=r"\.\d*$", replacement="")
+    elif field_type == "int" and pa.types.is_floating(values.type):
+        values = pc.if_else(pc.fill_null(pc.is_finite(values), False), values, pa.scalar(None, values.type))
+    try:
+        # Unsafe casts truncate fractions like Spark does
+        return pc.cast(values, arrow_type, safe=False)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # Lists and structs have no value of a column
+        return pa.nulls(len(values), arrow_type)
+
+
+def partition_arrays(table, now):
+    """Derive the partition columns from the event time of the records, falling back to the processing time."""
+    # The hour of the event time in UTC, like the partitions of the Glue ETL Job
+    event_time = to_timestamp(field_path_to_array(table, ("msg", "timestamp")))
+    event_time = pc.fill_null(event_time, pa.scalar(now, pa.timestamp("us")))
+    return [pc.strftime(event_time, format="%Y-%m-%d"), pc.strftime(event_time, format="%H")]
+
+
+def select_fields(table, selected_fields, now=None):
+    """
+    Explode the [*] prefixes of the selected fields in the same order as the Glue ETL Job. The rows of the table and
+    the elements of every exploded prefix are kept aligned with the output rows through take.
+    """
+    now = now or datetime.datetime.utcnow()
+    explodes, fields = plan_explodes(selected_fields)
+    rows = pa.array(range(table.num_rows), pa.int64())
+    bindings = {}
+
+    def relative_array(prefix, steps):
+        if prefix is None:
+            return field_path_to_array(table, steps).take(rows)
+        return apply_steps(bindings[prefix], steps)
+
+    for prefix, parent, steps in explodes:
+        elements, parents = explode_outer(relative_array(parent, steps))
+        rows = rows.take(parents)
+        bindings = {key: values.take(parents) for key, values in bindings.items()}
+        bindings[prefix] = elements
+
+    names = [column_name for column_name, _, _, _ in fields] + PARTITION_KEYS
+    arrays = [cast_field(relative_array(prefix, steps), field_type) for _, prefix, steps, field_type in fields] \
+        + [values.take(rows) for values in partition_arrays(table, now)]
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def write_json(table, bucket, output_compression, filesystem):
+    # Arrow has no JSON writer, so JSON lines are written per partition. Nulls are omitted like the Spark writer does.
+    # Timestamps are formatted like the Spark writer formats them, with milliseconds
+    for i, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type):
+            values = pc.cast(table.column(i), pa.timestamp("ms"), safe=False)
+            table = table.set_column(i, field.name, pc.strftime(values, format="%Y-%m-%d %H:%M:%S"))
+    partitions = pc.binary_join_element_wise(table.column("event_date"), table.column("event_hour"), "/")
+    for partition in pc.unique(partitions).to_pylist():
+        event_date, event_hour = partition.split("/")
+        mask = pc.equal(partitions, partition)
+        rows = table.filter(mask).drop(PARTITION_KEYS).to_pylist()
+        body = "\n".join(json.dumps({k: v for k, v in row.items() if v is not None}) for row in rows).encode() + b"\n"
+        extension = ".json"
+        if output_compression == "gzip":
+            body = gzip.compress(body)
+            extension = ".json.gz"
+        directory = "{}/event_date={}/event_hour={}".format(bucket, event_date, event_hour)
+        if isinstance(filesystem, pyarrow.fs.LocalFileSystem):
+            # S3 has no directories, local ones are created for the verification tool
+            filesystem.create_dir(directory, recursive=True)
+        path = "{}/lambda-{}{}".format(directory, uuid.uuid4().hex, extension)
+        with filesystem.open_output_stream(path) as stream:
+            stream.write(body)
+
+
+def write_output(table, bucket, output_format, output_compression, filesystem):
+    if output_format == "json":
+        write_json(table, bucket, output_compression, filesystem)
+        return
+
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        table,
+        base_dir=bucket,
+        basename_template="lambda-{}-{{i}}.parquet".format(uuid.uuid4().hex),
+        format=file_format,
+        file_options=file_format.make_write_options(compression=output_compression),
+        partitioning=ds.partitioning(pa.schema([(key, pa.string()) for key in PARTITION_KEYS]), flavor="hive"),
+        filesystem=filesystem,
+        existing_data_behavior="overwrite_or_ignore"
+    )
+
+
+def write_dead_letters(dead_letters, bucket, filesystem, now=None):
+    """Write the dead letters of a batch as gzip compressed JSON lines to the same prefix as the Glue ETL Job."""
+    if not dead_letters:
+        return
+    now = now or datetime.datetime.utcnow()
+    processed_at = "{:%Y-%m-%d %H:%M:%S}.{:03d}".format(now, now.microsecond // 1000)
+    body = "".join(json.dumps({"reason": reason, "payload": payload, "processed_at": processed_at}) + "\n"
+                   for reason, payload in dead_letters)
+    path = "{}/dead-letter/processing_date={:%Y-%m-%d}/lambda-{}.json.gz".format(bucket, now, uuid.uuid4().hex)
+    with filesystem.open_output_stream(path) as stream:
+        stream.write(gzip.compress(body.encode()))
+
+
+def load_config():
+    """
+    Load the input schema from the job assets bucket once per container, and the selected fields from SSM whenever a
+    new version of the parameter is read.
+    """
+    global _config
+    if _config is None:
+        # Imported here, so the transformations can be used locally without the AWS SDK
+        import boto3
+
+        schema = json.loads(boto3.client("s3").get_object(
+            Bucket=os.environ["SCHEMA_BUCKET"], Key=os.environ["SCHEMA_KEY"])["Body"].read())
+        _config = {
+            "selected_fields_parameter": CachedParameter(
+                os.environ["SELECTED_FIELDS_PARAMETER"], int(os.environ.get("SELECTED_FIELDS_TTL", "60"))),
+            "selected_fields_version": None,
+            "selected_fields": None,
+            "schema_json": schema,
+            "schema": to_arrow_schema(schema),
+            "output_columns": json.loads(os.environ["OUTPUT_COLUMNS"]),
+            "required_fields": compile_required_fields(json.loads(os.environ.get("REQUIRED_FIELDS", "[]"))),
+            "filesystem": pyarrow.fs.S3FileSystem(region=os.environ["AWS_REGION"])
+        }
+
+    version, value = _config["selected_fields_parameter"].get()
+    if version != _config["selected_fields_version"]:
+        try:
+            config = json.loads(value)
+            selected_fields = load_selected_fields(config)
+            if config.get("compression"):
+                raise ValueError("The Lambda consumer does not support the compression of the selected fields")
+            # The output table only has the columns of the deployed config, a new column takes a deployment
+            validate_field_paths(selected_fields, _config["schema_json"])
+            validate_output_columns(selected_fields, _config["output_columns"])
+        except ValueError as error:
+            if _config["selected_fields"] is None:
+                raise
+            print("Keeping version {} of the selected fields, version {} is invalid: {}".format(
+                _config["selected_fields_version"], version, error))
+        else:
+            print("Applying version {} of the selected fields".format(version))
+            _config["selected_fields"] = selected_fields
+        # An invalid version is not parsed again until the next one is read
+        _config["selected_fields_version"] = version
+    return _config
+
+
+def process_records(payloads, selected_fields, schema, required_fields=()):
+    """Return the selected fields of the valid payloads, or None, and the dead letters of the others."""
+    table, dead_letters = parse_records(payloads, schema, required_fields)
+    if table is None:
+        return None, dead_letters
+    return select_fields(table, selected_fields), dead_letters
+
+
+def decode_event(event):
+    """
+    Return the JSON messages of the records of an event, unpacking compressed and KPL aggregated records, and the dead
+    letters of the records which cannot be decoded with their base64 encoded data.
+    """
+    messages, dead_letters = [], []
+    for record in event["Records"]:
+        data = base64.b64decode(record["kinesis"]["data"])
+        try:
+            messages.extend(decode_record(data))
+        except RecordCodecError as error:
+            dead_letters.append(("Undecodable record: {}".format(error), record["kinesis"]["data"]))
+    return messages, dead_letters
+
+
+def handler(event, context):
+    config = load_config()
+    payloads, dead_letters = decode_event(event)
+    table, parse_dead_letters = process_records(
+        payloads, config["selected_fields"], config["schema"], config["required_fields"])
+    dead_letters += parse_dead_letters
+    write_dead_letters(dead_letters, os.environ["OUTPUT_BUCKET"], config["filesystem"])
+    if table is not None:
+        write_output(
+            table,
+            os.environ["OUTPUT_BUCKET"],
+            os.environ["OUTPUT_FORMAT"],
+            os.environ["OUTPUT_COMPRESSION"],
+            config["filesystem"]
+        )
+    return {"records": len(event["Records"]), "messages": len(payloads), "dead_letters": len(dead_letters)}
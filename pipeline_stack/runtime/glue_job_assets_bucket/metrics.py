@@ -0,0 +1,121 @@
+"""
+Custom metrics of the Glue ETL Job.
+
+Metrics are put into a sink as a dict of metric name to (value, unit) tuples per micro-batch. The CloudWatch sink
+buffers the metrics of several micro-batches and puts them in few PutMetricData calls, the log sink prints them and
+the memory sink keeps them, e.g. to capture the metrics of a local run.
+"""
+import datetime
+import json
+import time
+
+SINKS = ["cloudwatch", "log", "memory", "none"]
+
+# The maximum number of metrics of a PutMetricData request
+_MAX_METRICS_PER_REQUEST = 1000
+
+
+class MetricsSink:
+
+    def put(self, metrics):
+        pass
+
+    def flush(self):
+        pass
+
+
+class CloudWatchMetrics(MetricsSink):
+    """Puts metrics into a CloudWatch namespace, with the same dimensions for all of them."""
+
+    def __init__(self, namespace, dimensions, flush_interval=60):
+        # Imported here, so the transformations can be used locally without the AWS SDK
+        import boto3
+
+        self.client = boto3.client("cloudwatch")
+        self.namespace = namespace
+        self.dimensions = [{"Name": name, "Value": value} for name, value in dimensions.items()]
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def put(self, metrics):
+        timestamp = datetime.datetime.now(datetime.timezone.utc)
+        self.buffer.extend(
+            {
+                "MetricName": name,
+                "Dimensions": self.dimensions,
+                "Timestamp": timestamp,
+                "Value": value,
+                "Unit": unit
+            }
+            for name, (value, unit) in metrics.items()
+        )
+        if len(self.buffer) >= _MAX_METRICS_PER_REQUEST or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for i in range(0, len(self.buffer), _MAX_METRICS_PER_REQUEST):
+            self.client.put_metric_data(
+                Namespace=self.namespace, MetricData=self.buffer[i:i + _MAX_METRICS_PER_REQUEST])
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+
+class LogMetrics(MetricsSink):
+    """Prints the metrics as JSON lines, which end up in the continuous logs of the job."""
+
+    def put(self, metrics):
+        print(json.dumps({"metrics": {name: value for name, (value, _) in metrics.items()}}))
+
+
+class MemoryMetrics(MetricsSink):
+    """Keeps the metrics in a list, one dict of metric name to value per put."""
+
+    def __init__(self):
+        self.puts = []
+
+    def put(self, metrics):
+        self.puts.append({name: value for name, (value, _) in metrics.items()})
+
+
+def create_sink(sink, namespace, dimensions):
+    if sink == "cloudwatch":
+        return CloudWatchMetrics(namespace, dimensions)
+    if sink == "log":
+        return LogMetrics()
+    if sink == "memory":
+        return MemoryMetrics()
+    if sink == "none":
+        return MetricsSink()
+    raise ValueError("Unsupported metrics sink '{}', expected one of {}".format(sink, ", ".join(SINKS)))
+
+
+def job_ids(spark_context):
+    """The ids of the Spark jobs of the job group of the calling thread, e.g. the jobs of a streaming query."""
+    return set(spark_context.statusTracker().getJobIdsForGroup(spark_context.getLocalProperty("spark.jobGroup.id")))
+
+
+def output_statistics(spark_context, spark_job_ids):
+    """
+    Return the rows and bytes written by the Spark jobs, or None if they are not available. The statistics are read
+    from the status store of the Spark UI, which is updated asynchronously, so the listener bus is drained first.
+    Neither is a public API, so the statistics are best effort.
+    """
+    from py4j.protocol import Py4JError
+
+    spark = spark_context._jsc.sc()
+    tracker = spark_context.statusTracker()
+    try:
+        spark.listenerBus().waitUntilEmpty(1000)
+        store = spark.statusStore()
+        rows = 0
+        data_bytes = 0
+        for job_id in spark_job_ids:
+            job = tracker.getJobInfo(job_id)
+            for stage_id in job.stageIds if job else []:
+                stage = store.lastStageAttempt(stage_id)
+                rows += stage.outputRecords()
+                data_bytes += stage.outputBytes()
+        return rows, data_bytes
+    except Py4JError:
+        return None
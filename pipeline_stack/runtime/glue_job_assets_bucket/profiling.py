@@ -0,0 +1,190 @@
+"""
+Profiles of sampled micro-batches of the Glue ETL Job.
+
+Every interval-th micro-batch of the output query is run phase by phase: the batch is read from the stream into the
+persisted batch, the raw records are archived, the selected fields are projected into the noop sink, and the output,
+routes and current state are written. Every phase records its wall time, the CPU time of the Python driver process and
+the statistics of its Spark stages. The profile also records the physical plans of the batch and the projection.
+
+The profiles are compact JSON objects, one per batch, which tools/compare_profiles.py compares. A profiled batch takes
+longer than other batches, since the batch is read and the projection is run once more.
+"""
+import datetime
+import hashlib
+import json
+import re
+import time
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+from metrics import job_ids
+
+PROFILE_VERSION = 1
+
+# Expression ids like #123 or #123L differ between runs of the same plan
+_EXPRESSION_ID_PATTERN = re.compile(r"#\d+L?")
+
+
+def plan_digest(plan):
+    """A digest of a physical plan which only changes with the operators and expressions of the plan."""
+    return hashlib.sha1(_EXPRESSION_ID_PATTERN.sub("", plan).encode("utf-8")).hexdigest()[:12]
+
+
+def physical_plan(data_frame):
+    return data_frame._jdf.queryExecution().executedPlan().toString()
+
+
+def stage_statistics(spark_context, spark_job_ids):
+    """
+    Return the statistics of the stages of the Spark jobs, or {} if they are not available. Like the output statistics
+    of the metrics, they are read from the status store of the Spark UI and are best effort.
+    """
+    from py4j.protocol import Py4JError
+
+    spark = spark_context._jsc.sc()
+    tracker = spark_context.statusTracker()
+    statistics = {
+        "stages": 0,
+        "tasks": 0,
+        "executor_run_ms": 0,
+        "executor_cpu_ms": 0,
+        "input_bytes": 0,
+        "shuffle_read_bytes": 0,
+        "shuffle_write_bytes": 0,
+        "spilled_bytes": 0,
+        "output_rows": 0,
+        "output_bytes": 0
+    }
+    try:
+        spark.listenerBus().waitUntilEmpty(1000)
+        store = spark.statusStore()
+        for job_id in spark_job_ids:
+            job = tracker.getJobInfo(job_id)
+            for stage_id in job.stageIds if job else []:
+                stage = store.lastStageAttempt(stage_id)
+                statistics["stages"] += 1
+                statistics["tasks"] += stage.numTasks()
+                statistics["executor_run_ms"] += stage.executorRunTime()
+                statistics["executor_cpu_ms"] += stage.executorCpuTime() // 1000000
+                statistics["input_bytes"] += stage.inputBytes()
+                statistics["shuffle_read_bytes"] += stage.shuffleReadBytes()
+                statistics["shuffle_write_bytes"] += stage.shuffleWriteBytes()
+                statistics["spilled_bytes"] += stage.memoryBytesSpilled() + stage.diskBytesSpilled()
+                statistics["output_rows"] += stage.outputRecords()
+                statistics["output_bytes"] += stage.outputBytes()
+        return statistics
+    except Py4JError:
+        return {}
+
+
+def _scala_iterator(iterable):
+    iterator = iterable.iterator()
+    while iterator.hasNext():
+        yield iterator.next()
+
+
+def written_files(spark_session, spark_job_ids):
+    """
+    Return the number of files written by the SQL executions of the Spark jobs, from the metrics of their write
+    commands, or None if they are not available.
+    """
+    from py4j.protocol import Py4JError
+
+    try:
+        store = spark_session._jsparkSession.sharedState().statusStore()
+        files = 0
+        for execution in _scala_iterator(store.executionsList()):
+            if not any(job_id in spark_job_ids for job_id in _scala_iterator(execution.jobs().keys())):
+                continue
+            # The keys are Scala longs, which are compared as Python ints
+            metric_values = store.executionMetrics(execution.executionId())
+            values = {entry._1(): entry._2() for entry in _scala_iterator(metric_values)}
+            for plan_metric in _scala_iterator(execution.metrics()):
+                if plan_metric.name() == "number of written files" and plan_metric.accumulatorId() in values:
+                    files += int(values[plan_metric.accumulatorId()].replace(",", ""))
+        return files
+    except (Py4JError, ValueError):
+        return None
+
+
+def phase(profile, name):
+    """A phase of the profile of a batch, or no phase for batches without a profile."""
+    return profile.phase(name) if profile is not None else nullcontext()
+
+
+class BatchProfile:
+
+    def __init__(self, batch_id, spark_session):
+        self.spark_session = spark_session
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.record = {
+            "version": PROFILE_VERSION,
+            "batch_id": batch_id,
+            "started_at": self.started_at.isoformat(),
+            "phases": {},
+            "plans": {}
+        }
+
+    def set(self, name, value):
+        self.record[name] = value
+
+    def plan(self, name, data_frame):
+        plan = physical_plan(data_frame)
+        self.record["plans"][name] = {"digest": plan_digest(plan), "plan": plan}
+
+    @contextmanager
+    def phase(self, name):
+        spark_context = self.spark_session.sparkContext
+        jobs_before = job_ids(spark_context)
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        yield
+        wall_ms = (time.perf_counter() - started) * 1000
+        python_cpu_ms = (time.process_time() - cpu_started) * 1000
+
+        spark_job_ids = job_ids(spark_context) - jobs_before
+        self.record["phases"][name] = {
+            "wall_ms": round(wall_ms, 1),
+            "python_cpu_ms": round(python_cpu_ms, 1),
+            "spark_jobs": len(spark_job_ids)
+        } | stage_statistics(spark_context, spark_job_ids) | {
+            "written_files": written_files(self.spark_session, spark_job_ids)
+        }
+
+
+class Profiler:
+    """Samples every interval-th batch and writes its profile to an S3 prefix, by job name and date."""
+
+    def __init__(self, interval, path, job_name, client=None):
+        self.interval = interval
+        self.bucket, _, self.prefix = path[len("s3://"):].partition("/")
+        self.job_name = job_name
+        self.client = client
+
+    def sampled(self, batch_id):
+        return self.interval > 0 and batch_id % self.interval == 0
+
+    def start(self, batch_id, spark_session):
+        return BatchProfile(batch_id, spark_session)
+
+    def write(self, profile):
+        if self.client is None:
+            # Imported here, so the transformations can be used locally without the AWS SDK
+            import boto3
+
+            self.client = boto3.client("s3")
+
+        from botocore.exceptions import BotoCoreError
+        from botocore.exceptions import ClientError
+
+        key = "{}{}/{:%Y-%m-%d}/{:%H%M%S}-batch-{}.json".format(
+            self.prefix, self.job_name, profile.started_at, profile.started_at, profile.record["batch_id"])
+        try:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=key,
+                Body=json.dumps(profile.record, separators=(",", ":")).encode("utf-8")
+            )
+        except (BotoCoreError, ClientError) as error:
+            # A lost profile never fails the batch
+            print("Writing the profile of batch {} failed: {}".format(profile.record["batch_id"], error))
@@ -0,0 +1,259 @@
+"""
+Packing and unpacking of Kinesis record payloads.
+
+A packed record carries many messages, so the shard count and the Kinesis bill scale with bytes instead of messages:
+- Compressed records are gzip or zstd compressed JSON lines, one message per line.
+- Aggregated records use the KPL aggregation format: a magic number, an AggregatedRecord protobuf message and the MD5
+  digest of the protobuf message. Every user record of an aggregated record can be compressed in turn.
+Payloads which are neither are single plain JSON messages, so packed and plain records can share a stream.
+
+The module only depends on the standard library. zstd needs the zstandard package, or PyArrow as a fallback.
+"""
+import gzip
+import hashlib
+import io
+import json
+import zlib
+
+KPL_MAGIC = b"\xf3\x89\x9a\xc2"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+COMPRESSIONS = ["none", "gzip", "zstd"]
+
+# The maximum size of the data and partition key of a Kinesis record
+MAX_RECORD_BYTES = 1024 * 1024
+
+_DIGEST_BYTES = 16
+
+
+class RecordCodecError(ValueError):
+    pass
+
+
+def _zstd_decompress(data):
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        # Frames written in streaming mode carry no content size, which decompress requires
+        try:
+            return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+        except zstandard.ZstdError as error:
+            raise RecordCodecError("Corrupt zstd record: {}".format(error))
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise RecordCodecError("Decompressing zstd records requires the zstandard or pyarrow package")
+    try:
+        return pyarrow.input_stream(pyarrow.py_buffer(data), compression="zstd").read()
+    except (ValueError, OSError) as error:
+        raise RecordCodecError("Corrupt zstd record: {}".format(error))
+
+
+def _zstd_compress(data):
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        return zstandard.ZstdCompressor().compress(data)
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise RecordCodecError("Compressing zstd records requires the zstandard or pyarrow package")
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.CompressedOutputStream(sink, "zstd") as stream:
+        stream.write(data)
+    return sink.getvalue().to_pybytes()
+
+
+def _read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise RecordCodecError("Truncated varint in aggregated record")
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _write_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_fields(data):
+    """
+    Yield the (field number, value) tuples of a protobuf message. Only varint and length-delimited values are kept.
+    """
+    position = 0
+    while position < len(data):
+        key, position = _read_varint(data, position)
+        field_number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, position = _read_varint(data, position)
+        elif wire_type == 2:
+            length, position = _read_varint(data, position)
+            value = data[position:position + length]
+            if len(value) != length:
+                raise RecordCodecError("Truncated field in aggregated record")
+            position += length
+        elif wire_type == 1:
+            position += 8
+            continue
+        elif wire_type == 5:
+            position += 4
+            continue
+        else:
+            raise RecordCodecError("Unsupported wire type {} in aggregated record".format(wire_type))
+        yield field_number, value
+
+
+def _length_delimited(field_number, value):
+    return _write_varint(field_number << 3 | 2) + _write_varint(len(value)) + value
+
+
+def deaggregate(data):
+    """Return the data of the user records of a KPL aggregated record."""
+    message, digest = data[len(KPL_MAGIC):-_DIGEST_BYTES], data[-_DIGEST_BYTES:]
+    if len(data) < len(KPL_MAGIC) + _DIGEST_BYTES or hashlib.md5(message).digest() != digest:
+        raise RecordCodecError("Aggregated record has an invalid checksum")
+
+    user_records = []
+    for field_number, value in _read_fields(message):
+        # Field 3 holds the records, the partition key and explicit hash key tables are not needed
+        if field_number == 3:
+            user_records.extend(value for record_field, value in _read_fields(value) if record_field == 3)
+    return user_records
+
+
+def aggregate(user_records, partition_key="packed"):
+    """Build a KPL aggregated record from the data of the user records, which all share the partition key."""
+    message = _length_delimited(1, partition_key.encode())
+    for data in user_records:
+        # partition_key_index 0 followed by the data
+        record = _write_varint(1 << 3) + _write_varint(0) + _length_delimited(3, data)
+        message += _length_delimited(3, record)
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+
+def decompress(data):
+    """Return the messages of a compressed record, or the payload itself if it is not compressed."""
+    if data.startswith(GZIP_MAGIC):
+        try:
+            data = gzip.decompress(data)
+        except (OSError, EOFError, zlib.error) as error:
+            raise RecordCodecError("Corrupt gzip record: {}".format(error))
+    elif data.startswith(ZSTD_MAGIC):
+        data = _zstd_decompress(data)
+    else:
+        return [data]
+    return [line for line in data.split(b"\n") if line.strip()]
+
+
+def single_line(message):
+    """
+    Return a message without line breaks, so it stays one line of a compressed record. Messages with line breaks, e.g.
+    pretty-printed JSON, are serialized compactly, which escapes the line breaks within their strings.
+    """
+    if b"\n" not in message:
+        return message
+    try:
+        return json.dumps(json.loads(message), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    except ValueError as error:
+        raise RecordCodecError("Message with a line break is not valid JSON: {}".format(error))
+
+
+def compress(messages, compression):
+    body = b"\n".join(single_line(message) for message in messages) + b"\n"
+    if compression == "gzip":
+        return gzip.compress(body)
+    if compression == "zstd":
+        return _zstd_compress(body)
+    raise RecordCodecError("Unsupported compression '{}', expected one of {}".format(
+        compression, ", ".join(COMPRESSIONS)))
+
+
+def decode_record(data):
+    """Return the JSON messages carried by the payload of a Kinesis record."""
+    data = bytes(data)
+    if data.startswith(KPL_MAGIC):
+        return [message for user_record in deaggregate(data) for message in decompress(user_record)]
+    return decompress(data)
+
+
+def pack_records(messages, compression="gzip", aggregated=True, messages_per_record=500,
+                 max_record_bytes=MAX_RECORD_BYTES, partition_key="packed"):
+    """
+    Pack JSON messages into the payloads of as few Kinesis records as possible.
+
+    Without compression every message is a user record of its own. With compression, up to messages_per_record
+    messages are compressed into one user record as JSON lines, see single_line, blocks exceeding the record size are
+    split in half. Aggregation then packs as many user records into one Kinesis record as fit into max_record_bytes.
+    """
+    if compression not in COMPRESSIONS:
+        raise RecordCodecError("Unsupported compression '{}', expected one of {}".format(
+            compression, ", ".join(COMPRESSIONS)))
+
+    # The partition key counts against the record size, and aggregation adds the magic number, checksum and framing
+    limit = max_record_bytes - len(partition_key.encode())
+    if aggregated:
+        limit -= len(KPL_MAGIC) + _DIGEST_BYTES + len(partition_key.encode()) + 16
+
+    def blocks(batch):
+        if compression == "none":
+            for message in batch:
+                if len(message) > limit:
+                    raise RecordCodecError("Message of {} bytes exceeds the record size".format(len(message)))
+                yield message
+            return
+        data = compress(batch, compression)
+        if len(data) <= limit:
+            yield data
+        elif len(batch) == 1:
+            raise RecordCodecError("Compressed message of {} bytes exceeds the record size".format(len(data)))
+        else:
+            yield from blocks(batch[:len(batch) // 2])
+            yield from blocks(batch[len(batch) // 2:])
+
+    def user_records():
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) == messages_per_record:
+                yield from blocks(batch)
+                batch = []
+        if batch:
+            yield from blocks(batch)
+
+    if not aggregated:
+        yield from user_records()
+        return
+
+    pending = []
+    pending_bytes = 0
+    for data in user_records():
+        # Every user record adds its data and up to 16 bytes of protobuf framing
+        size = len(data) + 16
+        if pending and pending_bytes + size > limit:
+            yield aggregate(pending, partition_key)
+            pending, pending_bytes = [], 0
+        pending.append(data)
+        pending_bytes += size
+    if pending:
+        yield aggregate(pending, partition_key)
@@ -0,0 +1,121 @@
+import datetime
+import json
+import sys
+
+import boto3
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+from pyspark.sql.functions import col
+from pyspark.sql.types import StructType
+
+from cached_parameter import CachedParameter
+from compression import compress_closed
+from compression import load_compression
+from field_paths import load_selected_fields
+from transforms import PARTITION_KEYS
+from transforms import compile_dead_letters
+from transforms import compile_projection
+from transforms import decode_records
+from transforms import deduplicate
+from transforms import select_fields
+from transforms import valid_records
+from transforms import write_output
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "startDate",
+        "endDate",
+        "lateArrivalDays",
+        "rawArchiveBucket",
+        "kinesisRecordFormat",
+        "selectedFieldsParameter",
+        "inputSchemaPath",
+        "s3OutputBucket",
+        "outputFormat",
+        "outputCompression",
+        "deduplication",
+        "deduplicationKey",
+        "requiredFields"
+    ]
+)
+sc = SparkContext()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+sc._jsc.hadoopConfiguration().set("mapreduce.fileoutputcommitter.marksuccessfuljobs", "false")
+
+# Only the output partitions written by the replay are replaced, all others are kept
+spark.conf.set("spark.sql.sources.partitionOverwriteMode", "dynamic")
+
+# Read configuration
+param_start_date = datetime.date.fromisoformat(args['startDate'])
+param_end_date = datetime.date.fromisoformat(args['endDate'])
+param_late_arrival_days = int(args['lateArrivalDays'])
+param_raw_archive_bucket = args['rawArchiveBucket']
+param_kinesis_record_format = args['kinesisRecordFormat']
+param_input_schema_path = args['inputSchemaPath']
+param_s3_output_bucket = args['s3OutputBucket']
+param_output_format = args['outputFormat']
+param_output_compression = args['outputCompression']
+param_deduplication = args['deduplication'] == "true"
+param_deduplication_key = args['deduplicationKey']
+param_required_fields = json.loads(args['requiredFields'])
+
+if param_end_date < param_start_date:
+    raise ValueError("The end date {} is before the start date {}".format(param_end_date, param_start_date))
+
+# The replay uses the current version of the selected fields
+_, selected_fields_value = CachedParameter(args['selectedFieldsParameter'], 0).get()
+selected_fields = load_selected_fields(json.loads(selected_fields_value))
+selected_fields_projection = compile_projection(selected_fields)
+selected_fields_compression = load_compression(json.loads(selected_fields_value), selected_fields)
+input_schema = StructType.fromJson(json.loads(spark.read.text(param_input_schema_path, wholetext=True).first()[0]))
+
+
+# The archive is partitioned by arrival date, records of an event date arrive on the same day or up to
+# lateArrivalDays later
+def archived_dates():
+    last_arrival_date = param_end_date + datetime.timedelta(days=param_late_arrival_days)
+    paginator = boto3.client("s3").get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=param_raw_archive_bucket, Prefix="arrival_date=", Delimiter="/"):
+        for prefix in page.get("CommonPrefixes", []):
+            arrival_date = datetime.date.fromisoformat(prefix["Prefix"][len("arrival_date="):-1])
+            if param_start_date <= arrival_date <= last_arrival_date:
+                yield prefix["Prefix"]
+
+
+paths = ["s3://{}/{}".format(param_raw_archive_bucket, prefix) for prefix in archived_dates()]
+if not paths:
+    raise ValueError("The raw archive holds no records between {} and {}".format(param_start_date, param_end_date))
+print("Replaying {} days of the raw archive into the event dates {} to {}".format(
+    len(paths), param_start_date, param_end_date))
+
+# The records of all days are decoded, deduplicated and projected in parallel. The output is repartitioned by the
+# output partitions, so every event hour is written by one task into one file.
+records = spark.read.option("basePath", "s3://{}/".format(param_raw_archive_bucket)).parquet(*paths)
+# Dead letters were written by the Glue ETL Job when the records arrived, the replay skips them
+messages = valid_records(
+    decode_records(records, input_schema, param_kinesis_record_format),
+    compile_dead_letters(param_required_fields, "s3://{}/dead-letter/".format(param_s3_output_bucket))
+)
+if param_deduplication:
+    # Without a streaming state, duplicates are dropped over the whole replay
+    messages = deduplicate(messages, param_deduplication_key, "0 seconds")
+
+output = select_fields(messages, selected_fields_projection) \
+    .where(col("event_date").between(param_start_date.isoformat(), param_end_date.isoformat()))
+if selected_fields_compression is not None:
+    # Every key starts over with its first row of the replayed dates
+    output = compress_closed(output, selected_fields_compression)
+output = output.repartition(*PARTITION_KEYS)
+
+write_output(output, "s3://{}/".format(param_s3_output_bucket), param_output_format, param_output_compression,
+             mode="overwrite")
+
+job.commit()
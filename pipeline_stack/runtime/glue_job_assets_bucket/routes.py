@@ -0,0 +1,69 @@
+"""
+Content-based routes of the Glue ETL Job.
+
+Every route writes the records matching its where condition, e.g. the STS cranes by che_type, with selected fields of
+its own into an output table of its own. All routes are filtered from the persisted micro-batch of the output query, so
+the stream is read once for the output and all routes. The where condition applies to the output columns of the route,
+so conditions on fields of a [*] list, e.g. che_type, select the list elements instead of whole messages.
+"""
+import re
+from collections import namedtuple
+from functools import reduce
+
+from pyspark.sql.functions import col
+
+from field_paths import load_selected_fields
+from transforms import compile_projection
+from transforms import select_fields
+from transforms import write_output
+
+_NAME_PATTERN = re.compile(r"[a-z_][a-z0-9_]*$")
+
+Route = namedtuple("Route", ["name", "where", "projection"])
+
+
+class RouteConfigError(ValueError):
+    pass
+
+
+def load_routes(config):
+    """Validate the routes config and compile the projections of the routes. Returns [] for an empty config."""
+    routes = []
+    for entry in (config or {}).get("routes") or []:
+        if not isinstance(entry, dict) or not _NAME_PATTERN.match(str(entry.get("name"))):
+            raise RouteConfigError("Routes must have a name of lowercase letters, digits and _, got {!r}".format(entry))
+        selected_fields = load_selected_fields({"selected-fields": entry.get("selected-fields")})
+        column_names = [column_name for column_name, _, _ in selected_fields]
+
+        where = {}
+        for column_name, values in (entry.get("where") or {}).items():
+            if column_name not in column_names:
+                raise RouteConfigError("Column '{}' of route '{}' is not one of its selected fields".format(
+                    column_name, entry["name"]))
+            where[column_name] = values if isinstance(values, list) else [values]
+        if not where:
+            raise RouteConfigError("Route '{}' must have a where condition".format(entry["name"]))
+
+        routes.append(Route(entry["name"], where, compile_projection(selected_fields)))
+
+    if len({route.name for route in routes}) != len(routes):
+        raise RouteConfigError("Routes config must contain routes with distinct names")
+    return routes
+
+
+def route_condition(route):
+    """The condition of the rows of a route, every column must match one of its values."""
+    return reduce(lambda left, right: left & right, [
+        col(column_name).isin(values) for column_name, values in route.where.items()
+    ])
+
+
+def write_routes(data_frame, routes, path, output_format, output_compression):
+    # The conditions on message fields are pushed below the explodes of the projection by Spark
+    for route in routes:
+        write_output(
+            select_fields(data_frame, route.projection).where(route_condition(route)),
+            "{}{}/".format(path, route.name),
+            output_format,
+            output_compression
+        )
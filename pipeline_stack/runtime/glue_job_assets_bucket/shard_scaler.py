@@ -0,0 +1,214 @@
+"""
+Shard scaler of the Kinesis data stream.
+
+The scaler runs on a schedule, reads the per-minute IncomingBytes, IncomingRecords and
+WriteProvisionedThroughputExceeded metrics of the stream and changes the shard count with UpdateShardCount. The
+scaling decision only depends on the metric samples, the shard count and the policy, so it can be replayed against
+recorded metric series without AWS, see tools/replay_shard_scaling.py.
+
+Hysteresis keeps the shard count stable: the stream scales out when the utilization stays above the scale-out
+threshold or writes are throttled for a few minutes, and scales in only when the utilization stays below the much
+lower scale-in threshold for a longer time. Both directions have a cooldown after the last scaling.
+"""
+import datetime
+import json
+import math
+import os
+from collections import namedtuple
+
+# Write limits of a provisioned shard per minute
+SHARD_BYTES_PER_MINUTE = 1024 * 1024 * 60
+SHARD_RECORDS_PER_MINUTE = 1000 * 60
+
+# CloudWatch metrics of a minute are complete after a short delay
+METRICS_DELAY_MINUTES = 2
+
+LAST_SCALED_TAG = "shard-scaler:last-scaled"
+
+# The sums of the stream metrics of one minute
+MetricSample = namedtuple("MetricSample", ["incoming_bytes", "incoming_records", "throttled_records"])
+
+ScalingPolicy = namedtuple("ScalingPolicy", [
+    "min_shards",
+    "max_shards",
+    # Utilization of the write limits of the shards between 0 and 1
+    "scale_out_utilization",
+    "scale_in_utilization",
+    "target_utilization",
+    # Consecutive minutes the condition has to hold
+    "scale_out_periods",
+    "scale_in_periods",
+    # Minutes since the last scaling
+    "scale_out_cooldown",
+    "scale_in_cooldown"
+])
+
+Decision = namedtuple("Decision", ["shard_count", "reason"])
+
+
+def validate_policy(policy):
+    if not 1 <= policy.min_shards <= policy.max_shards:
+        raise ValueError("Expected 1 <= min shards <= max shards, got {} and {}".format(
+            policy.min_shards, policy.max_shards))
+    if not 0 < policy.scale_in_utilization < policy.target_utilization < policy.scale_out_utilization <= 1:
+        raise ValueError("Expected 0 < scale-in < target < scale-out utilization <= 1, got {}, {} and {}".format(
+            policy.scale_in_utilization, policy.target_utilization, policy.scale_out_utilization))
+    if policy.scale_out_periods < 1 or policy.scale_in_periods < 1:
+        raise ValueError("Scaling periods must be at least 1")
+    return policy
+
+
+def demand(sample):
+    """The number of shards needed to write the sample without exceeding the write limits."""
+    return max(sample.incoming_bytes / SHARD_BYTES_PER_MINUTE, sample.incoming_records / SHARD_RECORDS_PER_MINUTE)
+
+
+def decide(samples, shard_count, policy, minutes_since_scaling=None):
+    """
+    Decide the shard count for the metric samples of the last minutes, oldest first. minutes_since_scaling is None if
+    the stream has not been scaled before. Returns a Decision with the unchanged shard count if nothing is to be done.
+    """
+    # UpdateShardCount can at most double or halve the shard count in a single call
+    upper = min(policy.max_shards, shard_count * 2)
+    lower = max(policy.min_shards, math.ceil(shard_count / 2))
+
+    def cooled_down(cooldown):
+        return minutes_since_scaling is None or minutes_since_scaling >= cooldown
+
+    # The configured bounds are enforced before looking at the metrics
+    if shard_count > policy.max_shards:
+        return Decision(max(policy.max_shards, lower), "above the maximum of {} shards".format(policy.max_shards))
+    if shard_count < policy.min_shards:
+        return Decision(min(policy.min_shards, upper), "below the minimum of {} shards".format(policy.min_shards))
+
+    recent = samples[-policy.scale_out_periods:]
+    if len(recent) == policy.scale_out_periods and cooled_down(policy.scale_out_cooldown):
+        throttled = all(sample.throttled_records > 0 for sample in recent)
+        hot = all(demand(sample) / shard_count >= policy.scale_out_utilization for sample in recent)
+        if throttled or hot:
+            target = math.ceil(max(demand(sample) for sample in recent) / policy.target_utilization)
+            if throttled:
+                # Throttled writes hide the real demand, so the shard count is doubled
+                target = max(target, shard_count * 2)
+            target = min(target, upper)
+            if target > shard_count:
+                return Decision(target, "writes throttled for {} minutes".format(len(recent)) if throttled
+                                else "utilization above {:.0%} for {} minutes".format(
+                                    policy.scale_out_utilization, len(recent)))
+
+    recent = samples[-policy.scale_in_periods:]
+    if len(recent) == policy.scale_in_periods and cooled_down(policy.scale_in_cooldown):
+        throttled = any(sample.throttled_records > 0 for sample in recent)
+        peak = max(demand(sample) for sample in recent)
+        if not throttled and peak / shard_count <= policy.scale_in_utilization:
+            target = max(math.ceil(peak / policy.target_utilization), lower)
+            if target < shard_count:
+                return Decision(target, "utilization below {:.0%} for {} minutes".format(
+                    policy.scale_in_utilization, len(recent)))
+
+    return Decision(shard_count, "within thresholds")
+
+
+def load_policy(environ):
+    return validate_policy(ScalingPolicy(
+        min_shards=int(environ["MIN_SHARDS"]),
+        max_shards=int(environ["MAX_SHARDS"]),
+        scale_out_utilization=float(environ["SCALE_OUT_UTILIZATION"]),
+        scale_in_utilization=float(environ["SCALE_IN_UTILIZATION"]),
+        target_utilization=float(environ["TARGET_UTILIZATION"]),
+        scale_out_periods=int(environ.get("SCALE_OUT_PERIODS", 3)),
+        scale_in_periods=int(environ.get("SCALE_IN_PERIODS", 30)),
+        scale_out_cooldown=int(environ.get("SCALE_OUT_COOLDOWN", 5)),
+        scale_in_cooldown=int(environ.get("SCALE_IN_COOLDOWN", 60))
+    ))
+
+
+def fetch_samples(cloudwatch, stream_name, start, end):
+    """Fetch the per-minute metric samples of the stream between start and end, minutes without data count as zero."""
+    names = {
+        "incoming_bytes": "IncomingBytes",
+        "incoming_records": "IncomingRecords",
+        "throttled_records": "WriteProvisionedThroughputExceeded"
+    }
+    queries = [
+        {
+            "Id": field,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/Kinesis",
+                    "MetricName": metric_name,
+                    "Dimensions": [{"Name": "StreamName", "Value": stream_name}]
+                },
+                "Period": 60,
+                "Stat": "Sum"
+            }
+        }
+        for field, metric_name in names.items()
+    ]
+
+    values = {field: {} for field in names}
+    paginator = cloudwatch.get_paginator("get_metric_data")
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start, EndTime=end):
+        for result in page["MetricDataResults"]:
+            for timestamp, value in zip(result["Timestamps"], result["Values"]):
+                values[result["Id"]][timestamp.replace(second=0, microsecond=0)] = value
+
+    minutes = int((end - start).total_seconds() // 60)
+    samples = []
+    for minute in range(minutes):
+        timestamp = start + datetime.timedelta(minutes=minute)
+        samples.append(MetricSample(*(values[field].get(timestamp, 0.0) for field in names)))
+    return samples
+
+
+def minutes_since_last_scaling(kinesis, stream_name, now):
+    tags = kinesis.list_tags_for_stream(StreamName=stream_name)["Tags"]
+    for tag in tags:
+        if tag["Key"] == LAST_SCALED_TAG:
+            last_scaled = datetime.datetime.fromisoformat(tag["Value"])
+            return (now - last_scaled).total_seconds() / 60
+    return None
+
+
+def handler(event, context):
+    # Imported here, so the scaling decision can be replayed locally without the AWS SDK
+    import boto3
+
+    stream_name = os.environ["STREAM_NAME"]
+    policy = load_policy(os.environ)
+    kinesis = boto3.client("kinesis")
+    cloudwatch = boto3.client("cloudwatch")
+
+    summary = kinesis.describe_stream_summary(StreamName=stream_name)["StreamDescriptionSummary"]
+    if summary["StreamStatus"] != "ACTIVE":
+        print(json.dumps({"stream": stream_name, "action": "none", "reason": "stream is " + summary["StreamStatus"]}))
+        return {"shard_count": summary["OpenShardCount"]}
+
+    shard_count = summary["OpenShardCount"]
+    now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    end = now - datetime.timedelta(minutes=METRICS_DELAY_MINUTES)
+    start = end - datetime.timedelta(minutes=max(policy.scale_out_periods, policy.scale_in_periods))
+    samples = fetch_samples(cloudwatch, stream_name, start, end)
+
+    decision = decide(samples, shard_count, policy, minutes_since_last_scaling(kinesis, stream_name, now))
+    if decision.shard_count != shard_count:
+        try:
+            kinesis.update_shard_count(
+                StreamName=stream_name,
+                TargetShardCount=decision.shard_count,
+                ScalingType="UNIFORM_SCALING"
+            )
+        except kinesis.exceptions.LimitExceededException as error:
+            # Kinesis limits the scaling operations per stream and day, the next run tries again
+            print(json.dumps({"stream": stream_name, "action": "none", "reason": str(error)}))
+            return {"shard_count": shard_count}
+        kinesis.add_tags_to_stream(StreamName=stream_name, Tags={LAST_SCALED_TAG: now.isoformat()})
+
+    print(json.dumps({
+        "stream": stream_name,
+        "action": "scale" if decision.shard_count != shard_count else "none",
+        "shard_count": shard_count,
+        "target_shard_count": decision.shard_count,
+        "reason": decision.reason
+    }))
+    return {"shard_count": decision.shard_count}
@@ -0,0 +1,376 @@
+"""
+Transformations of the Glue ETL Job. The module only depends on PySpark, so the transformations can be run and
+benchmarked outside of Glue with a local Spark session.
+"""
+import base64
+import time
+from collections import namedtuple
+
+from pyspark.sql.functions import array
+from pyspark.sql.functions import avg
+from pyspark.sql.functions import coalesce
+from pyspark.sql.functions import concat
+from pyspark.sql.functions import concat_ws
+from pyspark.sql.functions import col
+from pyspark.sql.functions import count
+from pyspark.sql.functions import current_timestamp
+from pyspark.sql.functions import date_format
+from pyspark.sql.functions import explode_outer
+from pyspark.sql.functions import expr
+from pyspark.sql.functions import from_json
+from pyspark.sql.functions import greatest
+from pyspark.sql.functions import least
+from pyspark.sql.functions import lit
+from pyspark.sql.functions import max as max_
+from pyspark.sql.functions import min as min_
+from pyspark.sql.functions import posexplode
+from pyspark.sql.functions import struct
+from pyspark.sql.functions import to_timestamp
+from pyspark.sql.functions import udf
+from pyspark.sql.functions import when
+from pyspark.sql.types import ArrayType
+from pyspark.sql.types import StringType
+from pyspark.sql.types import StructField
+from pyspark.sql.types import StructType
+
+from field_paths import EACH
+from field_paths import FieldPathError
+from field_paths import parse_field_path
+from field_paths import plan_explodes
+from metrics import job_ids
+from metrics import output_statistics
+from record_codec import RecordCodecError
+from record_codec import decode_record
+
+PARTITION_KEYS = ["event_date", "event_hour"]
+RAW_ARCHIVE_PARTITION_KEYS = ["arrival_date", "arrival_hour"]
+
+# Timestamps are written to JSON in the format of Hive, which the JSON SerDes of the output table read as timestamps
+JSON_TIMESTAMP_FORMAT = "yyyy-MM-dd HH:mm:ss.SSS"
+
+# The explodes of a projection as (alias, generator) tuples and its output columns
+Projection = namedtuple("Projection", ["explodes", "columns"])
+
+# The reason of a dead letter as a column expression, which is null for valid records, and the path of the dead letters
+DeadLetters = namedtuple("DeadLetters", ["reason", "path"])
+
+# The columns of the decoded records with the original message, its decoding error and its parsing error
+PAYLOAD = "_payload"
+DECODE_ERROR = "_decode_error"
+CORRUPT_RECORD = "_corrupt_record"
+
+# The columns of the Kinesis record of a decoded row. The raw record is only set on the archive row of a record, the
+# position of a message within its record identifies rows without a key.
+RAW_RECORD = "_raw_record"
+ARRIVAL_TIME = "_arrival_time"
+RECORD_POSITION = "_record_position"
+_RAW_RECORD_COLUMNS = ["data", "partitionKey", "sequenceNumber", "approximateArrivalTimestamp"]
+
+_DECODED_PAYLOAD = ArrayType(StructType([
+    StructField("message", StringType()),
+    StructField("error", StringType())
+]))
+
+
+# Build a Spark column expression from the steps of a parsed field path, starting at the given column
+def apply_steps(column, steps):
+    for step in steps:
+        column = column.getItem(step) if isinstance(step, int) else column.getField(step)
+    return column
+
+
+# Build a Spark column expression from the steps of a parsed field path without [*] steps
+def field_path_to_column(steps):
+    return apply_steps(col(steps[0]), steps[1:])
+
+
+# Return the messages of the data of a Kinesis record, or its base64 encoded data and the reason it cannot be decoded
+def decode_payload(data):
+    try:
+        return [(message.decode("utf-8"), None) for message in decode_record(data)]
+    except (RecordCodecError, UnicodeDecodeError) as error:
+        return [(base64.b64encode(bytes(data)).decode("ascii"), "Undecodable record: {}".format(error))]
+
+
+# Decode the raw data of Kinesis records into one row per message with the columns of the input schema. Every row keeps
+# the original message and the errors of decoding and parsing it, which make it a dead letter. A "json" record is a
+# single message, which is decoded natively, only "packed" records go through the Python UDF. With archive, every
+# record adds a row of its own with the raw record, which write_raw_archive writes from the same micro-batch, so the
+# stream is read once for the output and the archive.
+def decode_records(data_frame, schema, record_format, archive=False):
+    parse_schema = StructType(schema.fields + [StructField(CORRUPT_RECORD, StringType())])
+    if record_format == "json":
+        # Invalid UTF-8 is replaced rather than failing the message, it usually fails the parsing
+        entries = array(struct(col("data").cast("string").alias("message"), lit(None).cast("string").alias("error")))
+    else:
+        entries = udf(decode_payload, _DECODED_PAYLOAD)(col("data"))
+    if archive:
+        # The archive row is a null entry in front of the messages
+        entries = concat(array(lit(None).cast(_DECODED_PAYLOAD.elementType)), entries)
+    return data_frame \
+        .select(posexplode(entries).alias("position", "record"), *_RAW_RECORD_COLUMNS) \
+        .select(
+            from_json(
+                col("record.message"), parse_schema, {"columnNameOfCorruptRecord": CORRUPT_RECORD}
+            ).alias("message"),
+            col("record.message").alias(PAYLOAD),
+            col("record.error").alias(DECODE_ERROR),
+            when(col("record").isNull(), struct(*_RAW_RECORD_COLUMNS)).alias(RAW_RECORD),
+            col("approximateArrivalTimestamp").alias(ARRIVAL_TIME),
+            concat_ws(":", col("partitionKey"), col("sequenceNumber"), col("position")).alias(RECORD_POSITION)
+        ) \
+        .select("message.*", PAYLOAD, DECODE_ERROR, RAW_RECORD, ARRIVAL_TIME, RECORD_POSITION)
+
+
+# The decoded messages of a batch without the archive rows of their records
+def decoded_messages(data_frame):
+    return data_frame.where(col(RAW_RECORD).isNull())
+
+
+# Compile the checks of the decoded records into the reason a record is a dead letter, which is null for valid
+# records. Records which cannot be decoded or parsed with the input schema, e.g. a che object instead of a list, and
+# records missing a required field are dead letters.
+def compile_dead_letters(required_fields, path):
+    checks = [col(DECODE_ERROR), when(col(CORRUPT_RECORD).isNotNull(), lit("Malformed JSON or schema violation"))]
+    for required_field in required_fields:
+        steps = parse_field_path(required_field)
+        if EACH in steps:
+            raise FieldPathError("The required field {!r} must address a single field".format(required_field))
+        checks.append(when(field_path_to_column(steps).isNull(), lit("Missing required field {}".format(
+            required_field))))
+    return DeadLetters(reason=coalesce(*checks), path=path)
+
+
+def valid_records(data_frame, dead_letters):
+    return data_frame.where(dead_letters.reason.isNull())
+
+
+# Write the dead letters of a batch with their reason and original message, partitioned by the processing date, and
+# return the valid records and the number of dead letters
+def route_dead_letters(data_frame, dead_letters):
+    processing_time = current_timestamp()
+    letters = data_frame \
+        .where(dead_letters.reason.isNotNull()) \
+        .select(
+            dead_letters.reason.alias("reason"),
+            col(PAYLOAD).alias("payload"),
+            date_format(processing_time, "yyyy-MM-dd HH:mm:ss.SSS").alias("processed_at"),
+            date_format(processing_time, "yyyy-MM-dd").alias("processing_date")
+        )
+    letter_count = letters.count()
+    if letter_count:
+        letters.write \
+            .mode("append") \
+            .format("json") \
+            .option("compression", "gzip") \
+            .partitionBy("processing_date") \
+            .save(dead_letters.path)
+    return valid_records(data_frame, dead_letters), letter_count
+
+
+# Drop the messages with a key seen before. The key is kept in the streaming state together with the deduplication time
+# of the message, so the watermark can evict keys once their time is the TTL behind the latest one. The deduplication
+# time is the event time of the message, which retried messages share with the original, clamped to the half TTL
+# before their arrival time. The watermark therefore follows the arrival time: a message with a skewed clock cannot
+# move it ahead, and a late message is only dropped if it arrived more than the half TTL before the latest messages.
+# Duplicates with an event time outside of the clamp get the arrival time of each copy, they are only dropped when the
+# same record is read again.
+# Rows without a key or event time, e.g. dead letters, are keyed by their position in their Kinesis record at their
+# arrival time, so they are only dropped when their record is read again. A batch DataFrame has no watermark, its
+# duplicates are dropped by key only.
+def deduplicate(data_frame, key_path, ttl):
+    key_steps = parse_field_path(key_path)
+    if EACH in key_steps:
+        raise FieldPathError("The deduplication key {!r} must address a single field".format(key_path))
+    key = coalesce(field_path_to_column(key_steps).cast("string"), concat(lit("record:"), col(RECORD_POSITION)))
+    if not data_frame.isStreaming:
+        return data_frame.withColumn("_dedup_key", key).dropDuplicates(["_dedup_key"]).drop("_dedup_key")
+
+    arrival_time = col(ARRIVAL_TIME)
+    event_time = to_timestamp(field_path_to_column(parse_field_path("msg.timestamp")))
+    # least and greatest skip nulls, rows without an event time get their arrival time
+    dedup_time = greatest(least(event_time, arrival_time), arrival_time - expr("INTERVAL {} / 2".format(ttl)))
+    return data_frame \
+        .withColumn("_dedup_key", key) \
+        .withColumn("_dedup_time", dedup_time) \
+        .withWatermark("_dedup_time", ttl) \
+        .dropDuplicates(["_dedup_key", "_dedup_time"]) \
+        .drop("_dedup_key", "_dedup_time")
+
+
+# Archive the raw records of a decoded batch as they were put into the stream, packed records included, with their
+# partition key, sequence number and arrival time. The archive is partitioned by the arrival time, since the event time
+# is only known after decoding the records. Every arrival hour of a batch is written into one file, empty batches write
+# no files.
+def write_raw_archive(data_frame, path):
+    arrival_time = col("approximateArrivalTimestamp")
+    data_frame \
+        .where(col(RAW_RECORD).isNotNull()) \
+        .select("{}.*".format(RAW_RECORD)) \
+        .select(
+            *_RAW_RECORD_COLUMNS,
+            date_format(arrival_time, "yyyy-MM-dd").alias("arrival_date"),
+            date_format(arrival_time, "HH").alias("arrival_hour")
+        ) \
+        .repartition(*RAW_ARCHIVE_PARTITION_KEYS) \
+        .write \
+        .mode("append") \
+        .format("parquet") \
+        .option("compression", "zstd") \
+        .partitionBy(*RAW_ARCHIVE_PARTITION_KEYS) \
+        .save(path)
+
+
+# Metrics of the deduplication from the progress of the last micro-batch of the streaming query. The unique rows are
+# the keys added to the state. Duplicates are only known if the input rows of the query are messages.
+def deduplication_metrics(progress, count_duplicates=True):
+    state = progress["stateOperators"][0]
+    metrics = {
+        "DeduplicationStateRows": (state["numRowsTotal"], "Count"),
+        "DeduplicationStateBytes": (state["memoryUsedBytes"], "Bytes"),
+        "DeduplicationUniqueRows": (state["numRowsUpdated"], "Count"),
+        "DeduplicationLateRowsDropped": (state.get("numRowsDroppedByWatermark", 0), "Count")
+    }
+    if count_duplicates:
+        duplicates = progress["numInputRows"] - state["numRowsUpdated"] - state.get("numRowsDroppedByWatermark", 0)
+        metrics["DeduplicationDuplicateRowsDropped"] = (max(0, duplicates), "Count")
+    return metrics
+
+
+# Cast a selected field to the Spark type of its column. Values which cannot be cast become nulls.
+def cast_field(column, field_type):
+    if field_type == "timestamp":
+        return to_timestamp(column)
+    if field_type == "int":
+        return column.cast("bigint")
+    return column.cast(field_type)
+
+
+# Records are partitioned by their own event time. Records without a parseable timestamp fall back to the processing
+# time.
+def partition_columns():
+    event_time = coalesce(to_timestamp(field_path_to_column(parse_field_path("msg.timestamp"))), current_timestamp())
+    return [
+        date_format(event_time, "yyyy-MM-dd").alias("event_date"),
+        date_format(event_time, "HH").alias("event_hour")
+    ]
+
+
+# Compile the selected fields into the explodes and column expressions of the projection, including the partition
+# columns. Every [*] prefix of the field paths becomes an outer explode into a column of its own, which the fields
+# below the prefix are read from. Every field is cast to the type of its column. The projection is planned once and
+# reused by every batch.
+def compile_projection(selected_fields):
+    explodes, fields = plan_explodes(selected_fields)
+    aliases = {prefix: "_each_{}".format(i) for i, (prefix, _, _) in enumerate(explodes)}
+
+    def relative_column(prefix, steps):
+        if prefix is None:
+            return field_path_to_column(steps)
+        return apply_steps(col(aliases[prefix]), steps)
+
+    return Projection(
+        explodes=[
+            (aliases[prefix], explode_outer(relative_column(parent, steps))) for prefix, parent, steps in explodes
+        ],
+        columns=[
+            cast_field(relative_column(prefix, steps), field_type).alias(column_name)
+            for column_name, prefix, steps, field_type in fields
+        ] + partition_columns()
+    )
+
+
+# The explodes are generators in the same stage as the final projection, so the batch is still read in a single pass
+def select_fields(data_frame, projection):
+    for alias, generator in projection.explodes:
+        data_frame = data_frame.select("*", generator.alias(alias))
+    return data_frame.select(*projection.columns)
+
+
+def write_output(data_frame, path, output_format, output_compression, mode="append"):
+    data_frame.write \
+        .mode(mode) \
+        .format(output_format) \
+        .option("compression", output_compression) \
+        .option("timestampFormat", JSON_TIMESTAMP_FORMAT) \
+        .partitionBy(*PARTITION_KEYS) \
+        .save(path)
+
+
+# The number of records and the earliest, average and latest event time of a batch in epoch seconds, in a single
+# aggregation over the persisted batch. The records include the dead letters, the event times are those of the valid
+# records.
+def input_statistics(data_frame, dead_letters=None):
+    event_time = to_timestamp(field_path_to_column(parse_field_path("msg.timestamp"))).cast("double")
+    if dead_letters is not None:
+        event_time = when(dead_letters.reason.isNull(), event_time)
+    return data_frame.agg(
+        count(lit(1)).alias("records"),
+        min_(event_time).alias("earliest"),
+        avg(event_time).alias("average"),
+        max_(event_time).alias("latest")
+    ).first()
+
+
+def batch_metrics(records_in, rows_out, bytes_written, started, statistics=None):
+    now = time.time()
+    metrics = {
+        "BatchRecordsIn": (records_in, "Count"),
+        "BatchWallTime": ((time.monotonic() - started) * 1000, "Milliseconds")
+    }
+    if rows_out is not None:
+        metrics["BatchRowsOut"] = (rows_out, "Count")
+        metrics["BatchBytesWritten"] = (bytes_written, "Bytes")
+    # The lag from the event time of the records until they are written
+    if statistics is not None and statistics["earliest"] is not None:
+        metrics["EndToEndLagMax"] = ((now - statistics["earliest"]) * 1000, "Milliseconds")
+        metrics["EndToEndLagAverage"] = ((now - statistics["average"]) * 1000, "Milliseconds")
+        metrics["EndToEndLagMin"] = ((now - statistics["latest"]) * 1000, "Milliseconds")
+    return metrics
+
+
+def process_batch(data_frame, projection, path, output_format, output_compression, metrics=None,
+                  dead_letters=None, compress=None):
+    started = time.monotonic()
+
+    # Fetching a single row is enough to detect an empty batch, a count would scan all of it
+    if not data_frame.take(1):
+        if metrics is not None:
+            metrics.put(batch_metrics(0, 0, 0, started) | ({"DeadLetterRows": (0, "Count")} if dead_letters else {}))
+        return
+
+    # The records in are counted before the dead letters are split off, so they add up to the rows out and the dead
+    # letters
+    statistics = input_statistics(data_frame, dead_letters) if metrics is not None else None
+
+    # Dead letters are split off before the write, so they never end up in the output as rows of nulls
+    dead_letter_count = None
+    if dead_letters is not None:
+        data_frame, dead_letter_count = route_dead_letters(data_frame, dead_letters)
+
+    # Select the configured fields, optionally drop the rows within the tolerance of their key, and write them in a
+    # single partitioned write
+    output = select_fields(data_frame, projection)
+    if compress is not None:
+        output = compress(output)
+
+    if metrics is None:
+        write_output(output, path, output_format, output_compression)
+        return
+
+    # The statistics are read from the persisted batch, and the rows and bytes from the Spark jobs of the write
+    spark_context = data_frame.sql_ctx.sparkSession.sparkContext
+    jobs_before = job_ids(spark_context)
+    write_output(output, path, output_format, output_compression)
+    written = output_statistics(spark_context, job_ids(spark_context) - jobs_before)
+
+    batch = batch_metrics(
+        statistics["records"],
+        written[0] if written else None,
+        written[1] if written else None,
+        started,
+        statistics
+    )
+    if dead_letter_count is not None:
+        batch["DeadLetterRows"] = (dead_letter_count, "Count")
+    metrics.put(batch)
@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules of the Glue ETL Job are flat modules next to the job script, they are imported like Glue does it with
+# --extra-py-files
+RUNTIME_DIR = Path(__file__).parent.parent.joinpath("pipeline_stack", "runtime", "glue_job_assets_bucket").resolve()
+
+if str(RUNTIME_DIR) not in sys.path:
+    sys.path.insert(0, str(RUNTIME_DIR))
+
+
+@pytest.fixture(scope="session")
+def spark():
+    """
+    A local Spark session for the transformations, in UTC like the Glue ETL Job. The Python workers of the UDFs import
+    the modules from the runtime directory as well.
+    """
+    sql = pytest.importorskip("pyspark.sql")
+    session = sql.SparkSession.builder \
+        .master("local[1]") \
+        .config("spark.ui.enabled", "false") \
+        .config("spark.sql.shuffle.partitions", "1") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.executorEnv.PYTHONPATH", str(RUNTIME_DIR)) \
+        .getOrCreate()
+    yield session
+    session.stop()
@@ -0,0 +1,123 @@
+import pytest
+
+from adaptive_window import BatchObservation
+from adaptive_window import WindowChange
+from adaptive_window import WindowPolicy
+from adaptive_window import decide_window
+from adaptive_window import load_window_policy
+from adaptive_window import parse_window_size
+
+POLICY = WindowPolicy(
+    min_window_seconds=5,
+    max_window_seconds=120,
+    target_utilization=0.6,
+    min_records=5000,
+    max_lag_seconds=30,
+    min_change=0.25,
+    cooldown_seconds=900
+)
+
+
+def batches(duration_seconds, records, count=5):
+    return [BatchObservation(duration_seconds, records)] * count
+
+
+@pytest.mark.parametrize("window_size, seconds", [
+    ("10 seconds", 10),
+    ("1 second", 1),
+    ("2 minutes", 120),
+    (" 1.5minute", 90),
+    ("1 hour", 3600)
+])
+def test_parse_window_size(window_size, seconds):
+    assert parse_window_size(window_size) == seconds
+
+
+@pytest.mark.parametrize("window_size", ["10", "10 days", "ten seconds", ""])
+def test_parse_window_size_rejects_invalid_sizes(window_size):
+    with pytest.raises(ValueError):
+        parse_window_size(window_size)
+
+
+def test_load_window_policy():
+    policy = load_window_policy({
+        "min-window-size": "5 seconds",
+        "max-window-size": "2 minutes",
+        "target-utilization": 0.6,
+        "min-records": 5000,
+        "max-lag-seconds": 30
+    })
+
+    assert policy == POLICY
+    assert load_window_policy({}) is None
+
+
+def test_too_few_micro_batches_keep_the_window():
+    assert decide_window(batches(9, 100, count=4), None, 10, POLICY).window_seconds == 10
+
+
+def test_slow_micro_batches_grow_the_window():
+    decision = decide_window(batches(9, 40000), None, 10, POLICY)
+
+    assert decision.window_seconds == 15
+    assert decision.reason == "micro-batches take 90% of the window"
+
+
+def test_lag_shrinks_the_window():
+    decision = decide_window(batches(6, 10000), 60, 20, POLICY)
+
+    assert decision.window_seconds == 10
+    assert decision.reason == "the stream is 60 seconds behind"
+
+
+def test_few_records_grow_the_window():
+    decision = decide_window(batches(3, 2500), None, 10, POLICY)
+
+    assert decision.window_seconds == 30
+    assert decision.reason == "micro-batches of 2500 records"
+
+
+def test_records_within_the_headroom_keep_the_window():
+    decision = decide_window(batches(4, 8000), None, 20, POLICY)
+
+    assert decision.window_seconds == 20
+
+
+def test_many_records_shrink_the_window_to_the_minimum_records():
+    decision = decide_window(batches(6, 30000), None, 40, POLICY)
+
+    assert decision.window_seconds == 10
+    assert decision.reason == "micro-batches of 30000 records"
+
+
+def test_the_reason_names_the_utilization_when_it_limits_the_shrink():
+    decision = decide_window(batches(12, 30000), None, 40, POLICY)
+
+    assert decision.window_seconds == 20
+    assert decision.reason == "micro-batches take 30% of the window"
+
+
+def test_small_changes_keep_the_window():
+    assert decide_window(batches(6.5, 40000), None, 10, POLICY).window_seconds == 10
+
+
+def test_the_window_is_kept_for_the_cooldown():
+    decision = decide_window(batches(3, 2500), None, 10, POLICY, WindowChange(grew=False, seconds_ago=300))
+
+    assert decision.window_seconds == 10
+    assert decision.reason == "changed 300 seconds ago, micro-batches of 2500 records"
+    assert decide_window(batches(3, 2500), None, 10, POLICY, WindowChange(False, 900)).window_seconds == 30
+
+
+def test_micro_batches_longer_than_the_window_skip_the_cooldown():
+    decision = decide_window(batches(12, 40000), None, 10, POLICY, WindowChange(grew=False, seconds_ago=60))
+
+    assert decision.window_seconds == 20
+
+
+def test_a_reversal_needs_the_signal_in_every_micro_batch():
+    observations = batches(3, 2500, count=4) + [BatchObservation(3, 6000)]
+
+    assert decide_window(observations, None, 10, POLICY).window_seconds == 30
+    assert decide_window(observations, None, 10, POLICY, WindowChange(False, 1800)).window_seconds == 10
+    assert decide_window(observations, None, 10, POLICY, WindowChange(True, 1800)).window_seconds == 30
@@ -0,0 +1,127 @@
+import pytest
+
+pytest.importorskip("pyspark")
+
+from aggregates import AggregateConfigError  # noqa: E402
+from aggregates import AggregateState  # noqa: E402
+from aggregates import load_aggregates  # noqa: E402
+
+COLUMNS = ["che_id", "msg_timestamp", "weight"]
+
+
+def aggregates_config(*aggregates):
+    return {
+        "key": "che_id",
+        "key-type": "bigint",
+        "event-time": "msg_timestamp",
+        "watermark": "10 minutes",
+        "windows": [{"name": "tumbling_1h", "duration": "1 hour"}],
+        "aggregates": list(aggregates)
+    }
+
+
+AGGREGATES = load_aggregates(aggregates_config(
+    {"messages": {"function": "count"}},
+    {"max_weight": {"function": "max", "column": "weight"}}
+), COLUMNS)
+
+
+def batch(spark, *rows):
+    return spark.createDataFrame(list(rows), "che_id bigint, msg_timestamp string, weight double")
+
+
+def written_windows(spark, path):
+    return sorted((row["che_id"], str(row["window_start"]), row["messages"], row["max_weight"])
+                  for row in spark.read.parquet(path).collect())
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "aggregate_state"), str(tmp_path / "aggregates")
+
+
+def test_open_windows_continue_after_a_restart(spark, paths):
+    state_path, output_path = paths
+    AggregateState(spark, AGGREGATES, state_path).apply(
+        batch(spark, (1, "2023-03-01 10:00:00", 10.0), (1, "2023-03-01 10:30:00", 30.0)),
+        0, output_path, "parquet", "snappy")
+
+    # A new state, like after a restart of the job, continues with the open windows and the watermark
+    AggregateState(spark, AGGREGATES, state_path).apply(
+        batch(spark, (1, "2023-03-01 10:50:00", 20.0), (1, "2023-03-01 11:20:00", 5.0)),
+        1, output_path, "parquet", "snappy")
+
+    assert written_windows(spark, output_path) == [(1, "2023-03-01 10:00:00", 3, 30.0)]
+
+
+def test_a_retried_batch_writes_its_windows_once(spark, paths):
+    state_path, output_path = paths
+    aggregate_state = AggregateState(spark, AGGREGATES, state_path)
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 10:00:00", 10.0)), 0, output_path, "parquet", "snappy")
+    closing = batch(spark, (1, "2023-03-01 11:20:00", 5.0))
+    aggregate_state.apply(closing, 1, output_path, "parquet", "snappy")
+
+    aggregate_state.apply(closing, 1, output_path, "parquet", "snappy")
+    AggregateState(spark, AGGREGATES, state_path).apply(closing, 1, output_path, "parquet", "snappy")
+
+    assert written_windows(spark, output_path) == [(1, "2023-03-01 10:00:00", 1, 10.0)]
+
+
+def test_a_batch_retried_after_its_commit_moves_the_staged_windows(spark, paths):
+    state_path, output_path = paths
+    aggregate_state = AggregateState(spark, AGGREGATES, state_path)
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 10:00:00", 10.0), (2, "2023-03-01 10:05:00", 7.0)),
+                          0, output_path, "parquet", "snappy")
+
+    def fail(batch_id, path):
+        raise RuntimeError("Interrupted")
+
+    # The job fails after the state of the batch is committed, before its closed windows are moved
+    aggregate_state._move_closed = fail
+    closing = batch(spark, (1, "2023-03-01 11:20:00", 5.0))
+    with pytest.raises(RuntimeError):
+        aggregate_state.apply(closing, 1, output_path, "parquet", "snappy")
+
+    AggregateState(spark, AGGREGATES, state_path).apply(closing, 1, output_path, "parquet", "snappy")
+
+    assert written_windows(spark, output_path) == [(1, "2023-03-01 10:00:00", 1, 10.0),
+                                                   (2, "2023-03-01 10:00:00", 1, 7.0)]
+
+
+def test_a_batch_retried_before_its_commit_starts_from_the_previous_state(spark, paths, tmp_path):
+    state_path, output_path = paths
+    AggregateState(spark, AGGREGATES, state_path).apply(
+        batch(spark, (1, "2023-03-01 10:00:00", 10.0)), 0, output_path, "parquet", "snappy")
+    # The job failed while it wrote the state of the next batch, which has no watermark
+    (tmp_path / "aggregate_state" / "batch=1" / "open").mkdir(parents=True)
+
+    aggregate_state = AggregateState(spark, AGGREGATES, state_path)
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 10:10:00", 20.0)), 1, output_path, "parquet", "snappy")
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 11:20:00", 5.0)), 2, output_path, "parquet", "snappy")
+
+    assert written_windows(spark, output_path) == [(1, "2023-03-01 10:00:00", 2, 20.0)]
+    assert sorted(path.name for path in (tmp_path / "aggregate_state").iterdir()) == ["batch=1", "batch=2"]
+
+
+@pytest.mark.parametrize("max_distinct", [None, 0, "10", True])
+def test_count_distinct_needs_a_cap(max_distinct):
+    with pytest.raises(AggregateConfigError, match="max-distinct"):
+        load_aggregates(aggregates_config(
+            {"weights": {"function": "count_distinct", "column": "weight", "max-distinct": max_distinct}}), COLUMNS)
+
+
+def test_count_distinct_counts_up_to_the_cap(spark, paths):
+    state_path, output_path = paths
+    aggregates = load_aggregates(aggregates_config(
+        {"weights": {"function": "count_distinct", "column": "weight", "max-distinct": 2}}), COLUMNS)
+    aggregate_state = AggregateState(spark, aggregates, state_path)
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 10:00:00", 1.0), (1, "2023-03-01 10:01:00", 1.0),
+                                (2, "2023-03-01 10:00:00", 1.0), (2, "2023-03-01 10:01:00", 2.0)),
+                          0, output_path, "parquet", "snappy")
+    aggregate_state.apply(batch(spark, (1, "2023-03-01 10:02:00", 2.0), (2, "2023-03-01 10:02:00", 3.0),
+                                (3, "2023-03-01 11:20:00", 1.0)),
+                          1, output_path, "parquet", "snappy")
+
+    # The distinct values of che 2 exceed the cap, it has no count
+    assert sorted((row["che_id"], row["weights"]) for row in spark.read.parquet(output_path).collect()) == [
+        (1, 2), (2, None)]
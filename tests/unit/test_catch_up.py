@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from catch_up import ReadProfile
+from catch_up import StartingPositionError
+from catch_up import checkpoint_suffix
+from catch_up import choose_profile
+from catch_up import load_read_profiles
+from catch_up import seconds_behind_latest
+from catch_up import source_options
+from catch_up import validate_starting_position
+
+
+@pytest.mark.parametrize("current, lag_seconds, expected", [
+    ("steady", None, "steady"),
+    ("catch-up", None, "catch-up"),
+    ("steady", 100, "steady"),
+    ("steady", 600, "catch-up"),
+    ("steady", 900, "catch-up"),
+    ("catch-up", 300, "catch-up"),
+    ("catch-up", 60, "steady"),
+    ("catch-up", 0, "steady")
+])
+def test_choose_profile(current, lag_seconds, expected):
+    assert choose_profile(current, lag_seconds, catch_up_lag_seconds=600, steady_lag_seconds=60) == expected
+
+
+def test_load_read_profiles():
+    profiles = load_read_profiles({
+        "steady": {"window-size": "10 seconds", "max-fetch-time-ms": "1000", "max-fetch-records-per-shard": 10000},
+        "catch-up": {"window-size": "60 seconds", "max-fetch-time-ms": 5000, "max-fetch-records-per-shard": 100000}
+    })
+
+    assert profiles == {
+        "steady": ReadProfile("steady", "10 seconds", 1000, 10000),
+        "catch-up": ReadProfile("catch-up", "60 seconds", 5000, 100000)
+    }
+    assert source_options(profiles["steady"], "LATEST") == {
+        "startingPosition": "LATEST",
+        "maxFetchTimeInMs": 1000,
+        "maxFetchRecordsPerShard": 10000
+    }
+
+
+@pytest.mark.parametrize("starting_position", ["TRIM_HORIZON", "LATEST", "2023-03-01T06:00:00Z",
+                                               "2023-03-01T06:00:00+01:00"])
+def test_validate_starting_position(starting_position):
+    assert validate_starting_position(starting_position) == starting_position
+
+
+@pytest.mark.parametrize("starting_position", ["EARLIEST", "2023-03-01", "2023-03-01 06:00:00", None])
+def test_validate_starting_position_rejects_invalid_positions(starting_position):
+    with pytest.raises(StartingPositionError):
+        validate_starting_position(starting_position)
+
+
+def test_checkpoint_suffix():
+    assert checkpoint_suffix("TRIM_HORIZON") == ""
+    assert checkpoint_suffix("LATEST") == "-latest"
+    assert checkpoint_suffix("2023-03-01T06:00:00Z") == "-20230301t060000z"
+
+
+class FakeCloudWatch:
+
+    def __init__(self, datapoints):
+        self.datapoints = datapoints
+
+    def get_metric_statistics(self, **kwargs):
+        return {"Datapoints": self.datapoints}
+
+
+def test_seconds_behind_latest_reads_the_latest_datapoint():
+    end = datetime.datetime(2023, 3, 1, 6, 0, tzinfo=datetime.timezone.utc)
+    cloudwatch = FakeCloudWatch([
+        {"Timestamp": end - datetime.timedelta(minutes=1), "Maximum": 30000.0},
+        {"Timestamp": end - datetime.timedelta(minutes=3), "Maximum": 900000.0}
+    ])
+
+    assert seconds_behind_latest(cloudwatch, "stream", end) == 30
+    assert seconds_behind_latest(FakeCloudWatch([]), "stream", end) is None
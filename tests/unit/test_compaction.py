@@ -0,0 +1,111 @@
+import io
+import json
+
+import pytest
+
+from compaction import ManifestError
+from compaction import read_manifest
+from compaction import swap_in
+from compaction import write_manifest
+
+BUCKET = "output-bucket"
+PARTITION = "event_date=2023-03-01/event_hour=06/"
+MANIFEST_KEY = "_compaction/" + PARTITION + "_manifest.json"
+SOURCES = [PARTITION + "part-0000{}.snappy.parquet".format(i) for i in range(3)]
+COMPACTED = {
+    "_compaction/{}run/part-0000{}.snappy.parquet".format(PARTITION, i):
+        "{}compacted-run-part-0000{}.snappy.parquet".format(PARTITION, i) for i in range(2)
+}
+MANIFEST = {"run_id": "run", "sources": SOURCES, "compacted": COMPACTED}
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    """The S3 operations of the compaction on a dict of keys and bodies of a single bucket."""
+
+    exceptions = type("Exceptions", (), {"NoSuchKey": NoSuchKey})
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+        self.copies = []
+
+    def get_paginator(self, operation):
+        assert operation == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        yield {"Contents": [{"Key": key, "Size": len(body)} for key, body in sorted(self.objects.items())
+                            if key.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def copy_object(self, Bucket, Key, CopySource):
+        if CopySource["Key"] not in self.objects:
+            raise NoSuchKey(CopySource["Key"])
+        self.objects[Key] = self.objects[CopySource["Key"]]
+        self.copies.append(Key)
+
+    def delete_objects(self, Bucket, Delete):
+        # Like S3, keys which do not exist are deleted without an error
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+        return {}
+
+
+def staged_partition(**objects):
+    s3 = FakeS3(dict({key: b"source" for key in SOURCES}, **{key: b"staged" for key in COMPACTED}, **objects))
+    write_manifest(s3, BUCKET, MANIFEST_KEY, MANIFEST)
+    return s3
+
+
+def partition_after_swap(late_records=()):
+    return dict({key: b"staged" for key in COMPACTED.values()}, **{key: b"late" for key in late_records})
+
+
+def test_swap_in_replaces_the_sources():
+    late_record = PARTITION + "part-00009.snappy.parquet"
+    s3 = staged_partition(**{late_record: b"late"})
+
+    swap_in(s3, BUCKET, PARTITION, MANIFEST_KEY, read_manifest(s3, BUCKET, MANIFEST_KEY))
+
+    assert s3.objects == partition_after_swap([late_record])
+    assert read_manifest(s3, BUCKET, MANIFEST_KEY) is None
+
+
+@pytest.mark.parametrize("copied, deleted", [
+    # Failed during the copies
+    (1, []),
+    # Failed while deleting the sources
+    (2, SOURCES[:2]),
+    # Failed after deleting the staged files, before deleting the manifest
+    (2, SOURCES + list(COMPACTED))
+])
+def test_swap_in_resumes_from_the_manifest(copied, deleted):
+    s3 = staged_partition(**{compacted: b"staged" for compacted in list(COMPACTED.values())[:copied]})
+    for key in deleted:
+        del s3.objects[key]
+
+    swap_in(s3, BUCKET, PARTITION, MANIFEST_KEY, read_manifest(s3, BUCKET, MANIFEST_KEY))
+
+    assert s3.objects == partition_after_swap()
+    assert s3.copies == [compacted for staged, compacted in COMPACTED.items() if staged not in deleted]
+
+
+def test_swap_in_fails_without_the_staged_and_the_compacted_file():
+    s3 = staged_partition()
+    del s3.objects[list(COMPACTED)[0]]
+
+    with pytest.raises(ManifestError):
+        swap_in(s3, BUCKET, PARTITION, MANIFEST_KEY, json.loads(s3.objects[MANIFEST_KEY]))
+
+    # The sources are kept, since the swap is incomplete
+    assert all(key in s3.objects for key in SOURCES)
@@ -0,0 +1,118 @@
+import pytest
+
+from compression import Compression
+from compression import CompressionConfigError
+from compression import FieldCompression
+from compression import compress_rows
+from compression import load_compression
+from field_paths import load_selected_fields
+
+SELECTED_FIELDS = {"selected-fields": [
+    {"che_id": {"path": "che[*].id", "type": "int"}},
+    {"msg_timestamp": {"path": "msg.timestamp", "type": "timestamp"}},
+    {"height": {"path": "che[*].hoist[0].hoisting.height[0].value", "type": "double"}},
+    {"status": {"path": "che[*].spreader[0].locked.status[0].value", "type": "string"}}
+]}
+
+
+def compression(*fields, heartbeat_seconds=300):
+    return Compression("che_id", "msg_timestamp", heartbeat_seconds, fields)
+
+
+DEADBAND = compression(FieldCompression("height", "deadband", 0.5))
+SWINGING_DOOR = compression(FieldCompression("height", "swinging-door", 0.1))
+
+
+def compressed(compression_config, values, times=None, state=None, held=None):
+    """The heights of the written rows, with a row per second by default."""
+    rows = [{"che_id": 1, "height": value} for value in values]
+    times = times if times is not None else list(range(len(values)))
+    written, state, held = compress_rows(rows, times, state, held, compression_config)
+    return [row["height"] for row in written], state, held
+
+
+def test_load_compression():
+    config = dict(SELECTED_FIELDS, compression={"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60})
+    config["selected-fields"][2]["height"]["compression"] = {"method": "swinging-door", "tolerance": 0.05}
+
+    assert load_compression(config, load_selected_fields(config)) == Compression(
+        "che_id", "msg_timestamp", 60, (FieldCompression("height", "swinging-door", 0.05),))
+    assert load_compression(SELECTED_FIELDS, load_selected_fields(SELECTED_FIELDS)) is None
+
+
+@pytest.mark.parametrize("compression_config, field_compression", [
+    ({"key": "msg_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60}, {"method": "deadband"}),
+    ({"key": "che_id", "order-by": "height", "heartbeat-seconds": 60}, {"method": "deadband"}),
+    ({"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 0}, {"method": "deadband"}),
+    ({"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60}, {"method": "linear"}),
+    ({"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60}, {"method": "swinging-door"}),
+    ({"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60}, {"method": "deadband", "tolerance": -1})
+])
+def test_load_compression_rejects_invalid_configs(compression_config, field_compression):
+    config = {"compression": compression_config, "selected-fields": [
+        {"che_id": {"path": "che[*].id", "type": "int"}},
+        {"msg_timestamp": {"path": "msg.timestamp", "type": "timestamp"}},
+        {"height": {"path": "che[*].hoist[0].hoisting.height[0].value", "type": "double",
+                    "compression": field_compression}}
+    ]}
+
+    with pytest.raises(CompressionConfigError):
+        load_compression(config, load_selected_fields(config))
+
+
+def test_string_fields_only_support_a_deadband_of_zero():
+    config = {"compression": {"key": "che_id", "order-by": "msg_timestamp", "heartbeat-seconds": 60},
+              "selected-fields": SELECTED_FIELDS["selected-fields"][:3] + [
+                  {"status": {"path": "che[*].spreader[0].locked.status[0].value", "type": "string",
+                              "compression": {"method": "deadband", "tolerance": 1}}}]}
+
+    with pytest.raises(CompressionConfigError):
+        load_compression(config, load_selected_fields(config))
+
+
+def test_deadband_writes_changes_beyond_the_tolerance():
+    written, state, _ = compressed(DEADBAND, [10.0, 10.2, 10.4, 10.6, 10.0, 9.6])
+
+    assert written == [10.0, 10.6, 10.0]
+    assert state["values"] == {"height": 10.0}
+
+
+def test_changes_from_and_to_null_are_written():
+    assert compressed(DEADBAND, [10.0, None, None, 10.0])[0] == [10.0, None, 10.0]
+
+
+def test_heartbeat_writes_unchanged_rows():
+    written, _, _ = compressed(compression(FieldCompression("height", "deadband", 0.5), heartbeat_seconds=2),
+                               [10.0] * 6)
+
+    assert written == [10.0, 10.0, 10.0]
+
+
+def test_rows_without_time_are_written():
+    assert compressed(DEADBAND, [10.0, 10.0, 10.0], times=[0, None, 2])[0] == [10.0, 10.0, 10.0]
+
+
+def test_swinging_door_holds_rows_on_a_line():
+    written, state, held = compressed(SWINGING_DOOR, [0.0, 1.0, 2.0, 3.0, 4.0])
+
+    assert written == [0.0]
+    assert held["height"] == 4.0
+    assert state["held_time"] == 4
+
+
+def test_swinging_door_writes_the_last_row_on_the_line():
+    # The line bends at the third row, so it is written and the doors open again from it
+    written, _, held = compressed(SWINGING_DOOR, [0.0, 1.0, 2.0, 2.0, 2.0])
+
+    assert written == [0.0, 2.0]
+    assert held["height"] == 2.0
+
+
+def test_compression_continues_with_the_state_of_the_previous_rows():
+    _, state, held = compressed(SWINGING_DOOR, [0.0, 1.0, 2.0])
+    # The jump closes the doors, so the held row is written and the doors open again from it
+    written, state, held = compressed(SWINGING_DOOR, [5.0], times=[3], state=state, held=held)
+
+    assert written == [2.0]
+    assert held["height"] == 5.0
+    assert state["time"] == 2
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from current_state import CurrentState  # noqa: E402
+from current_state import CurrentStateConfigError  # noqa: E402
+from current_state import latest_rows  # noqa: E402
+from current_state import load_current_state  # noqa: E402
+from field_paths import load_selected_fields  # noqa: E402
+
+SELECTED_FIELDS = load_selected_fields({"selected-fields": [
+    {"che_id": {"path": "che[*].id", "type": "int"}},
+    {"msg_timestamp": {"path": "msg.timestamp", "type": "timestamp"}},
+    {"height": {"path": "che[*].hoist[0].hoisting.height[0].value", "type": "double"}},
+    {"che_name": "che[*].name"}
+]})
+
+STATE = load_current_state("database", "table", "s3://bucket/current_state/", "che_id", "msg_timestamp",
+                           SELECTED_FIELDS)
+
+
+def at(minute):
+    return datetime.datetime(2023, 3, 1, 6, minute)
+
+
+def test_load_current_state():
+    assert STATE == CurrentState(
+        table="`database`.`table`",
+        location="s3://bucket/current_state/",
+        key="che_id",
+        order_by="msg_timestamp",
+        columns=[("che_id", "bigint"), ("msg_timestamp", "timestamp"), ("height", "double"), ("che_name", "string")]
+    )
+
+
+@pytest.mark.parametrize("key, order_by", [("che_type", "msg_timestamp"), ("che_id", "msg_time")])
+def test_load_current_state_rejects_columns_outside_the_selected_fields(key, order_by):
+    with pytest.raises(CurrentStateConfigError):
+        load_current_state("database", "table", "s3://bucket/current_state/", key, order_by, SELECTED_FIELDS)
+
+
+def rows(spark, *values):
+    # The batch has the partition columns of the projection as well, which the table does not have
+    return spark.createDataFrame(
+        [value + ("2023-03-01", "06") for value in values],
+        "che_id long, msg_timestamp timestamp, height double, che_name string, event_date string, event_hour string"
+    )
+
+
+def test_latest_rows_keep_the_latest_row_per_key(spark):
+    latest = latest_rows(rows(
+        spark,
+        (1, at(0), 1.0, "STS 1"),
+        (1, at(2), 2.0, "STS 1"),
+        (1, at(1), 3.0, "STS 1"),
+        (2, at(0), 4.0, "STS 2"),
+        (None, at(5), 5.0, "unknown")
+    ), STATE)
+
+    assert latest.columns == ["che_id", "msg_timestamp", "height", "che_name"]
+    assert sorted(tuple(row) for row in latest.collect()) == [(1, at(2), 2.0, "STS 1"), (2, at(0), 4.0, "STS 2")]
+
+
+def test_latest_rows_order_nulls_last(spark):
+    latest = latest_rows(rows(
+        spark,
+        (1, None, 1.0, "STS 1"),
+        (1, at(0), 2.0, "STS 1"),
+        (2, None, 3.0, "STS 2")
+    ), STATE)
+
+    # A row without an order value only wins if its key has no other row
+    assert sorted((row["che_id"], row["height"]) for row in latest.collect()) == [(1, 2.0), (2, 3.0)]
+
+
+def test_latest_rows_keep_one_of_tied_rows(spark):
+    latest = latest_rows(rows(spark, (1, at(0), 1.0, "STS 1"), (1, at(0), 2.0, "STS 1")), STATE).collect()
+
+    assert len(latest) == 1
+    assert latest[0]["height"] in (1.0, 2.0)
@@ -0,0 +1,164 @@
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from field_paths import EACH
+from field_paths import FieldPathError
+from field_paths import format_field_path
+from field_paths import load_selected_fields
+from field_paths import output_columns
+from field_paths import parse_field_path
+from field_paths import plan_explodes
+from field_paths import validate_field_paths
+from field_paths import validate_output_columns
+
+CONFIG = Path(__file__).parent.parent.parent.joinpath("pipeline_stack", "config")
+KPI_SAMPLE = CONFIG.joinpath("kpis", "kpi_sample.json")
+INPUT_SCHEMA = CONFIG.joinpath("schemas", "input_schema.json")
+
+SCHEMA = {"type": "struct", "fields": [
+    {"name": "msg", "type": {"type": "struct", "fields": [{"name": "id", "type": "string"}]}},
+    {"name": "che", "type": {"type": "array", "elementType": {"type": "struct", "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "gross", "type": {"type": "array", "elementType": "double"}}
+    ]}}}
+]}
+
+COLUMNS = [{"name": "msg_id", "type": "string"}, {"name": "che_id", "type": "bigint"}]
+
+
+@pytest.mark.parametrize("path, steps", [
+    ("msg.id", ("msg", "id")),
+    ("che[0].id", ("che", 0, "id")),
+    ("che[*].hoist[0].weight.gross[12].value", ("che", EACH, "hoist", 0, "weight", "gross", 12, "value")),
+    ("matrix[1][*]", ("matrix", 1, EACH)),
+    ("_private.x9", ("_private", "x9"))
+])
+def test_parse_field_path(path, steps):
+    assert parse_field_path(path) == steps
+
+
+@pytest.mark.parametrize("path", ["", None, "msg..id", "che[].id", "che[-1].id", "che[x].id", "9lives", "msg.id;"])
+def test_parse_field_path_rejects_invalid_paths(path):
+    with pytest.raises(FieldPathError):
+        parse_field_path(path)
+
+
+def test_load_selected_fields():
+    selected_fields = load_selected_fields({"selected-fields": [
+        {"msg_id": "msg.id"},
+        {
+            "che_id": {"path": "che[*].id", "type": "int"},
+            "msg_timestamp": {"path": "msg.timestamp", "type": "timestamp"}
+        }
+    ]})
+
+    assert selected_fields == [
+        ("msg_id", ("msg", "id"), "string"),
+        ("che_id", ("che", EACH, "id"), "int"),
+        ("msg_timestamp", ("msg", "timestamp"), "timestamp")
+    ]
+
+
+def test_output_columns():
+    assert output_columns(load_selected_fields({"selected-fields": [
+        {"msg_id": "msg.id"},
+        {"che_id": {"path": "che[*].id", "type": "int"}},
+        {"msg_timestamp": {"path": "msg.timestamp", "type": "timestamp"}}
+    ]})) == [
+        {"name": "msg_id", "type": "string"},
+        {"name": "che_id", "type": "bigint"},
+        {"name": "msg_timestamp", "type": "timestamp"}
+    ]
+
+
+def test_load_selected_fields_of_the_kpi_sample():
+    selected_fields = load_selected_fields(json.loads(KPI_SAMPLE.read_text()))
+
+    assert len({column_name for column_name, _, _ in selected_fields}) == len(selected_fields)
+
+
+@pytest.mark.parametrize("path", ["msg.id", "che[*].hoist[0].weight.gross[12].value", "matrix[1][*]"])
+def test_format_field_path(path):
+    assert format_field_path(parse_field_path(path)) == path
+
+
+@pytest.mark.parametrize("config", [
+    None,
+    {},
+    {"selected-fields": []},
+    {"selected-fields": ["msg.id"]},
+    {"selected-fields": [{"Msg_Id": "msg.id"}]},
+    {"selected-fields": [{"msg_id": "msg.id"}, {"msg_id": "msg.mid"}]},
+    {"selected-fields": [{"msg_id": {"path": "msg.id", "type": "long"}}]},
+    {"selected-fields": [{"msg_id": {"type": "string"}}]}
+])
+def test_load_selected_fields_rejects_invalid_configs(config):
+    with pytest.raises(FieldPathError):
+        load_selected_fields(config)
+
+
+def test_plan_explodes_shares_the_prefixes():
+    explodes, fields = plan_explodes(load_selected_fields({"selected-fields": [
+        {"msg_id": "msg.id"},
+        {"che_id": "che[*].id"},
+        {"hoist_id": "che[*].hoist[*].id"},
+        {"trolley_id": "che[*].trolley[*].id"},
+        {"hoist_weight": "che[*].hoist[*].weight[0]"}
+    ]}))
+
+    che, hoist, trolley = ("che", EACH), ("che", EACH, "hoist", EACH), ("che", EACH, "trolley", EACH)
+    assert explodes == [
+        (che, None, ("che",)),
+        (hoist, che, ("hoist",)),
+        (trolley, che, ("trolley",))
+    ]
+    assert fields == [
+        ("msg_id", None, ("msg", "id"), "string"),
+        ("che_id", che, ("id",), "string"),
+        ("hoist_id", hoist, ("id",), "string"),
+        ("trolley_id", trolley, ("id",), "string"),
+        ("hoist_weight", hoist, ("weight", 0), "string")
+    ]
+
+
+def test_validate_field_paths():
+    validate_field_paths(load_selected_fields({"selected-fields": [
+        {"msg_id": "msg.id"},
+        {"che_id": "che[*].id"},
+        {"gross": "che[0].gross[*]"}
+    ]}), SCHEMA)
+
+
+def test_validate_field_paths_of_the_kpi_sample():
+    validate_field_paths(load_selected_fields(json.loads(KPI_SAMPLE.read_text())), json.loads(INPUT_SCHEMA.read_text()))
+
+
+@pytest.mark.parametrize("path, missing", [
+    ("msg.mid", "msg.mid"),
+    ("msg[0].id", "msg[0]"),
+    ("che.id", "che.id"),
+    ("che[*].gross[0].value", "che[*].gross[0].value"),
+    ("che[*].id[*]", "che[*].id[*]")
+])
+def test_validate_field_paths_rejects_paths_missing_from_the_schema(path, missing):
+    with pytest.raises(FieldPathError, match=r"after '{}'".format(re.escape(missing))):
+        validate_field_paths(load_selected_fields({"selected-fields": [{"field": path}]}), SCHEMA)
+
+
+def test_validate_output_columns_allows_fewer_columns():
+    validate_output_columns(load_selected_fields({"selected-fields": [
+        {"che_id": {"path": "che[0].id", "type": "int"}}
+    ]}), COLUMNS)
+
+
+@pytest.mark.parametrize("field, message", [
+    ({"che_weight": {"path": "che[0].weight", "type": "double"}}, "adding a column takes a deployment"),
+    ({"che_id": {"path": "che[0].id", "type": "double"}}, "has type bigint in the output table, not double"),
+    ({"che_id": "che[0].id"}, "has type bigint in the output table, not string")
+])
+def test_validate_output_columns_rejects_new_columns_and_types(field, message):
+    with pytest.raises(FieldPathError, match=message):
+        validate_output_columns(load_selected_fields({"selected-fields": [field]}), COLUMNS)
@@ -0,0 +1,134 @@
+import base64
+import datetime
+import json
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+lambda_consumer = pytest.importorskip("lambda_consumer")
+
+from field_paths import load_selected_fields  # noqa: E402
+
+SCHEMA = lambda_consumer.to_arrow_schema({
+    "type": "struct",
+    "fields": [
+        {"name": "msg", "type": {"type": "struct", "fields": [
+            {"name": "id", "type": "string"},
+            {"name": "timestamp", "type": "string"},
+            {"name": "mid", "type": "string"},
+            {"name": "weight", "type": "string"}
+        ]}}
+    ]
+})
+
+SELECTED_FIELDS = load_selected_fields({"selected-fields": [
+    {"msg_id": {"path": "msg.id", "type": "string"}},
+    {"mid": {"path": "msg.mid", "type": "int"}},
+    {"weight": {"path": "msg.weight", "type": "double"}}
+]})
+
+
+def message(msg_id, **fields):
+    return json.dumps({"msg": dict({"id": msg_id, "timestamp": "2023-02-25T10:00:00"}, **fields)}).encode()
+
+
+def test_parse_records_keeps_multi_line_messages():
+    payloads = [message("1"), json.dumps({"msg": {"id": "2"}}, indent=2).encode()]
+
+    table, dead_letters = lambda_consumer.parse_records(payloads, SCHEMA)
+
+    assert table.column("msg").to_pylist()[1]["id"] == "2"
+    assert table.num_rows == 2
+    assert dead_letters == []
+
+
+def test_parse_records_routes_invalid_messages_to_the_dead_letters():
+    payloads = [message("1"), b'{"msg": ', message("2"), b'{"msg": {"id": {"nested": 1}}}', message("3")]
+
+    table, dead_letters = lambda_consumer.parse_records(payloads, SCHEMA)
+
+    assert [row["id"] for row in table.column("msg").to_pylist()] == ["1", "2", "3"]
+    assert [payload for _, payload in dead_letters] == ['{"msg": ', '{"msg": {"id": {"nested": 1}}}']
+    assert {reason for reason, _ in dead_letters} == {lambda_consumer.MALFORMED_MESSAGE}
+
+
+def test_parse_records_of_dead_letters_only():
+    table, dead_letters = lambda_consumer.parse_records([b"not json"], SCHEMA)
+
+    assert table is None
+    assert len(dead_letters) == 1
+
+
+def test_uncastable_values_become_nulls():
+    payloads = [message("1", mid=" 42 ", weight="1.5e3"), message("2", mid="4.7", weight="heavy"),
+                message("3", mid="many", weight=" 2 ")]
+
+    table, dead_letters = lambda_consumer.process_records(payloads, SELECTED_FIELDS, SCHEMA)
+
+    assert table.column("mid").to_pylist() == [42, 4, None]
+    assert table.column("weight").to_pylist() == [1500.0, None, 2.0]
+    assert dead_letters == []
+
+
+def test_messages_missing_a_required_field_are_dead_letters():
+    required_fields = lambda_consumer.compile_required_fields(["msg.id", "msg.timestamp"])
+    no_timestamp = json.dumps({"msg": {"id": "2"}}).encode()
+    no_fields = json.dumps({"msg": {}}).encode()
+    payloads = [message("1"), no_timestamp, no_fields, message("4")]
+
+    table, dead_letters = lambda_consumer.process_records(payloads, SELECTED_FIELDS, SCHEMA, required_fields)
+
+    assert table.column("msg_id").to_pylist() == ["1", "4"]
+    # The reason is the first missing field, like in the Glue ETL Job
+    assert dead_letters == [("Missing required field msg.timestamp", no_timestamp.decode()),
+                            ("Missing required field msg.id", no_fields.decode())]
+
+
+def test_messages_which_all_miss_a_required_field():
+    required_fields = lambda_consumer.compile_required_fields(["msg.mid"])
+
+    table, dead_letters = lambda_consumer.process_records([message("1")], SELECTED_FIELDS, SCHEMA, required_fields)
+
+    assert table is None
+    assert dead_letters == [("Missing required field msg.mid", message("1").decode())]
+
+
+def test_required_fields_must_address_a_single_field():
+    with pytest.raises(ValueError, match="single field"):
+        lambda_consumer.compile_required_fields(["che[*].id"])
+
+
+def test_timestamps_with_a_zone_offset_are_converted_to_utc():
+    selected_fields = load_selected_fields({"selected-fields": [
+        {"msg_id": {"path": "msg.id", "type": "string"}},
+        {"ts": {"path": "msg.timestamp", "type": "timestamp"}}
+    ]})
+    payloads = [message("1", timestamp="2023-03-01T00:30:00+01:00"), message("2", timestamp="2023-03-01T06:00:00Z"),
+                message("3", timestamp="2023-03-01T06:00:00.250-0530"), message("4", timestamp="2023-03-01 06:00:00"),
+                message("5", timestamp="2023-03-01T06:00:00+19:00")]
+    now = datetime.datetime(2023, 3, 2, 12, 0)
+
+    table, _ = lambda_consumer.parse_records(payloads, SCHEMA)
+    table = lambda_consumer.select_fields(table, selected_fields, now)
+
+    assert table.column("ts").to_pylist() == [
+        datetime.datetime(2023, 2, 28, 23, 30), datetime.datetime(2023, 3, 1, 6, 0),
+        datetime.datetime(2023, 3, 1, 11, 30, 0, 250000), datetime.datetime(2023, 3, 1, 6, 0), None]
+    # Partitioned by the UTC hour, timestamps Spark cannot parse fall back to the processing time
+    assert table.column("event_date").to_pylist() == ["2023-02-28", "2023-03-01", "2023-03-01", "2023-03-01",
+                                                      "2023-03-02"]
+    assert table.column("event_hour").to_pylist() == ["23", "06", "11", "06", "12"]
+
+
+def test_decode_event_routes_undecodable_records_to_the_dead_letters():
+    corrupt = base64.b64encode(b"\x1f\x8b\x08corrupt").decode()
+    event = {"Records": [
+        {"kinesis": {"data": base64.b64encode(message("1")).decode()}},
+        {"kinesis": {"data": corrupt}}
+    ]}
+
+    messages, dead_letters = lambda_consumer.decode_event(event)
+
+    assert messages == [message("1")]
+    assert [payload for _, payload in dead_letters] == [corrupt]
+    assert dead_letters[0][0].startswith("Undecodable record")
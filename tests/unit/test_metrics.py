@@ -0,0 +1,92 @@
+import json
+import sys
+import types
+
+import pytest
+
+from metrics import CloudWatchMetrics
+from metrics import LogMetrics
+from metrics import MemoryMetrics
+from metrics import MetricsSink
+from metrics import create_sink
+
+BATCH = {"BatchRecordsIn": (100, "Count"), "BatchWallTime": (1500.0, "Milliseconds")}
+
+
+class FakeCloudWatch:
+
+    def __init__(self):
+        self.requests = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.requests.append((Namespace, MetricData))
+
+
+@pytest.fixture
+def cloudwatch(monkeypatch):
+    client = FakeCloudWatch()
+    monkeypatch.setitem(sys.modules, "boto3", types.SimpleNamespace(client=lambda service: client))
+    return client
+
+
+def test_memory_sink_keeps_the_values_of_every_put():
+    sink = MemoryMetrics()
+    sink.put(BATCH)
+    sink.put({"DeadLetterRows": (2, "Count")})
+
+    assert sink.puts == [{"BatchRecordsIn": 100, "BatchWallTime": 1500.0}, {"DeadLetterRows": 2}]
+
+
+def test_log_sink_prints_json_lines(capsys):
+    LogMetrics().put(BATCH)
+
+    assert json.loads(capsys.readouterr().out) == {"metrics": {"BatchRecordsIn": 100, "BatchWallTime": 1500.0}}
+
+
+def test_cloudwatch_sink_buffers_until_flushed(cloudwatch):
+    sink = CloudWatchMetrics("Pipeline", {"JobName": "job"}, flush_interval=3600)
+    sink.put(BATCH)
+    sink.put(BATCH)
+
+    assert cloudwatch.requests == []
+
+    sink.flush()
+
+    assert len(cloudwatch.requests) == 1
+    namespace, metric_data = cloudwatch.requests[0]
+    assert namespace == "Pipeline"
+    assert [metric["MetricName"] for metric in metric_data] == ["BatchRecordsIn", "BatchWallTime"] * 2
+    assert metric_data[0]["Dimensions"] == [{"Name": "JobName", "Value": "job"}]
+    assert (metric_data[0]["Value"], metric_data[0]["Unit"]) == (100, "Count")
+
+    sink.flush()
+
+    assert len(cloudwatch.requests) == 1
+
+
+def test_cloudwatch_sink_flushes_after_the_interval(cloudwatch):
+    sink = CloudWatchMetrics("Pipeline", {"JobName": "job"}, flush_interval=0)
+    sink.put(BATCH)
+
+    assert len(cloudwatch.requests) == 1
+
+
+def test_cloudwatch_sink_splits_requests(cloudwatch):
+    sink = CloudWatchMetrics("Pipeline", {"JobName": "job"}, flush_interval=3600)
+    sink.put({"Metric{}".format(i): (i, "Count") for i in range(500)})
+
+    assert cloudwatch.requests == []
+
+    # A full request is put right away, with the rest of the buffer
+    sink.put({"Metric{}".format(i): (i, "Count") for i in range(700)})
+
+    assert [len(metric_data) for _, metric_data in cloudwatch.requests] == [1000, 200]
+
+
+def test_create_sink(cloudwatch):
+    assert isinstance(create_sink("cloudwatch", "Pipeline", {"JobName": "job"}), CloudWatchMetrics)
+    assert isinstance(create_sink("log", "Pipeline", {}), LogMetrics)
+    assert isinstance(create_sink("memory", "Pipeline", {}), MemoryMetrics)
+    assert type(create_sink("none", "Pipeline", {})) is MetricsSink
+    with pytest.raises(ValueError):
+        create_sink("statsd", "Pipeline", {})
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from record_codec import RecordCodecError
+from record_codec import aggregate
+from record_codec import deaggregate
+from record_codec import decode_record
+from record_codec import pack_records
+
+MESSAGES = [json.dumps({"msg": {"id": str(i), "mid": i}}, separators=(",", ":")).encode() for i in range(1200)]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+@pytest.mark.parametrize("aggregated", [False, True])
+def test_pack_records_round_trip(compression, aggregated):
+    records = list(pack_records(MESSAGES, compression=compression, aggregated=aggregated))
+
+    assert [message for record in records for message in decode_record(record)] == MESSAGES
+
+
+def test_pack_records_splits_records_at_the_record_size():
+    records = list(pack_records(MESSAGES, compression="none", aggregated=True, max_record_bytes=4096))
+
+    assert len(records) > 1
+    assert all(len(record) <= 4096 for record in records)
+    assert [message for record in records for message in decode_record(record)] == MESSAGES
+
+
+def test_pack_records_keeps_multi_line_messages_whole():
+    messages = [b'{\n"a":1}', json.dumps({"b": "line\nbreak"}, indent=2).encode(), b'{"c":"\xc3\xa4"}']
+
+    records = list(pack_records(messages, compression="gzip"))
+    decoded = [message for record in records for message in decode_record(record)]
+
+    assert [json.loads(message) for message in decoded] == [{"a": 1}, {"b": "line\nbreak"}, {"c": "ä"}]
+
+
+def test_pack_records_rejects_multi_line_messages_which_are_not_json():
+    with pytest.raises(RecordCodecError):
+        list(pack_records([b"not\njson"], compression="gzip"))
+
+
+def test_plain_message_is_decoded_as_is():
+    assert decode_record(bytearray(b'{"a":1}')) == [b'{"a":1}']
+
+
+def test_aggregate_round_trip():
+    assert deaggregate(aggregate([b"one", b"two"])) == [b"one", b"two"]
+
+
+def test_corrupt_aggregate_is_rejected():
+    record = bytearray(aggregate([b"one", b"two"]))
+    record[-1] ^= 0xff
+
+    with pytest.raises(RecordCodecError):
+        decode_record(record)
+
+
+def test_corrupt_gzip_is_rejected():
+    with pytest.raises(RecordCodecError):
+        decode_record(b"\x1f\x8bnot gzip")
@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from routes import RouteConfigError  # noqa: E402
+from routes import load_routes  # noqa: E402
+from routes import route_condition  # noqa: E402
+
+ROUTES_SAMPLE = Path(__file__).parent.parent.parent.joinpath("pipeline_stack", "config", "kpis", "routes_sample.json")
+
+SELECTED_FIELDS = [{"che_id": {"path": "che[*].id", "type": "int"}}, {"che_type": "che[*].type"}]
+
+
+def route(name="sts", where=None, selected_fields=None):
+    return {
+        "name": name,
+        "where": {"che_type": "STS"} if where is None else where,
+        "selected-fields": SELECTED_FIELDS if selected_fields is None else selected_fields
+    }
+
+
+def test_load_routes(spark):
+    routes = load_routes({"routes": [route(), route("cranes", where={"che_type": ["STS", "RTG"], "che_id": 1})]})
+
+    assert [(r.name, r.where) for r in routes] == [
+        ("sts", {"che_type": ["STS"]}),
+        ("cranes", {"che_type": ["STS", "RTG"], "che_id": [1]})
+    ]
+    assert len(routes[0].projection.columns) == len(SELECTED_FIELDS) + 2
+
+
+def test_load_routes_of_the_routes_sample(spark):
+    routes = load_routes(json.loads(ROUTES_SAMPLE.read_text()))
+
+    assert len({r.name for r in routes}) == len(routes) > 0
+
+
+@pytest.mark.parametrize("config", [None, {}, {"routes": []}])
+def test_load_routes_of_an_empty_config(spark, config):
+    assert load_routes(config) == []
+
+
+@pytest.mark.parametrize("config", [
+    {"routes": ["sts"]},
+    {"routes": [route(name=None)]},
+    {"routes": [route(name="STS")]},
+    {"routes": [route(name="sts-cranes")]},
+    {"routes": [route(), route()]},
+    {"routes": [route(where={"che_name": "STS 1"})]},
+    {"routes": [route(where={})]}
+])
+def test_load_routes_rejects_invalid_configs(spark, config):
+    with pytest.raises(RouteConfigError):
+        load_routes(config)
+
+
+def test_load_routes_rejects_invalid_selected_fields(spark):
+    with pytest.raises(ValueError):
+        load_routes({"routes": [route(selected_fields=[{"che_type": "che[x].type"}])]})
+
+
+def test_route_condition(spark):
+    rows = spark.createDataFrame([(1, "STS"), (2, "RTG"), (3, "STS"), (None, "STS")], "che_id long, che_type string")
+    [cranes] = load_routes({"routes": [route("cranes", where={"che_type": "STS", "che_id": [1, 2]})]})
+
+    assert [row["che_id"] for row in rows.where(route_condition(cranes)).collect()] == [1]
@@ -0,0 +1,118 @@
+import pytest
+
+from shard_scaler import MetricSample
+from shard_scaler import SHARD_BYTES_PER_MINUTE
+from shard_scaler import SHARD_RECORDS_PER_MINUTE
+from shard_scaler import ScalingPolicy
+from shard_scaler import decide
+from shard_scaler import load_policy
+from shard_scaler import validate_policy
+
+POLICY = ScalingPolicy(
+    min_shards=1,
+    max_shards=16,
+    scale_out_utilization=0.8,
+    scale_in_utilization=0.3,
+    target_utilization=0.6,
+    scale_out_periods=3,
+    scale_in_periods=30,
+    scale_out_cooldown=5,
+    scale_in_cooldown=60
+)
+
+
+def sample(shards_of_bytes, throttled_records=0):
+    """A minute of writes using the byte limit of the given number of shards."""
+    return MetricSample(shards_of_bytes * SHARD_BYTES_PER_MINUTE, 1000, throttled_records)
+
+
+def test_hot_shards_scale_out_to_the_target_utilization():
+    decision = decide([sample(3.6)] * 3, 4, POLICY)
+
+    assert decision.shard_count == 6
+    assert decision.reason == "utilization above 80% for 3 minutes"
+
+
+def test_the_records_limit_counts_as_demand():
+    samples = [MetricSample(0, 3.6 * SHARD_RECORDS_PER_MINUTE, 0)] * 3
+
+    assert decide(samples, 4, POLICY).shard_count == 6
+
+
+def test_a_single_hot_minute_does_not_scale_out():
+    assert decide([sample(1), sample(1), sample(3.6)], 4, POLICY).shard_count == 4
+
+
+def test_throttled_writes_double_the_shards():
+    decision = decide([sample(1, throttled_records=10)] * 3, 4, POLICY)
+
+    assert decision.shard_count == 8
+    assert decision.reason == "writes throttled for 3 minutes"
+
+
+def test_a_scaling_doubles_at_most():
+    assert decide([sample(20)] * 3, 4, POLICY).shard_count == 8
+
+
+def test_scaling_out_waits_for_the_cooldown():
+    assert decide([sample(3.6)] * 3, 4, POLICY, minutes_since_scaling=2).shard_count == 4
+    assert decide([sample(3.6)] * 3, 4, POLICY, minutes_since_scaling=5).shard_count == 6
+
+
+def test_cold_shards_scale_in_after_the_scale_in_periods():
+    decision = decide([sample(1)] * 30, 8, POLICY)
+
+    assert decision.shard_count == 4
+    assert decision.reason == "utilization below 30% for 30 minutes"
+    assert decide([sample(1)] * 29, 8, POLICY).shard_count == 8
+
+
+def test_scaling_in_halves_at_most():
+    assert decide([sample(0.1)] * 30, 8, POLICY).shard_count == 4
+
+
+def test_throttled_writes_prevent_scaling_in():
+    samples = [sample(1)] * 29 + [sample(1, throttled_records=1)]
+
+    assert decide(samples, 8, POLICY).shard_count == 8
+
+
+def test_scaling_in_waits_for_the_cooldown():
+    assert decide([sample(1)] * 30, 8, POLICY, minutes_since_scaling=30).shard_count == 8
+
+
+def test_shard_counts_outside_the_bounds_are_corrected():
+    assert decide([], 20, POLICY).shard_count == 16
+    assert decide([], 40, POLICY).shard_count == 20
+    assert decide([], 1, POLICY._replace(min_shards=4)).shard_count == 2
+
+
+def test_utilization_within_the_thresholds_keeps_the_shards():
+    decision = decide([sample(2)] * 30, 4, POLICY)
+
+    assert decision.shard_count == 4
+    assert decision.reason == "within thresholds"
+
+
+def test_load_policy_defaults():
+    policy = load_policy({
+        "MIN_SHARDS": "1",
+        "MAX_SHARDS": "16",
+        "SCALE_OUT_UTILIZATION": "0.8",
+        "SCALE_IN_UTILIZATION": "0.3",
+        "TARGET_UTILIZATION": "0.6"
+    })
+
+    assert policy == POLICY
+
+
+@pytest.mark.parametrize("changes", [
+    {"min_shards": 0},
+    {"min_shards": 20},
+    {"scale_in_utilization": 0.7},
+    {"scale_out_utilization": 1.5},
+    {"scale_out_periods": 0}
+])
+def test_validate_policy_rejects_invalid_policies(changes):
+    with pytest.raises(ValueError):
+        validate_policy(POLICY._replace(**changes))
@@ -0,0 +1,233 @@
+import datetime
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from pyspark.sql.functions import col  # noqa: E402
+from pyspark.sql.types import StructType  # noqa: E402
+
+from field_paths import load_selected_fields  # noqa: E402
+from record_codec import pack_records  # noqa: E402
+from transforms import compile_dead_letters  # noqa: E402
+from transforms import compile_projection  # noqa: E402
+from transforms import decode_records  # noqa: E402
+from transforms import decoded_messages  # noqa: E402
+from transforms import deduplicate  # noqa: E402
+from transforms import route_dead_letters  # noqa: E402
+from transforms import select_fields  # noqa: E402
+from transforms import valid_records  # noqa: E402
+from transforms import write_raw_archive  # noqa: E402
+
+CONFIG = Path(__file__).parent.parent.parent.joinpath("pipeline_stack", "config")
+INPUT_SCHEMA = StructType.fromJson(json.loads(CONFIG.joinpath("schemas", "input_schema.json").read_text()))
+KPI_SAMPLE = json.loads(CONFIG.joinpath("kpis", "kpi_sample.json").read_text())
+REQUIRED_FIELDS = ["msg.id", "msg.timestamp", "che[0].id"]
+ARRIVAL_TIME = datetime.datetime(2023, 3, 1, 6, 0, 5, tzinfo=datetime.timezone.utc)
+
+
+def message(msg_id, timestamp="2023-03-01T06:00:00Z", che=({"id": 1},)):
+    msg = {"id": msg_id, "timestamp": timestamp} if timestamp is not None else {"id": msg_id}
+    return json.dumps({"msg": msg, "che": list(che)})
+
+
+KINESIS_SCHEMA = "data binary, partitionKey string, sequenceNumber string, approximateArrivalTimestamp timestamp"
+
+
+def kinesis_records(spark, *payloads, arrival_time=ARRIVAL_TIME):
+    """A batch of the Kinesis source with a record per payload, payloads are packed records or JSON messages."""
+    data = [bytearray(payload if isinstance(payload, bytes) else payload.encode()) for payload in payloads]
+    return spark.createDataFrame(
+        [(record, "key", "{:020d}".format(i), arrival_time) for i, record in enumerate(data)],
+        KINESIS_SCHEMA
+    )
+
+
+def at(hour, minute=0, second=0):
+    return datetime.datetime(2023, 3, 1, hour, minute, second, tzinfo=datetime.timezone.utc)
+
+
+def stream_batches(spark, path, batches):
+    """
+    A stream of the Kinesis source, which reads a micro-batch per batch of (payload, arrival time) tuples. The batches
+    are written as files of increasing modification times, which the file source reads in order.
+    """
+    for i, batch in enumerate(batches):
+        rows = [(bytearray(payload.encode()), "key", "{:02d}{:018d}".format(i, j), arrival_time)
+                for j, (payload, arrival_time) in enumerate(batch)]
+        batch_path = path.joinpath("batch-{}".format(i))
+        spark.createDataFrame(rows, KINESIS_SCHEMA).coalesce(1).write.parquet(str(batch_path))
+        for part in batch_path.glob("part-*"):
+            os.rename(part, path.joinpath("batch-{}.parquet".format(i)))
+            os.utime(path.joinpath("batch-{}.parquet".format(i)), (1000000000 + i, 1000000000 + i))
+    return spark.readStream.schema(KINESIS_SCHEMA).option("maxFilesPerTrigger", 1).parquet(str(path))
+
+
+def decode(spark, *payloads):
+    return decode_records(kinesis_records(spark, *payloads), INPUT_SCHEMA, "json")
+
+
+def test_dead_letter_reasons(spark, tmp_path):
+    dead_letters = compile_dead_letters(REQUIRED_FIELDS, str(tmp_path))
+    records = decode(spark, message("1"), '{"msg": ', json.dumps({"msg": {"id": "3"}, "che": {"id": 1}}),
+                     message("4", timestamp=None), message("5", che=()))
+
+    reasons = [row["reason"] for row in records.select(dead_letters.reason.alias("reason")).collect()]
+
+    assert reasons == [
+        None,
+        "Malformed JSON or schema violation",
+        "Malformed JSON or schema violation",
+        "Missing required field msg.timestamp",
+        "Missing required field che[0].id"
+    ]
+
+
+def test_route_dead_letters_writes_them_with_their_payload(spark, tmp_path):
+    dead_letters = compile_dead_letters(REQUIRED_FIELDS, str(tmp_path))
+    records = decode(spark, message("1"), '{"msg": ', message("3", timestamp=None))
+
+    valid, letter_count = route_dead_letters(records, dead_letters)
+
+    assert [row["msg"]["id"] for row in valid.collect()] == ["1"]
+    assert letter_count == 2
+    letters = spark.read.json(str(tmp_path)).orderBy("payload").collect()
+    assert [(letter["reason"], letter["payload"]) for letter in letters] == [
+        ("Malformed JSON or schema violation", '{"msg": '),
+        ("Missing required field msg.timestamp", message("3", timestamp=None))
+    ]
+    assert {letter["processing_date"] for letter in letters} == {datetime.datetime.now(datetime.timezone.utc).date()}
+
+
+def test_route_dead_letters_of_valid_records_writes_nothing(spark, tmp_path):
+    dead_letters = compile_dead_letters(REQUIRED_FIELDS, str(tmp_path.joinpath("dead-letter")))
+
+    valid, letter_count = route_dead_letters(decode(spark, message("1"), message("2")), dead_letters)
+
+    assert valid.count() == 2
+    assert letter_count == 0
+    assert not tmp_path.joinpath("dead-letter").exists()
+
+
+def test_decode_records_keeps_the_payload_and_the_record_position(spark):
+    records = decoded_messages(decode(spark, message("1"), message("2"))).collect()
+
+    assert [row["_payload"] for row in records] == [message("1"), message("2")]
+    assert [row["_record_position"] for row in records] == ["key:{:020d}:0".format(i) for i in range(2)]
+
+
+def test_deduplicate_within_the_watermark_and_late_duplicates(spark, tmp_path):
+    input_path = tmp_path.joinpath("input")
+    input_path.mkdir()
+    stream = stream_batches(spark, input_path, [
+        # A message and a copy put again by the producer
+        [(message("1", "2023-03-01T06:00:00Z"), at(6, 0, 5)), (message("1", "2023-03-01T06:00:00Z"), at(6, 0, 6))],
+        # The copy of a retry arrives within the half TTL, a new message moves the watermark to 07:00
+        [(message("1", "2023-03-01T06:00:00Z"), at(6, 20)), (message("2", "2023-03-01T08:00:00Z"), at(8))],
+        # A copy arriving more than the half TTL after its event time is clamped to 07:30:10 and written again, the
+        # same record read again is dropped, and a message which arrived before the watermark is dropped as late
+        [(message("1", "2023-03-01T06:00:00Z"), at(8, 0, 10)), (message("2", "2023-03-01T08:00:00Z"), at(8)),
+         (message("3", "2023-03-01T06:10:00Z"), at(6, 10))]
+    ])
+
+    deduplicated = deduplicate(decode_records(stream, INPUT_SCHEMA, "json"), "msg.id", "1 hour")
+    query = deduplicated.select(col("msg.id").alias("id")).writeStream \
+        .format("memory") \
+        .queryName("deduplicated") \
+        .option("checkpointLocation", str(tmp_path.joinpath("checkpoint"))) \
+        .trigger(availableNow=True) \
+        .start()
+    query.awaitTermination()
+
+    assert [progress["numInputRows"] for progress in query.recentProgress] == [2, 2, 3]
+    assert [row["id"] for row in spark.table("deduplicated").collect()] == ["1", "2", "1"]
+    assert query.lastProgress["stateOperators"][0]["numRowsDroppedByWatermark"] == 1
+
+
+def test_deduplicate_a_batch_by_key(spark):
+    records = decode(spark, message("1"), message("2"), message("1", "2023-03-01T07:00:00Z"), '{"msg": ', '{"msg": ')
+
+    deduplicated = deduplicate(decoded_messages(records), "msg.id", "1 hour")
+
+    # Rows without a key are keyed by their position in their record
+    assert sorted(row["_record_position"] for row in deduplicated.collect()) == [
+        "key:{:020d}:0".format(i) for i in [0, 1, 3, 4]]
+
+
+CRANES = [
+    {"id": 1, "name": "STS 1", "hoist": [{"id": 11, "hoisting": {"height": [{"value": 12.5}]}}],
+     "trolley": [{"id": 101}]},
+    {"id": 2, "name": "STS 2", "hoist": [], "trolley": [{"id": 201}, {"id": 202}]}
+]
+
+
+def project(spark, config, *payloads):
+    return select_fields(decoded_messages(decode(spark, *payloads)), compile_projection(load_selected_fields(config)))
+
+
+def test_kpi_sample_projection_writes_a_row_per_che(spark):
+    rows = project(spark, KPI_SAMPLE, message("1", "2023-03-01T06:59:59.5Z", CRANES)).collect()
+
+    assert [(row["msg_id"], row["che_id"], row["che_name"]) for row in rows] == [("1", 1, "STS 1"), ("1", 2, "STS 2")]
+    # The fields below a [0] of an empty list are null
+    assert [row["che_hoist_hoisting_height_value"] for row in rows] == [12.5, None]
+    assert [row["che_trolley_id"] for row in rows] == [101, 201]
+    assert rows[0]["msg_timestamp"] == datetime.datetime(2023, 3, 1, 6, 59, 59, 500000)
+    assert [(row["event_date"], row["event_hour"]) for row in rows] == [("2023-03-01", "06")] * 2
+
+
+def test_kpi_sample_projection_keeps_messages_without_che(spark):
+    rows = project(spark, KPI_SAMPLE, message("1", che=()), json.dumps({"msg": {"id": "2"}})).collect()
+
+    assert [(row["msg_id"], row["che_id"]) for row in rows] == [("1", None), ("2", None)]
+
+
+def test_nested_explodes_keep_the_elements_aligned(spark):
+    config = {"selected-fields": [
+        {"che_id": {"path": "che[*].id", "type": "int"}},
+        {"hoist_id": {"path": "che[*].hoist[*].id", "type": "int"}},
+        {"height": {"path": "che[*].hoist[*].hoisting.height[0].value", "type": "double"}},
+        {"trolley_id": {"path": "che[*].trolley[*].id", "type": "int"}}
+    ]}
+    cranes = CRANES + [{"id": 3, "hoist": [{"id": 31}, {"id": 32, "hoisting": {"height": [{"value": 3.5}]}}]}]
+
+    rows = project(spark, config, message("1", che=cranes)).collect()
+
+    # Sibling lists yield the cross product of their elements, an empty or missing list a row of nulls
+    assert [(row["che_id"], row["hoist_id"], row["height"], row["trolley_id"]) for row in rows] == [
+        (1, 11, 12.5, 101),
+        (2, None, None, 201),
+        (2, None, None, 202),
+        (3, 31, None, None),
+        (3, 32, 3.5, None)
+    ]
+
+
+@pytest.mark.parametrize("record_format", ["json", "packed"])
+def test_replaying_the_raw_archive_projects_the_same_rows(spark, tmp_path, record_format):
+    messages = [message("1", che=CRANES), '{"msg": ', message("3", timestamp=None), message("4", che=CRANES[1:])]
+    if record_format == "json":
+        payloads = messages
+    else:
+        payloads = list(pack_records([payload.encode() for payload in messages], compression="gzip", aggregated=True))
+    dead_letters = compile_dead_letters(REQUIRED_FIELDS, str(tmp_path.joinpath("dead-letter")))
+    projection = compile_projection(load_selected_fields(KPI_SAMPLE))
+
+    # The streaming path archives the raw records of the batch and projects its messages
+    batch = decode_records(kinesis_records(spark, *payloads), INPUT_SCHEMA, record_format, archive=True)
+    write_raw_archive(batch, str(tmp_path.joinpath("archive")))
+    streamed = select_fields(valid_records(decoded_messages(batch), dead_letters), projection)
+
+    # The replay decodes the archived records again
+    archived = spark.read.option("basePath", str(tmp_path.joinpath("archive"))).parquet(
+        str(tmp_path.joinpath("archive", "arrival_date=2023-03-01")))
+    replayed = select_fields(valid_records(decode_records(archived, INPUT_SCHEMA, record_format), dead_letters),
+                             projection)
+
+    assert archived.select("arrival_date", "arrival_hour").distinct().collect() == [
+        (datetime.date(2023, 3, 1), 6)]
+    assert sorted(replayed.collect()) == sorted(streamed.collect())
+    assert [row["msg_id"] for row in sorted(streamed.collect())] == ["1", "1", "4"]
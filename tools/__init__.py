@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+REPOSITORY_DIR = Path(__file__).parent.parent.resolve()
+
+CONFIG_DIR = Path(REPOSITORY_DIR, "pipeline_stack", "config")
+
+# The modules of the Glue ETL Job are flat modules next to the job script. They are made importable for the tools the
+# same way Glue does it with --extra-py-files.
+RUNTIME_DIR = Path(REPOSITORY_DIR, "pipeline_stack", "runtime", "glue_job_assets_bucket")
+
+if str(RUNTIME_DIR) not in sys.path:
+    sys.path.insert(0, str(RUNTIME_DIR))
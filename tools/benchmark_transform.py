@@ -0,0 +1,223 @@
+"""
+Benchmark the micro-batch transformation of the Glue ETL Job with local-mode Spark.
+
+Synthetic batches of raw Kinesis records are created before the measurement starts. Every batch is then run through
+the same steps as in the Glue ETL Job, writing into a temporary directory: the records are decoded and parsed with the
+input schema, deduplicated and persisted, and the dead letters and the projection of the selected fields are written.
+Without a streaming state, the batch is deduplicated by key only.
+
+Usage:
+    python -m tools.benchmark_transform --messages-per-batch 10000 --batches 10 --che-per-message 1
+    python -m tools.benchmark_transform --record-format packed --compression gzip
+    python -m tools.benchmark_transform --json results.json --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import datetime
+import json
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from pyspark.sql import SparkSession
+from pyspark.sql.types import BinaryType
+from pyspark.sql.types import StringType
+from pyspark.sql.types import StructField
+from pyspark.sql.types import StructType
+from pyspark.sql.types import TimestampType
+
+from tools import CONFIG_DIR
+from tools.synthetic_data import DEFAULT_SAMPLE
+from tools.synthetic_data import load_sample
+from tools.synthetic_data import synthetic_records
+from field_paths import load_selected_fields
+from record_codec import COMPRESSIONS
+from record_codec import pack_records
+from transforms import compile_dead_letters
+from transforms import compile_projection
+from transforms import decode_records
+from transforms import decoded_messages
+from transforms import deduplicate
+from transforms import process_batch
+
+DEFAULT_SELECTED_FIELDS = Path(CONFIG_DIR, "kpis", "kpi_sample.json")
+DEFAULT_SCHEMA = Path(CONFIG_DIR, "schemas", "input_schema.json")
+DEFAULT_REQUIRED_FIELDS = ["msg.id", "msg.timestamp", "che[0].id"]
+
+# The columns of the Kinesis source of the Glue ETL Job
+KINESIS_SCHEMA = StructType([
+    StructField("data", BinaryType()),
+    StructField("partitionKey", StringType()),
+    StructField("sequenceNumber", StringType()),
+    StructField("approximateArrivalTimestamp", TimestampType())
+])
+
+
+def create_spark_session(master, shuffle_partitions):
+    return SparkSession.builder \
+        .master(master) \
+        .appName("benchmark-transform") \
+        .config("spark.sql.shuffle.partitions", shuffle_partitions) \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+
+
+def memory_pools(spark):
+    management_factory = spark.sparkContext._jvm.java.lang.management.ManagementFactory
+    return [pool for pool in management_factory.getMemoryPoolMXBeans() if pool.getType().toString() == "Heap memory"]
+
+
+def peak_jvm_heap_bytes(pools):
+    return sum(pool.getPeakUsage().getUsed() for pool in pools)
+
+
+def create_batch(spark, sample, args, batch_number):
+    """A persisted batch of raw Kinesis records, with one message per record or packed messages."""
+    messages = [record.encode("utf-8") for record in synthetic_records(
+        sample,
+        args.messages_per_batch,
+        che_per_message=args.che_per_message,
+        seed=batch_number
+    )]
+    if args.record_format == "packed":
+        payloads = pack_records(messages, compression=args.compression)
+    else:
+        payloads = messages
+    arrival_time = datetime.datetime.utcnow()
+    rows = [
+        (bytearray(payload), "key-{}".format(i % args.input_partitions), "{}-{}".format(batch_number, i), arrival_time)
+        for i, payload in enumerate(payloads)
+    ]
+    data_frame = spark.createDataFrame(spark.sparkContext.parallelize(rows, args.input_partitions), KINESIS_SCHEMA)
+    data_frame.persist()
+    data_frame.count()
+    return data_frame
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_benchmark(args):
+    spark = create_spark_session(args.master, args.shuffle_partitions)
+    schema = StructType.fromJson(json.loads(args.schema.read_text()))
+    projection = compile_projection(load_selected_fields(json.loads(args.selected_fields.read_text())))
+    required_fields = json.loads(args.required_fields) if args.required_fields else DEFAULT_REQUIRED_FIELDS
+    sample = load_sample(args.sample)
+    pools = memory_pools(spark)
+
+    latencies = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for batch_number in range(args.warmup + args.batches):
+            records = create_batch(spark, sample, args, batch_number)
+            dead_letters = compile_dead_letters(required_fields, str(Path(output_dir, "dead-letter")))
+
+            if batch_number == args.warmup:
+                for pool in pools:
+                    pool.resetPeakUsage()
+
+            started = time.perf_counter()
+            data_frame = deduplicate(decode_records(records, schema, args.record_format), "msg.id", "1 hour")
+            data_frame.persist()
+            process_batch(
+                decoded_messages(data_frame),
+                projection,
+                output_dir,
+                args.output_format,
+                args.output_compression,
+                dead_letters=dead_letters
+            )
+            elapsed = time.perf_counter() - started
+
+            data_frame.unpersist()
+            records.unpersist()
+            if batch_number >= args.warmup:
+                latencies.append(elapsed)
+
+        peak_jvm_heap = peak_jvm_heap_bytes(pools)
+
+    # The cores of the local master, so the capacity planner can derive the throughput per vCPU
+    cores = spark.sparkContext.defaultParallelism
+    spark.stop()
+
+    return {
+        "master": args.master,
+        "cores": cores,
+        "messages_per_batch": args.messages_per_batch,
+        "che_per_message": args.che_per_message,
+        "record_format": args.record_format,
+        "batches": args.batches,
+        "output_format": args.output_format,
+        "output_compression": args.output_compression,
+        "records_per_second": args.messages_per_batch * len(latencies) / sum(latencies),
+        "latency_ms": {
+            "mean": statistics.mean(latencies) * 1000,
+            "p50": percentile(latencies, 0.5) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "max": max(latencies) * 1000
+        },
+        "peak_jvm_heap_mb": peak_jvm_heap / 1024 / 1024,
+        "peak_python_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def print_results(results):
+    print("master:               {}".format(results["master"]))
+    print("messages per batch:   {}".format(results["messages_per_batch"]))
+    print("CHE per message:      {}".format(results["che_per_message"]))
+    print("record format:        {}".format(results["record_format"]))
+    print("output:               {} ({})".format(results["output_format"], results["output_compression"]))
+    print("records/s:            {:.0f}".format(results["records_per_second"]))
+    print("batch latency [ms]:   mean {mean:.1f}, p50 {p50:.1f}, p95 {p95:.1f}, max {max:.1f}".format(
+        **results["latency_ms"]))
+    print("peak JVM heap [MB]:   {:.1f}".format(results["peak_jvm_heap_mb"]))
+    print("peak Python RSS [MB]: {:.1f}".format(results["peak_python_rss_mb"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages-per-batch", type=int, default=10000)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2, help="Batches run before the measurement starts")
+    parser.add_argument("--che-per-message", type=int, default=1)
+    parser.add_argument("--input-partitions", type=int, default=4,
+                        help="The number of partitions of a batch, e.g. the number of Kinesis shards")
+    parser.add_argument("--shuffle-partitions", type=int, default=4)
+    parser.add_argument("--record-format", choices=["json", "packed"], default="json")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip",
+                        help="The compression of packed records")
+    parser.add_argument("--required-fields", help="The required fields as a JSON list, the defaults of cdk.json")
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--output-format", default="json")
+    parser.add_argument("--output-compression", default="none")
+    parser.add_argument("--sample", type=Path, default=DEFAULT_SAMPLE)
+    parser.add_argument("--selected-fields", type=Path, default=DEFAULT_SELECTED_FIELDS)
+    parser.add_argument("--schema", type=Path, default=DEFAULT_SCHEMA)
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="The tolerated loss of records/s compared to the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args)
+    print_results(results)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        ratio = results["records_per_second"] / baseline["records_per_second"]
+        print("records/s vs. baseline: {:+.1%}".format(ratio - 1))
+        if ratio < 1 - args.max_regression:
+            print("Throughput regressed by more than {:.0%}".format(args.max_regression))
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Compare two captures of batch profiles of the Glue ETL Job to find regressions, e.g. of a change of the selected
+fields.
+
+A capture is a directory of the profiles of one job run or config, downloaded from the profiles/ prefix of the output
+bucket. The tool compares the median of every phase metric of both captures. Times and bytes are compared per 1000
+records, since the batches of two captures differ in size, and counts like files and tasks per batch. It reports the
+metrics which grew by more than --max-regression and the physical plans which changed.
+
+Usage:
+    aws s3 sync s3://<output bucket>/profiles/<job name>/2023-03-01/ baseline/
+    python -m tools.compare_profiles baseline/ candidate/ --max-regression 0.2 [--show-plans]
+"""
+import argparse
+import difflib
+import json
+import statistics
+import sys
+from collections import Counter
+from pathlib import Path
+
+from profiling import PROFILE_VERSION
+from profiling import plan_digest
+
+# Metrics compared per 1000 records, the others are compared per batch
+PER_RECORDS_METRICS = [
+    "wall_ms",
+    "python_cpu_ms",
+    "executor_run_ms",
+    "executor_cpu_ms",
+    "input_bytes",
+    "shuffle_read_bytes",
+    "shuffle_write_bytes",
+    "spilled_bytes",
+    "output_bytes"
+]
+PER_BATCH_METRICS = [
+    "spark_jobs",
+    "stages",
+    "tasks",
+    "written_files"
+]
+
+# Differences below these are noise, e.g. a few milliseconds of a phase which takes almost no time
+_MIN_DIFFERENCES = {
+    "wall_ms": 50,
+    "python_cpu_ms": 50,
+    "executor_run_ms": 50,
+    "executor_cpu_ms": 50
+}
+
+
+def load_capture(path):
+    profiles = []
+    for profile_path in sorted(Path(path).rglob("*.json")):
+        profile = json.loads(profile_path.read_text())
+        if profile.get("version") != PROFILE_VERSION:
+            print("Skipping {}, profile version {} is not {}".format(
+                profile_path, profile.get("version"), PROFILE_VERSION), file=sys.stderr)
+            continue
+        profiles.append(profile)
+    if not profiles:
+        raise ValueError("No profiles found in {}".format(path))
+    return profiles
+
+
+def phase_medians(profiles):
+    """Return the median of every metric of every phase, times and bytes per 1000 records."""
+    values = {}
+    for profile in profiles:
+        records = profile.get("records") or 0
+        for phase_name, phase in profile["phases"].items():
+            for metric in PER_RECORDS_METRICS + PER_BATCH_METRICS:
+                if phase.get(metric) is None or (metric in PER_RECORDS_METRICS and not records):
+                    continue
+                value = phase[metric] * 1000 / records if metric in PER_RECORDS_METRICS else phase[metric]
+                values.setdefault((phase_name, metric), []).append(value)
+    return {key: statistics.median(metric_values) for key, metric_values in values.items()}
+
+
+def common_plans(profiles):
+    """Return the most common plan of every plan name, plans which only differ in their expression ids are equal."""
+    digests = {}
+    plans = {}
+    for profile in profiles:
+        for name, plan in profile["plans"].items():
+            digest = plan_digest(plan["plan"])
+            digests.setdefault(name, Counter())[digest] += 1
+            plans.setdefault((name, digest), plan["plan"])
+    return {name: plans[(name, counter.most_common(1)[0][0])] for name, counter in digests.items()}
+
+
+def compare(baseline, candidate, max_regression):
+    """Return the rows of the comparison and the regressed rows, as (phase, metric, baseline, candidate, change)."""
+    baseline_medians = phase_medians(baseline)
+    candidate_medians = phase_medians(candidate)
+    rows = []
+    regressions = []
+    for key in sorted(set(baseline_medians) | set(candidate_medians)):
+        before, after = baseline_medians.get(key), candidate_medians.get(key)
+        change = after / before - 1 if before and after is not None else None
+        row = key + (before, after, change)
+        rows.append(row)
+        if change is not None and change > max_regression and after - before >= _MIN_DIFFERENCES.get(key[1], 0):
+            regressions.append(row)
+    return rows, regressions
+
+
+def format_value(value):
+    return "-" if value is None else "{:.1f}".format(value)
+
+
+def print_rows(rows):
+    print("{:<16} {:<22} {:>14} {:>14} {:>9}".format("phase", "metric", "baseline", "candidate", "change"))
+    for phase_name, metric, before, after, change in rows:
+        print("{:<16} {:<22} {:>14} {:>14} {:>9}".format(
+            phase_name,
+            metric + (" /1k" if metric in PER_RECORDS_METRICS else ""),
+            format_value(before),
+            format_value(after),
+            "-" if change is None else "{:+.1%}".format(change)
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path, help="The directory of the baseline profiles")
+    parser.add_argument("candidate", type=Path, help="The directory of the profiles to compare against the baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="The tolerated growth of a metric compared to the baseline")
+    parser.add_argument("--show-plans", action="store_true", help="Print the diff of changed physical plans")
+    args = parser.parse_args(argv)
+
+    baseline = load_capture(args.baseline)
+    candidate = load_capture(args.candidate)
+    print("baseline:  {} profiles, candidate: {} profiles".format(len(baseline), len(candidate)))
+
+    rows, regressions = compare(baseline, candidate, args.max_regression)
+    print_rows(rows)
+
+    baseline_plans = common_plans(baseline)
+    candidate_plans = common_plans(candidate)
+    for name in sorted(set(baseline_plans) & set(candidate_plans)):
+        if plan_digest(baseline_plans[name]) == plan_digest(candidate_plans[name]):
+            continue
+        print("The {} plan changed".format(name))
+        if args.show_plans:
+            sys.stdout.writelines(difflib.unified_diff(
+                baseline_plans[name].splitlines(keepends=True),
+                candidate_plans[name].splitlines(keepends=True),
+                fromfile="baseline",
+                tofile="candidate"
+            ))
+            print()
+
+    if regressions:
+        print("Regressed by more than {:.0%}:".format(args.max_regression))
+        print_rows(regressions)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
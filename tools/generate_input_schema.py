@@ -0,0 +1,149 @@
+"""
+Generate the input schema of the Kinesis data stream from sample messages and the selected fields config.
+
+The schema only contains the fields addressed by the selected fields, in the JSON representation of a Spark
+StructType. It is registered as the columns of the Glue Kinesis table and applied by the Glue ETL Job instead of
+inferring the schema of every batch.
+
+Usage:
+    python -m tools.generate_input_schema [--check]
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from tools import CONFIG_DIR
+from tools import REPOSITORY_DIR
+from field_paths import EACH
+from field_paths import load_selected_fields
+
+DEFAULT_SAMPLES = [Path(REPOSITORY_DIR, "docs", "sample_data", "sample_data.json")]
+DEFAULT_SELECTED_FIELDS = Path(CONFIG_DIR, "kpis", "kpi_sample.json")
+DEFAULT_OUTPUT = Path(CONFIG_DIR, "schemas", "input_schema.json")
+
+# Numeric types are widened when samples disagree, e.g. a value of 0 next to a value of 6.014
+_WIDENING = {
+    frozenset(["long", "double"]): "double"
+}
+
+
+def infer_type(value):
+    """Infer the Spark type of a JSON value, the same way the Spark JSON reader does it."""
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, dict):
+        return {"type": "struct", "fields": {name: infer_type(field) for name, field in value.items()}}
+    if isinstance(value, list):
+        element_type = "string"
+        if value:
+            element_type = infer_type(value[0])
+            for element in value[1:]:
+                element_type = merge_types(element_type, infer_type(element))
+        return {"type": "array", "elementType": element_type}
+    return "string"
+
+
+def merge_types(left, right):
+    if left == right:
+        return left
+    if isinstance(left, dict) and isinstance(right, dict) and left["type"] == right["type"]:
+        if left["type"] == "array":
+            return {"type": "array", "elementType": merge_types(left["elementType"], right["elementType"])}
+        fields = dict(left["fields"])
+        for name, field_type in right["fields"].items():
+            fields[name] = merge_types(fields[name], field_type) if name in fields else field_type
+        return {"type": "struct", "fields": fields}
+    if isinstance(left, str) and isinstance(right, str):
+        return _WIDENING.get(frozenset([left, right]), "string")
+    raise ValueError("Incompatible types {} and {}".format(left, right))
+
+
+def prune_type(value, steps, path):
+    """Infer the type of a sample value, reduced to the branch addressed by the remaining steps of a field path."""
+    if not steps:
+        return infer_type(value)
+
+    step = steps[0]
+    if isinstance(step, int) or step is EACH:
+        if not isinstance(value, list):
+            raise ValueError("Field path {} indexes a value which is not a list in the sample".format(path))
+        # Elements are merged like the Spark JSON reader does it, elements without the addressed branch are skipped
+        elements = []
+        for element in value:
+            try:
+                elements.append(prune_type(element, steps[1:], path))
+            except ValueError:
+                continue
+        if not elements:
+            raise ValueError("Field path {} does not exist in the sample".format(path))
+        element_type = elements[0]
+        for element in elements[1:]:
+            element_type = merge_types(element_type, element)
+        return {"type": "array", "elementType": element_type}
+
+    if not isinstance(value, dict) or step not in value:
+        raise ValueError("Field path {} does not exist in the sample".format(path))
+    return {"type": "struct", "fields": {step: prune_type(value[step], steps[1:], path)}}
+
+
+def to_spark_json(data_type):
+    if isinstance(data_type, str):
+        return data_type
+    if data_type["type"] == "array":
+        return {
+            "type": "array",
+            "elementType": to_spark_json(data_type["elementType"]),
+            "containsNull": True
+        }
+    return {
+        "type": "struct",
+        "fields": [
+            {"name": name, "type": to_spark_json(field_type), "nullable": True, "metadata": {}}
+            for name, field_type in data_type["fields"].items()
+        ]
+    }
+
+
+def generate_input_schema(samples, selected_fields):
+    schema = {"type": "struct", "fields": {}}
+    for sample in samples:
+        for _, steps, _ in selected_fields:
+            path = ".".join(str(step) for step in steps)
+            schema = merge_types(schema, prune_type(sample, steps, path))
+    return to_spark_json(schema)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", nargs="+", type=Path, default=DEFAULT_SAMPLES,
+                        help="JSON files containing one sample message each")
+    parser.add_argument("--selected-fields", type=Path, default=DEFAULT_SELECTED_FIELDS,
+                        help="The selected fields config")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT,
+                        help="The schema file to write")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check that the schema file is up to date")
+    args = parser.parse_args(argv)
+
+    samples = [json.loads(sample.read_text()) for sample in args.samples]
+    selected_fields = load_selected_fields(json.loads(args.selected_fields.read_text()))
+    schema = json.dumps(generate_input_schema(samples, selected_fields), indent=2) + "\n"
+
+    if args.check:
+        if not args.output.exists() or args.output.read_text() != schema:
+            print("{} is out of date, regenerate it with python -m tools.generate_input_schema".format(args.output))
+            return 1
+        return 0
+
+    args.output.write_text(schema)
+    print("Wrote {}".format(args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Pack JSON messages into compressed and KPL aggregated Kinesis records, the producer side of the packed record format.
+
+Messages are read as JSON lines from a file, or generated from the sample message. The tool reports how many Kinesis
+records and bytes the messages cost packed and unpacked, and the shards needed for a given message rate. With
+--stream-name, the packed records are put into the Kinesis data stream.
+
+Usage:
+    python -m tools.pack_records --messages 10000 --compression gzip --rate 2000
+    python -m tools.pack_records --input messages.jsonl --stream-name <stream> --compression zstd
+"""
+import argparse
+import math
+import sys
+import uuid
+from pathlib import Path
+
+from tools.synthetic_data import DEFAULT_SAMPLE
+from tools.synthetic_data import load_sample
+from tools.synthetic_data import synthetic_records
+from record_codec import COMPRESSIONS
+from record_codec import pack_records
+
+# Write limits of a provisioned shard
+SHARD_RECORDS_PER_SECOND = 1000
+SHARD_BYTES_PER_SECOND = 1024 * 1024
+
+# Limits of a single PutRecords request
+PUT_RECORDS_MAX_RECORDS = 500
+PUT_RECORDS_MAX_BYTES = 5 * 1024 * 1024
+
+
+def read_messages(args):
+    if args.input:
+        return [line.encode() for line in Path(args.input).read_text().splitlines() if line.strip()]
+    return [record.encode() for record in synthetic_records(
+        load_sample(args.sample), args.messages, che_per_message=args.che_per_message)]
+
+
+def required_shards(records, data_bytes, messages, rate):
+    """The shards needed to write messages at the given rate, limited by records or bytes, whichever is hit first."""
+    seconds = messages / rate
+    return max(1, math.ceil(records / seconds / SHARD_RECORDS_PER_SECOND),
+               math.ceil(data_bytes / seconds / SHARD_BYTES_PER_SECOND))
+
+
+def put_records(stream_name, records):
+    import boto3
+
+    client = boto3.client("kinesis")
+    batch, batch_bytes = [], 0
+    failed = 0
+    for data in records:
+        # Random partition keys spread the packed records evenly across the shards
+        entry = {"Data": data, "PartitionKey": uuid.uuid4().hex}
+        size = len(data) + len(entry["PartitionKey"])
+        if batch and (len(batch) == PUT_RECORDS_MAX_RECORDS or batch_bytes + size > PUT_RECORDS_MAX_BYTES):
+            failed += client.put_records(StreamName=stream_name, Records=batch)["FailedRecordCount"]
+            batch, batch_bytes = [], 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        failed += client.put_records(StreamName=stream_name, Records=batch)["FailedRecordCount"]
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=Path, help="A file with one JSON message per line")
+    parser.add_argument("--messages", type=int, default=10000, help="The number of synthetic messages")
+    parser.add_argument("--che-per-message", type=int, default=1)
+    parser.add_argument("--sample", type=Path, default=DEFAULT_SAMPLE)
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    parser.add_argument("--no-aggregation", action="store_true", help="Put every compressed block into its own record")
+    parser.add_argument("--messages-per-record", type=int, default=500,
+                        help="The maximum number of messages compressed into one user record")
+    parser.add_argument("--rate", type=float, default=1000.0,
+                        help="The message rate in messages/s for the shard estimate")
+    parser.add_argument("--stream-name", help="Put the packed records into this Kinesis data stream")
+    args = parser.parse_args(argv)
+
+    messages = read_messages(args)
+    if not messages:
+        print("No messages to pack")
+        return 1
+
+    records = list(pack_records(
+        messages,
+        compression=args.compression,
+        aggregated=not args.no_aggregation,
+        messages_per_record=args.messages_per_record
+    ))
+
+    plain_bytes = sum(len(message) for message in messages)
+    packed_bytes = sum(len(record) for record in records)
+    print("messages:             {}".format(len(messages)))
+    print("plain records:        {} ({} bytes)".format(len(messages), plain_bytes))
+    print("packed records:       {} ({} bytes)".format(len(records), packed_bytes))
+    print("messages per record:  {:.1f}".format(len(messages) / len(records)))
+    print("compression ratio:    {:.1f}".format(plain_bytes / packed_bytes))
+    print("shards at {:.0f} msg/s: {} plain, {} packed".format(
+        args.rate,
+        required_shards(len(messages), plain_bytes, len(messages), args.rate),
+        required_shards(len(records), packed_bytes, len(messages), args.rate)
+    ))
+
+    if args.stream_name:
+        failed = put_records(args.stream_name, records)
+        if failed:
+            print("{} records could not be put into {}".format(failed, args.stream_name))
+            return 1
+        print("Put {} records into {}".format(len(records), args.stream_name))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Plan the capacity of the pipeline for a target load.
+
+The planner derives the shard count, the Glue worker type, number of workers and window size from the message rate,
+the average record size and the latency target, and prints them as context values. The throughput per vCPU is taken
+from the results of the local benchmark of the transformation, or from the context of cdk.json.
+
+Usage:
+    python -m tools.benchmark_transform --json benchmark.json
+    python -m tools.plan_capacity --message-rate 2000 --record-size 1200 --latency-target 60 --benchmark benchmark.json
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from tools import REPOSITORY_DIR
+from pipeline_stack.capacity import WORKER_VCPUS
+from pipeline_stack.capacity import batch_seconds
+from pipeline_stack.capacity import format_window_size
+from pipeline_stack.capacity import job_throughput
+from pipeline_stack.capacity import plan_job
+from pipeline_stack.capacity import shards_needed
+
+CDK_JSON = Path(REPOSITORY_DIR, "cdk.json")
+
+
+def main(argv=None):
+    context = json.loads(CDK_JSON.read_text())["context"]
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--message-rate", type=float, required=True, help="The average message rate in messages/s")
+    parser.add_argument("--peak-message-rate", type=float, help="The peak message rate, defaults to the average")
+    parser.add_argument("--record-size", type=int, required=True, help="The average message size in bytes")
+    parser.add_argument("--latency-target", type=int, required=True,
+                        help="The seconds until a message is written to S3 at the latest")
+    parser.add_argument("--messages-per-record", type=float, default=1,
+                        help="The average messages per Kinesis record of packed producers")
+    parser.add_argument("--benchmark", type=Path, help="The JSON results of tools.benchmark_transform")
+    parser.add_argument("--worker-type", choices=list(WORKER_VCPUS), action="append",
+                        help="Only consider this worker type, can be repeated")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark = json.loads(args.benchmark.read_text())
+        messages_per_second_per_vcpu = benchmark["records_per_second"] / benchmark["cores"]
+    else:
+        messages_per_second_per_vcpu = context["job-messages-per-second-per-vcpu"]
+
+    # The job is sized for the peak, so it does not fall behind during vessel calls
+    peak_rate = args.peak_message_rate or args.message_rate
+    job = plan_job(peak_rate, args.latency_target, messages_per_second_per_vcpu, args.worker_type)
+    if job is None:
+        print("No Glue job configuration processes {} messages/s within {} seconds".format(
+            peak_rate, args.latency_target))
+        return 1
+    worker_type, number_of_workers, window_seconds = job
+
+    # The initial shard count leaves room for the shard scaler to react, the maximum takes the peak at full
+    # utilization of the write limits
+    recommended = {
+        "kinesis-shard-count": shards_needed(
+            args.message_rate, args.record_size, args.messages_per_record, context["kinesis-target-utilization"]),
+        "kinesis-max-shard-count": shards_needed(
+            peak_rate, args.record_size, args.messages_per_record, context["kinesis-target-utilization"]),
+        "job-worker-type": worker_type,
+        "job-number-of-workers": number_of_workers,
+        "job-window-size": format_window_size(window_seconds),
+        "job-messages-per-second-per-vcpu": round(messages_per_second_per_vcpu),
+        "expected-message-rate": peak_rate,
+        "expected-record-size": args.record_size,
+        "expected-messages-per-record": args.messages_per_record,
+        "expected-latency-seconds": args.latency_target
+    }
+
+    throughput = job_throughput(worker_type, number_of_workers, messages_per_second_per_vcpu)
+    processing = batch_seconds(peak_rate, window_seconds, throughput)
+    print("throughput per vCPU:  {:.0f} messages/s".format(messages_per_second_per_vcpu))
+    print("job throughput:       {:.0f} messages/s ({:.0%} utilized at the peak)".format(
+        throughput, peak_rate / throughput))
+    print("batch processing:     {:.1f} seconds per {} second window".format(processing, window_seconds))
+    print("worst-case latency:   {:.1f} seconds".format(window_seconds + processing))
+    print()
+    print("Recommended context values:")
+    print(json.dumps(recommended, indent=2))
+    print()
+    print(" ".join("-c {}={}".format(key, json.dumps(value) if isinstance(value, str) and " " in value else value)
+                   for key, value in recommended.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Replay the scaling decisions of the Kinesis shard scaler against a recorded or synthetic metric series.
+
+The replay simulates the shard count minute by minute: writes exceeding the write limits of the simulated shards are
+throttled, scaling takes effect after a delay, and the scaler decides on the samples the simulated stream would have
+reported. Recorded throttled writes are counted as demand, since the recorded stream could not accept them.
+
+Usage:
+    python -m tools.replay_shard_scaling --record <stream name> --hours 24 --output metrics.json
+    python -m tools.replay_shard_scaling --metrics metrics.json --shards 2
+    python -m tools.replay_shard_scaling --synthetic-hours 24 --json
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import sys
+from pathlib import Path
+
+from shard_scaler import SHARD_BYTES_PER_MINUTE
+from shard_scaler import SHARD_RECORDS_PER_MINUTE
+from shard_scaler import MetricSample
+from shard_scaler import ScalingPolicy
+from shard_scaler import decide
+from shard_scaler import fetch_samples
+from shard_scaler import validate_policy
+
+FIELDS = list(MetricSample._fields)
+
+
+def record_metrics(stream_name, hours, output):
+    import boto3
+
+    end = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0)
+    start = end - datetime.timedelta(hours=hours)
+    samples = fetch_samples(boto3.client("cloudwatch"), stream_name, start, end)
+    Path(output).write_text(json.dumps({
+        "stream": stream_name,
+        "start": start.isoformat(),
+        "samples": [sample._asdict() for sample in samples]
+    }, indent=1))
+    print("Recorded {} minutes of {} into {}".format(len(samples), stream_name, output))
+
+
+def load_metrics(path):
+    return [MetricSample(**{field: sample[field] for field in FIELDS})
+            for sample in json.loads(Path(path).read_text())["samples"]]
+
+
+def synthetic_metrics(hours, bytes_per_record=1000, seed=0):
+    """Three shifts a day with different base loads and a few vessel calls with bursts of traffic."""
+    rng = random.Random(seed)
+    calls = set()
+    for _ in range(max(1, hours // 8)):
+        start = rng.randrange(hours * 60)
+        calls.update(range(start, start + rng.randrange(60, 180)))
+
+    samples = []
+    for minute in range(hours * 60):
+        shift = (minute // 480) % 3
+        records_per_second = [400, 250, 80][shift] * rng.uniform(0.8, 1.2)
+        if minute in calls:
+            records_per_second += 1500 * rng.uniform(0.9, 1.1)
+        records = records_per_second * 60
+        samples.append(MetricSample(records * bytes_per_record, records, 0.0))
+    return samples
+
+
+def replay(samples, shards, policy, scaling_delay):
+    """Return the per-minute simulation and the scaling events of the replay."""
+    history = []
+    minutes = []
+    events = []
+    minutes_since_scaling = None
+    pending = None
+
+    for minute, recorded in enumerate(samples):
+        # Writes throttled by the recorded stream were attempted, their bytes are estimated from the accepted records
+        bytes_per_record = recorded.incoming_bytes / recorded.incoming_records if recorded.incoming_records else 0.0
+        wanted_records = recorded.incoming_records + recorded.throttled_records
+        wanted_bytes = recorded.incoming_bytes + recorded.throttled_records * bytes_per_record
+
+        # The simulated stream accepts writes up to the limits of its shards
+        accepted = min(1.0, shards * SHARD_RECORDS_PER_MINUTE / wanted_records if wanted_records else 1.0,
+                       shards * SHARD_BYTES_PER_MINUTE / wanted_bytes if wanted_bytes else 1.0)
+        sample = MetricSample(wanted_bytes * accepted, wanted_records * accepted, wanted_records * (1 - accepted))
+        history.append(sample)
+        minutes.append({"minute": minute, "shards": shards, "throttled_records": sample.throttled_records})
+
+        if minutes_since_scaling is not None:
+            minutes_since_scaling += 1
+
+        if pending is not None:
+            # The stream is updating and the scaler skips it until the new shard count is active
+            if minute >= pending[0]:
+                shards = pending[1]
+                pending = None
+            continue
+
+        decision = decide(history, shards, policy, minutes_since_scaling)
+        if decision.shard_count != shards:
+            events.append({"minute": minute, "from": shards, "to": decision.shard_count, "reason": decision.reason})
+            pending = (minute + scaling_delay, decision.shard_count)
+            minutes_since_scaling = 0
+
+    return minutes, events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", metavar="STREAM_NAME", help="Record the metrics of a stream instead of replaying")
+    parser.add_argument("--hours", type=int, default=24, help="The hours of metrics to record")
+    parser.add_argument("--output", type=Path, default=Path("metrics.json"))
+    parser.add_argument("--metrics", type=Path, help="A metric series recorded with --record")
+    parser.add_argument("--synthetic-hours", type=int, default=24, help="The hours of a synthetic series")
+    parser.add_argument("--shards", type=int, default=1, help="The shard count at the start of the replay")
+    parser.add_argument("--scaling-delay", type=int, default=3, help="Minutes until a new shard count is active")
+    parser.add_argument("--min-shards", type=int, default=1)
+    parser.add_argument("--max-shards", type=int, default=8)
+    parser.add_argument("--scale-out-utilization", type=float, default=0.8)
+    parser.add_argument("--scale-in-utilization", type=float, default=0.3)
+    parser.add_argument("--target-utilization", type=float, default=0.6)
+    parser.add_argument("--scale-out-periods", type=int, default=3)
+    parser.add_argument("--scale-in-periods", type=int, default=30)
+    parser.add_argument("--scale-out-cooldown", type=int, default=5)
+    parser.add_argument("--scale-in-cooldown", type=int, default=60)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_metrics(args.record, args.hours, args.output)
+        return 0
+
+    policy = validate_policy(ScalingPolicy(
+        min_shards=args.min_shards,
+        max_shards=args.max_shards,
+        scale_out_utilization=args.scale_out_utilization,
+        scale_in_utilization=args.scale_in_utilization,
+        target_utilization=args.target_utilization,
+        scale_out_periods=args.scale_out_periods,
+        scale_in_periods=args.scale_in_periods,
+        scale_out_cooldown=args.scale_out_cooldown,
+        scale_in_cooldown=args.scale_in_cooldown
+    ))
+    samples = load_metrics(args.metrics) if args.metrics else synthetic_metrics(args.synthetic_hours)
+    minutes, events = replay(samples, args.shards, policy, args.scaling_delay)
+
+    peak_demand = max(max(sample.incoming_bytes / SHARD_BYTES_PER_MINUTE,
+                          (sample.incoming_records + sample.throttled_records) / SHARD_RECORDS_PER_MINUTE)
+                      for sample in samples)
+    results = {
+        "minutes": len(minutes),
+        "scaling_operations": len(events),
+        "shard_hours": sum(minute["shards"] for minute in minutes) / 60,
+        "fixed_shard_hours": math.ceil(peak_demand) * len(minutes) / 60,
+        "throttled_minutes": sum(1 for minute in minutes if minute["throttled_records"] > 0),
+        "throttled_records": sum(minute["throttled_records"] for minute in minutes),
+        "events": events
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    for event in events:
+        print("minute {:>5}: {} -> {} shards ({})".format(event["minute"], event["from"], event["to"], event["reason"]))
+    print("minutes:              {}".format(results["minutes"]))
+    print("scaling operations:   {}".format(results["scaling_operations"]))
+    print("shard hours:          {:.1f} (fixed for the peak: {:.1f})".format(
+        results["shard_hours"], results["fixed_shard_hours"]))
+    print("throttled minutes:    {}".format(results["throttled_minutes"]))
+    print("throttled records:    {:.0f}".format(results["throttled_records"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
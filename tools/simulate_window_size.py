@@ -0,0 +1,205 @@
+"""
+Simulate the adaptive window size of the Glue ETL Job against a recorded or synthetic load curve.
+
+The simulation runs the micro-batches of the steady read profile: a micro-batch starts at every trigger of the window,
+or right after the previous one if it took longer, and reads the records which arrived before it, up to the fetch
+limit. It takes a fixed overhead plus the time of processing its records. Once a minute, the window size is decided
+like in the job, and every change costs a restart of the streaming queries. The same load is simulated with the static
+initial window size for comparison.
+
+The load is the per-minute IncomingRecords of a metric series recorded with tools/replay_shard_scaling.py, or the
+synthetic series of that tool.
+
+Usage:
+    python -m tools.simulate_window_size --synthetic-hours 24 --window-size "10 seconds"
+    python -m tools.simulate_window_size --metrics metrics.json --records-per-second 4000 --json
+"""
+import argparse
+import json
+import math
+import sys
+from collections import deque
+from collections import namedtuple
+from pathlib import Path
+
+from tools.replay_shard_scaling import load_metrics
+from tools.replay_shard_scaling import synthetic_metrics
+from adaptive_window import BatchObservation
+from adaptive_window import WindowChange
+from adaptive_window import WindowPolicy
+from adaptive_window import decide_window
+from adaptive_window import parse_window_size
+from adaptive_window import validate_window_policy
+from catch_up import LAG_CHECK_SECONDS
+from catch_up import MIN_PROFILE_SECONDS
+
+# The cost model of a micro-batch
+BatchCost = namedtuple("BatchCost", ["overhead_seconds", "records_per_second", "max_records_per_batch"])
+
+
+def weighted_percentile(histogram, fraction):
+    """The percentile of a histogram of whole seconds to record counts."""
+    total = sum(histogram.values())
+    seen = 0
+    for seconds in sorted(histogram):
+        seen += histogram[seconds]
+        if seen >= fraction * total:
+            return seconds
+    return 0
+
+
+def simulate(records_per_minute, window_seconds, cost, policy, adaptive, restart_seconds=30):
+    """Return the results of the micro-batches of the load, with the adaptive or the static window size."""
+    arrivals = [records / 60 for records in records_per_minute for _ in range(60)]
+    end = len(arrivals)
+    queue = deque()
+    enqueued = 0
+    latencies = {}
+    observations = []
+    events = []
+    batches = []
+    window_seconds_used = []
+
+    time = 0.0
+    queries_started = 0.0
+    next_check = LAG_CHECK_SECONDS
+    last_change = None
+    while time < end:
+        # The records which arrived before the micro-batch starts, per second of arrival
+        while enqueued < min(int(time), end):
+            queue.append([enqueued, arrivals[enqueued]])
+            enqueued += 1
+
+        budget = cost.max_records_per_batch
+        read = []
+        while queue and budget > 0:
+            records = min(queue[0][1], budget)
+            read.append((queue[0][0], records))
+            budget -= records
+            queue[0][1] -= records
+            if queue[0][1] <= 0:
+                queue.popleft()
+        records = sum(count for _, count in read)
+
+        # Triggers without records do not run a micro-batch
+        duration = cost.overhead_seconds + records / cost.records_per_second if records else 0.0
+        finished = time + duration
+        for arrived, count in read:
+            latency = int(finished - arrived - 0.5)
+            latencies[latency] = latencies.get(latency, 0) + count
+        observations.append(BatchObservation(duration, records))
+        if records:
+            batches.append(records)
+            window_seconds_used.append(window_seconds)
+
+        # Processing time triggers are aligned to the window since the start of the queries
+        next_trigger = max(finished, queries_started + math.floor((time - queries_started) / window_seconds + 1)
+                           * window_seconds)
+
+        if adaptive and finished >= next_check:
+            next_check = finished + LAG_CHECK_SECONDS
+            if finished - queries_started >= MIN_PROFILE_SECONDS:
+                lag_seconds = finished - queue[0][0] if queue else 0.0
+                decision = decide_window(observations, lag_seconds, window_seconds, policy, WindowChange(
+                    last_change[0], finished - last_change[1]) if last_change is not None else None)
+                if decision.window_seconds != window_seconds:
+                    last_change = (decision.window_seconds > window_seconds, finished)
+                    events.append({
+                        "minute": int(finished // 60),
+                        "from": window_seconds,
+                        "to": decision.window_seconds,
+                        "reason": decision.reason
+                    })
+                    window_seconds = decision.window_seconds
+                    queries_started = finished + restart_seconds
+                    next_trigger = queries_started
+                    observations = []
+
+        time = next_trigger
+
+    return {
+        "micro_batches": len(batches),
+        "records": sum(batches),
+        "unprocessed_records": sum(count for _, count in queue) + sum(arrivals[enqueued:]),
+        "mean_records_per_batch": sum(batches) / len(batches) if batches else 0.0,
+        "small_batches": sum(1 for records in batches if records < policy.min_records),
+        "latency_seconds": {
+            "p50": weighted_percentile(latencies, 0.5),
+            "p95": weighted_percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else 0
+        },
+        "window_seconds": {
+            "min": min(window_seconds_used, default=window_seconds),
+            "max": max(window_seconds_used, default=window_seconds)
+        },
+        "restarts": len(events),
+        "events": events
+    }
+
+
+def print_results(name, results):
+    print("{}:".format(name))
+    print("  micro-batches:        {} ({} below the min records)".format(
+        results["micro_batches"], results["small_batches"]))
+    print("  records per batch:    {:.0f}".format(results["mean_records_per_batch"]))
+    print("  latency [s]:          p50 {p50}, p95 {p95}, max {max}".format(**results["latency_seconds"]))
+    print("  window size [s]:      {min:.0f} to {max:.0f}".format(**results["window_seconds"]))
+    print("  restarts:             {}".format(results["restarts"]))
+    print("  unprocessed records:  {:.0f}".format(results["unprocessed_records"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--metrics", type=Path, help="A metric series recorded with tools.replay_shard_scaling")
+    parser.add_argument("--synthetic-hours", type=int, default=24, help="The hours of a synthetic series")
+    parser.add_argument("--window-size", default="10 seconds", help="The initial and static window size")
+    parser.add_argument("--min-window-size", default="5 seconds")
+    parser.add_argument("--max-window-size", default="120 seconds")
+    parser.add_argument("--target-utilization", type=float, default=0.6)
+    parser.add_argument("--min-records", type=int, default=5000)
+    parser.add_argument("--max-lag-seconds", type=float, default=30)
+    parser.add_argument("--min-change", type=float, default=0.25)
+    parser.add_argument("--cooldown-seconds", type=float, default=900)
+    parser.add_argument("--overhead-seconds", type=float, default=3.0,
+                        help="The time of a micro-batch without records, e.g. scheduling and committing")
+    parser.add_argument("--records-per-second", type=float, default=5000,
+                        help="The records a micro-batch processes per second")
+    parser.add_argument("--max-records-per-batch", type=float, default=100000,
+                        help="The fetch limit of a micro-batch, the records per shard times the shards")
+    parser.add_argument("--restart-seconds", type=float, default=30,
+                        help="The time of restarting the streaming queries with another window size")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    policy = validate_window_policy(WindowPolicy(
+        min_window_seconds=parse_window_size(args.min_window_size),
+        max_window_seconds=parse_window_size(args.max_window_size),
+        target_utilization=args.target_utilization,
+        min_records=args.min_records,
+        max_lag_seconds=args.max_lag_seconds,
+        min_change=args.min_change,
+        cooldown_seconds=args.cooldown_seconds
+    ))
+    cost = BatchCost(args.overhead_seconds, args.records_per_second, args.max_records_per_batch)
+    samples = load_metrics(args.metrics) if args.metrics else synthetic_metrics(args.synthetic_hours)
+    records_per_minute = [sample.incoming_records + sample.throttled_records for sample in samples]
+    window_seconds = parse_window_size(args.window_size)
+
+    results = {
+        "static": simulate(records_per_minute, window_seconds, cost, policy, False),
+        "adaptive": simulate(records_per_minute, window_seconds, cost, policy, True, args.restart_seconds)
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    for event in results["adaptive"]["events"]:
+        print("minute {:>5}: {:.0f} -> {} seconds ({})".format(
+            event["minute"], event["from"], event["to"], event["reason"]))
+    print_results("static window", results["static"])
+    print_results("adaptive window", results["adaptive"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
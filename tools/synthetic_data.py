@@ -0,0 +1,52 @@
+"""
+Synthetic TIC 4.0 messages derived from a sample message, used by the benchmark and verification tools.
+"""
+import datetime
+import json
+import random
+import uuid
+from pathlib import Path
+
+from tools import REPOSITORY_DIR
+
+DEFAULT_SAMPLE = Path(REPOSITORY_DIR, "docs", "sample_data", "sample_data.json")
+
+
+def load_sample(path=DEFAULT_SAMPLE):
+    return Path(path).read_text()
+
+
+def synthetic_messages(sample, count, che_per_message=1, start=None, interval_ms=100, seed=0):
+    """
+    Yield count messages as dicts. Every message gets a unique id and an increasing timestamp, carries che_per_message
+    copies of the first CHE object of the sample with distinct ids and jittered sensor values.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.datetime(2023, 2, 25, 14, 0, 0)
+
+    for i in range(count):
+        # Parsing the sample is faster than deep copying it
+        message = json.loads(sample)
+        message["msg"]["id"] = str(uuid.UUID(int=rng.getrandbits(128)))
+        message["msg"]["mid"] = i
+        message["msg"]["timestamp"] = (start + datetime.timedelta(milliseconds=i * interval_ms)).isoformat()
+
+        template = json.dumps(message["che"][0])
+        che_list = []
+        for number in range(che_per_message):
+            che = json.loads(template)
+            che["id"] = che["id"] + number
+            che["number"] = che["number"] + number
+            che["hoist"][0]["hoisting"]["height"][0]["value"] = round(rng.uniform(-10.0, 50.0), 2)
+            che["hoist"][0]["weight"]["gross"][0]["value"] = round(rng.uniform(0.0, 65.0), 3)
+            che["trolley"][0]["trolleying"]["reach"][0]["value"] = round(rng.uniform(-20.0, 120.0), 2)
+            che_list.append(che)
+        message["che"] = che_list
+
+        yield message
+
+
+def synthetic_records(sample, count, **kwargs):
+    """Yield the synthetic messages serialized as JSON strings, the way they are put into the Kinesis data stream."""
+    for message in synthetic_messages(sample, count, **kwargs):
+        yield json.dumps(message, separators=(",", ":"))
@@ -0,0 +1,243 @@
+"""
+Verify that the Lambda consumer produces the same output as the Glue ETL Job.
+
+Synthetic messages are put into a local stand-in for the Kinesis data stream, which hands them to the Lambda consumer
+as Kinesis event batches. The same records are run through the Spark transformation in local mode. Both outputs are
+written into temporary directories and compared row by row and partition by partition, the dead letters are compared
+by reason. Some messages get a timestamp with a zone offset or miss a required field, which both consumers must handle
+alike.
+
+Usage:
+    python -m tools.verify_lambda_consumer --messages 2000 --batch-size 500
+"""
+import argparse
+import base64
+import collections
+import datetime
+import json
+import math
+import sys
+import tempfile
+from pathlib import Path
+
+import pyarrow.fs
+from pyspark.sql import SparkSession
+from pyspark.sql.types import StructType
+
+from tools import CONFIG_DIR
+from tools.benchmark_transform import DEFAULT_REQUIRED_FIELDS
+from tools.benchmark_transform import KINESIS_SCHEMA
+from tools.synthetic_data import DEFAULT_SAMPLE
+from tools.synthetic_data import load_sample
+from tools.synthetic_data import synthetic_records
+import lambda_consumer
+import transforms
+from field_paths import load_selected_fields
+from field_paths import parse_field_path
+
+DEFAULT_SELECTED_FIELDS = Path(CONFIG_DIR, "kpis", "kpi_sample.json")
+DEFAULT_SCHEMA = Path(CONFIG_DIR, "schemas", "input_schema.json")
+
+# Zone offsets of the edge case timestamps. The synthetic messages start at 14:00, so +15:00 is the previous day in UTC
+ZONE_OFFSETS = ["+01:00", "-05:30", "+0200", "Z", "+15:00"]
+
+
+class LocalKinesisStream:
+    """Keeps the records put into it and replays them as the event batches a Lambda event source mapping delivers."""
+
+    def __init__(self, stream_name="local-stream"):
+        self.stream_name = stream_name
+        self.records = []
+
+    def put_record(self, data, partition_key):
+        sequence_number = str(len(self.records))
+        self.records.append({
+            "kinesis": {
+                "kinesisSchemaVersion": "1.0",
+                "partitionKey": partition_key,
+                "sequenceNumber": sequence_number,
+                "data": base64.b64encode(data).decode(),
+                "approximateArrivalTimestamp": 0
+            },
+            "eventSource": "aws:kinesis",
+            "eventName": "aws:kinesis:record",
+            "eventSourceARN": "arn:aws:kinesis:local:000000000000:stream/{}".format(self.stream_name)
+        })
+        return sequence_number
+
+    def events(self, batch_size):
+        for i in range(0, len(self.records), batch_size):
+            yield {"Records": self.records[i:i + batch_size]}
+
+
+def drop_field(message, steps):
+    """Remove a field path from a message, a list index drops the list from that index on."""
+    container = message
+    for step in steps[:-1]:
+        try:
+            container = container[step]
+        except (KeyError, IndexError, TypeError):
+            return
+    if isinstance(steps[-1], int):
+        del container[steps[-1]:]
+    else:
+        container.pop(steps[-1], None)
+
+
+def add_edge_cases(records, every, required_fields):
+    """
+    Give every nth message a timestamp with a zone offset, and remove one of the required fields, in turn, from the
+    message after it.
+    """
+    for i, record in enumerate(records):
+        if i % every not in (0, 1):
+            yield record
+            continue
+        message = json.loads(record)
+        case = i // every
+        if i % every == 0:
+            message["msg"]["timestamp"] += ZONE_OFFSETS[case % len(ZONE_OFFSETS)]
+        elif required_fields:
+            drop_field(message, parse_field_path(required_fields[case % len(required_fields)]))
+        yield json.dumps(message, separators=(",", ":"))
+
+
+def row_order(row):
+    # Floats are left out, so rounding differences between both outputs do not change the order of the rows
+    return sorted((column, str(value)) for column, value in row.items() if not isinstance(value, float))
+
+
+def read_output(output_dir):
+    """Read the written JSON lines per partition, keyed by msg_id. Messages exploded by [*] have several rows."""
+    partitions = {}
+    for path in Path(output_dir).glob("event_date=*/event_hour=*/*.json"):
+        partition = path.parent.relative_to(output_dir).as_posix()
+        rows = partitions.setdefault(partition, {})
+        for line in path.read_text().splitlines():
+            if line:
+                row = json.loads(line)
+                rows.setdefault(row["msg_id"], []).append(row)
+    for rows in partitions.values():
+        for msg_rows in rows.values():
+            msg_rows.sort(key=row_order)
+    return partitions
+
+
+def compare_rows(expected, actual, tolerance):
+    differences = []
+    for column in sorted(set(expected) | set(actual)):
+        left, right = expected.get(column), actual.get(column)
+        if isinstance(left, float) or isinstance(right, float):
+            if left is None or right is None or not math.isclose(left, right, rel_tol=tolerance):
+                differences.append((column, left, right))
+        elif left != right:
+            differences.append((column, left, right))
+    return differences
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500, help="The batch size of the event source mapping")
+    parser.add_argument("--che-per-message", type=int, default=1)
+    parser.add_argument("--sample", type=Path, default=DEFAULT_SAMPLE)
+    parser.add_argument("--selected-fields", type=Path, default=DEFAULT_SELECTED_FIELDS)
+    parser.add_argument("--schema", type=Path, default=DEFAULT_SCHEMA)
+    parser.add_argument("--required-fields", default=json.dumps(DEFAULT_REQUIRED_FIELDS),
+                        help="The JSON list of job-required-fields")
+    parser.add_argument("--edge-case-every", type=int, default=10,
+                        help="Every nth message has a zone offset, the message after it misses a required field")
+    parser.add_argument("--tolerance", type=float, default=1e-9)
+    args = parser.parse_args(argv)
+
+    schema = json.loads(args.schema.read_text())
+    selected_fields = load_selected_fields(json.loads(args.selected_fields.read_text()))
+    required_fields = json.loads(args.required_fields)
+    records = list(add_edge_cases(
+        synthetic_records(load_sample(args.sample), args.messages, che_per_message=args.che_per_message),
+        args.edge_case_every,
+        required_fields
+    ))
+
+    stream = LocalKinesisStream()
+    for i, record in enumerate(records):
+        # Messages missing their id are put with their position
+        stream.put_record(record.encode(), partition_key=json.loads(record)["msg"].get("id") or str(i))
+
+    with tempfile.TemporaryDirectory() as lambda_dir, tempfile.TemporaryDirectory() as spark_dir:
+        # Lambda consumer
+        arrow_schema = lambda_consumer.to_arrow_schema(schema)
+        compiled_fields = lambda_consumer.compile_required_fields(required_fields)
+        filesystem = pyarrow.fs.LocalFileSystem()
+        lambda_reasons = collections.Counter()
+        for event in stream.events(args.batch_size):
+            payloads, _ = lambda_consumer.decode_event(event)
+            table, dead_letters = lambda_consumer.process_records(
+                payloads, selected_fields, arrow_schema, compiled_fields)
+            lambda_reasons.update(reason for reason, _ in dead_letters)
+            if table is not None:
+                lambda_consumer.write_output(table, lambda_dir, "json", "none", filesystem)
+
+        # Glue ETL Job transformation
+        spark = SparkSession.builder \
+            .master("local[*]") \
+            .config("spark.ui.enabled", "false") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .getOrCreate()
+        arrival_time = datetime.datetime.utcnow()
+        rows = [(bytearray(record.encode()), str(i), str(i), arrival_time) for i, record in enumerate(records)]
+        data_frame = transforms.decode_records(
+            spark.createDataFrame(rows, KINESIS_SCHEMA), StructType.fromJson(schema), "json")
+        dead_letters = transforms.compile_dead_letters(required_fields, str(Path(spark_dir, "dead-letter")))
+        spark_reasons = collections.Counter({
+            row["reason"]: row["count"]
+            for row in data_frame.where(dead_letters.reason.isNotNull()).groupBy(dead_letters.reason.alias("reason"))
+            .count().collect()
+        })
+        transforms.process_batch(
+            transforms.valid_records(data_frame, dead_letters),
+            transforms.compile_projection(selected_fields),
+            spark_dir,
+            "json",
+            "none"
+        )
+        spark.stop()
+
+        expected = read_output(spark_dir)
+        actual = read_output(lambda_dir)
+
+    failures = 0
+    for reason in sorted(set(spark_reasons) | set(lambda_reasons)):
+        if spark_reasons[reason] != lambda_reasons[reason]:
+            failures += 1
+            print("{}: {} dead letters from Spark, {} dead letters from Lambda".format(
+                reason, spark_reasons[reason], lambda_reasons[reason]))
+    for partition in sorted(set(expected) | set(actual)):
+        expected_rows, actual_rows = expected.get(partition, {}), actual.get(partition, {})
+        if set(expected_rows) != set(actual_rows):
+            failures += 1
+            print("{}: {} rows from Spark, {} rows from Lambda".format(
+                partition, len(expected_rows), len(actual_rows)))
+            continue
+        for msg_id, msg_rows in expected_rows.items():
+            if len(msg_rows) != len(actual_rows[msg_id]):
+                failures += 1
+                print("{} {}: {} rows from Spark, {} rows from Lambda".format(
+                    partition, msg_id, len(msg_rows), len(actual_rows[msg_id])))
+                continue
+            for row, actual_row in zip(msg_rows, actual_rows[msg_id]):
+                for column, left, right in compare_rows(row, actual_row, args.tolerance):
+                    failures += 1
+                    print("{} {} {}: Spark {!r}, Lambda {!r}".format(partition, msg_id, column, left, right))
+
+    rows = sum(len(msg_rows) for rows in expected.values() for msg_rows in rows.values())
+    if failures:
+        print("Lambda consumer output differs from the Spark output in {} places".format(failures))
+        return 1
+    print("Lambda consumer output matches the Spark output ({} rows in {} partitions, {} dead letters)".format(
+        rows, len(expected), sum(spark_reasons.values())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())